@@ -0,0 +1,114 @@
+"""Receive path allocation benchmark for pyvisonic.
+
+  Feeds an EPROM download (0x3F and 0x33 PDUs) and A5 status messages through
+  VisonicProtocol.data_received with the message decoders active (and the ACKs sent
+  back) and uses tracemalloc to measure the memory retained while doing it.
+
+  It then feeds the frames one at a time and reports what each frame allocates: the
+  memory blocks it leaves allocated (sys.getallocatedblocks before and after the frame)
+  and the most memory it has allocated at once while it is decoded (the tracemalloc peak).
+
+  Run from the repository root:
+      python benchmarks/bench_allocations.py
+"""
+
+import os
+import gc
+import sys
+import asyncio
+import logging
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pyvisonic
+from bench_framing import NullTransport, make_stream, stop_loop, CHUNK_SIZE
+
+ROUNDS = 5
+
+
+def measure():
+    """ Return the results as a dictionary """
+    pyvisonic.log.setLevel(logging.WARNING)
+    loop = asyncio.new_event_loop()
+    pdus, stream = make_stream()
+    chunks = [stream[i : i + CHUNK_SIZE] for i in range(0, len(stream), CHUNK_SIZE)]
+
+    protocol = pyvisonic.VisonicProtocol(loop=loop)
+    protocol.transport = NullTransport()
+    protocol.coordinating_powerlink = False
+
+    # the first pass creates the EPROM pages
+    for chunk in chunks:
+        protocol.data_received(chunk)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for r in range(0, ROUNDS):
+        for chunk in chunks:
+            protocol.data_received(chunk)
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    frames = len(pdus) * ROUNDS
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'lineno') if stat.count_diff > 0)
+    results = {
+        "frames" : frames,
+        "peak_bytes" : peak - base,
+        "retained_bytes_per_frame" : (current - base) / frames,
+        "retained_blocks_per_frame" : blocks / frames
+    }
+    results.update(measure_frames(protocol, pdus))
+    stop_loop(loop)
+    return results
+
+
+def measure_frames(protocol, pdus):
+    """ Feed the frames one at a time and measure the allocations made by each of them """
+    # the garbage collector would free memory part way through a frame
+    gc.disable()
+    try:
+        # getallocatedblocks is counted without tracemalloc running, as tracemalloc allocates memory for each block that it traces
+        blocks = []
+        for r in range(0, ROUNDS):
+            for pdu in pdus:
+                start = sys.getallocatedblocks()
+                protocol.data_received(pdu)
+                blocks.append(sys.getallocatedblocks() - start)
+
+        peaks = []
+        tracemalloc.start()
+        for r in range(0, ROUNDS):
+            for pdu in pdus:
+                start, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                protocol.data_received(pdu)
+                _, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - start)
+        tracemalloc.stop()
+    finally:
+        gc.enable()
+    return {
+        "allocated_blocks_per_frame" : sum(blocks) / len(blocks),
+        "max_allocated_blocks_per_frame" : max(blocks),
+        "peak_bytes_per_frame" : sum(peaks) / len(peaks),
+        "max_peak_bytes_per_frame" : max(peaks)
+    }
+
+
+def run():
+    results = measure()
+    print("allocations: {0} frames decoded".format(results["frames"]))
+    print("    {0:10d} bytes peak above the starting point".format(results["peak_bytes"]))
+    print("    {0:10.2f} bytes retained per frame".format(results["retained_bytes_per_frame"]))
+    print("    {0:10.3f} memory blocks retained per frame".format(results["retained_blocks_per_frame"]))
+    print("  frame by frame:")
+    print("    {0:10.2f} memory blocks allocated per frame that are not freed by the end of it (at most {1})".format(results["allocated_blocks_per_frame"], results["max_allocated_blocks_per_frame"]))
+    print("    {0:10.1f} bytes allocated per frame at the most at once (at most {1})".format(results["peak_bytes_per_frame"], results["max_peak_bytes_per_frame"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
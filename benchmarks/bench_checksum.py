@@ -0,0 +1,98 @@
+"""Checksum benchmark for pyvisonic.
+
+  The worst case for the receive framer is a message of unknown length (like 0xB0) that
+  has a lot of 0x0A bytes in its data, each 0x0A could be the end of the PDU so the
+  checksum is checked for each one. This reports the time to frame one of these PDUs
+  against its length, with a running checksum the time should grow linearly.
+
+  It also reports the time to encode and send a command with pmSendPdu, both with options
+  (MSG_ARM) and without (MSG_STATUS, which is sent from a frame built once).
+
+  Run from the repository root:
+      python benchmarks/bench_checksum.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_framing import make_pdu, new_protocol, stop_loop
+
+import pyvisonic
+
+LENGTHS = [0x10, 0x20, 0x40, 0x80, 0xB0]
+FRAMES = 200
+ROUNDS = 10
+SENDS = 20000
+
+
+def make_b0_pdu(length):
+    """ A 0xB0 PDU of length bytes where all the data bytes are 0x0A, the checksum is made to not be 0x0A """
+    data = bytearray(b'\xB0' + b'\x0A' * (length - 4))
+    if make_pdu(data)[-2] == 0x0A:
+        data[-1] = 0x0B
+    return make_pdu(data)
+
+
+def time_framing(protocol, pdu):
+    stream = pdu * FRAMES
+    best = None
+    for r in range(0, ROUNDS):
+        protocol.receive_log = []
+        start = time.perf_counter()
+        protocol.data_received(stream)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    if len(protocol.receive_log) != FRAMES or bytes(protocol.receive_log[0]) != pdu:
+        return None
+    return best / FRAMES
+
+
+def time_sending(protocol, message_type, options):
+    start = time.perf_counter()
+    for i in range(0, SENDS):
+        protocol.pmSendPdu(pyvisonic.VisonicListEntry(command = pyvisonic.pmSendMsg[message_type], options = options))
+    return (time.perf_counter() - start) / SENDS
+
+
+def measure():
+    """ Return the results as a dictionary """
+    pyvisonic.log.setLevel(logging.WARNING)
+    loop = asyncio.new_event_loop()
+    protocol = new_protocol(loop)
+
+    framing = {}
+    for length in LENGTHS:
+        per_frame = time_framing(protocol, make_b0_pdu(length))
+        if per_frame is None:
+            raise RuntimeError("the framer did not return the expected PDUs")
+        framing[str(length)] = per_frame * 1e6
+    send = time_sending(protocol, "MSG_ARM", [3, bytearray([0x05]), 4, bytearray.fromhex('12 34')]) * 1e6
+    send_cached = time_sending(protocol, "MSG_STATUS", None) * 1e6
+
+    stop_loop(loop)
+    return {
+        "b0_framing_usec_per_frame" : framing,
+        "send_usec_per_command" : send,
+        "send_cached_usec_per_command" : send_cached
+    }
+
+
+def run():
+    results = measure()
+    print("framing 0xB0 PDUs full of 0x0A bytes")
+    print("    {0:>6}  {1:>12}  {2:>12}".format("length", "usec/frame", "nsec/byte"))
+    for length, per_frame in results["b0_framing_usec_per_frame"].items():
+        print("    {0:>6}  {1:12.2f}  {2:12.1f}".format(length, per_frame, per_frame * 1e3 / int(length)))
+    print("sending MSG_ARM with options")
+    print("    {0:12.2f} usec/command".format(results["send_usec_per_command"]))
+    print("sending MSG_STATUS without options")
+    print("    {0:12.2f} usec/command".format(results["send_cached_usec_per_command"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,121 @@
+"""Message decoding benchmark for pyvisonic.
+
+  Reports the cost of the message decoders (A5 zone event and zone status, the PowerMaster
+  B0 zone bitmask, A7, 3F and 33) called through the message table with the data the framer
+  gives them, of ProcessSettings on a full EPROM image and of GetSensor.
+
+  Run from the repository root:
+      python benchmarks/bench_decode.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_framing import NullTransport, stop_loop
+
+import pyvisonic
+import simulator
+
+CALLS = 20000
+SETTINGS_ROUNDS = 50
+ZONES = 30
+
+# The message bodies (without the header, checksum and footer) for each decoder, they are given to it in turn
+#    The zone bitmasks alternate between two bodies so that each call changes a zone, with the same body every time nothing would change
+MESSAGES = {
+    "A5" : (bytes.fromhex('A5 00 04 00 61 03 05 00 05 00 00 43'),),        # zone event
+    "A5 02" : (bytes.fromhex('A5 00 02 08 00 00 00 00 00 00 00 43'),       # zone status and low battery bitmasks, zone 4 open
+               bytes.fromhex('A5 00 02 00 00 00 00 00 00 00 00 43')),      #    and closed
+    "B0 18" : (bytes.fromhex('B0 03 18 0C FF 08 0B 08 08 00 00 00 00 00 00 80 43'),   # PowerMaster 64 zone open/close bitmask, zones 4 and 64 open
+               bytes.fromhex('B0 03 18 0C FF 08 0B 08 00 00 00 00 00 00 00 00 43')),  #    and closed
+    "A7" : (bytes.fromhex('A7 01 00 03 03 00 00 00 00 00 00 43'),),        # zone 3 alarm
+    "33" : (bytes.fromhex('33 08 09 01 02 05 21 01 02 06 32'),),           # 8 settings bytes
+    "3F" : (bytes([0x3F, 0x00, 0x19, 0xB0]) + bytes(i & 0xFF for i in range(0xB0)),)
+}
+
+
+def new_protocol(loop):
+    # the B0 zone bitmasks are only decoded when this is set, the protocol reads it when it is made so it is put back straight away
+    setting = pyvisonic.PanelSettings["PowerMasterZoneMasks"]
+    pyvisonic.PanelSettings["PowerMasterZoneMasks"] = True
+    try:
+        protocol = pyvisonic.VisonicProtocol(loop=loop)
+    finally:
+        pyvisonic.PanelSettings["PowerMasterZoneMasks"] = setting
+    protocol.transport = NullTransport()
+    protocol.coordinating_powerlink = False
+    return protocol
+
+
+def write_eprom(protocol):
+    """ Write a full EPROM image for a PowerMax Pro in powerlink, with ZONES zones enrolled, in to the protocol """
+    protocol.pmPowerlinkMode = True
+    image = simulator.make_eprom(zones = ZONES)
+    # pmWriteSettings takes at most 0xB1 bytes at a time, write half a page at a time
+    for address in range(0, len(image), 0x80):
+        protocol.pmWriteSettings(address >> 8, address & 0xFF, image[address : address + 0x80])
+
+
+def time_calls(func, calls):
+    start = time.perf_counter()
+    for i in range(0, calls):
+        func()
+    return (time.perf_counter() - start) / calls
+
+
+def time_handler(protocol, bodies, calls):
+    """ Call the decoder for the message bodies in turn, return the time per call """
+    handler = protocol.pmMessageTable_t[bodies[0][0]].handler
+    data = [memoryview(body[1:]).toreadonly() for body in bodies]
+    rounds = calls // len(data)
+    start = time.perf_counter()
+    for i in range(0, rounds):
+        for d in data:
+            handler(protocol, d)
+    return (time.perf_counter() - start) / (rounds * len(data))
+
+
+def measure():
+    """ Return the results as a dictionary """
+    pyvisonic.log.setLevel(logging.WARNING)
+    loop = asyncio.new_event_loop()
+    protocol = new_protocol(loop)
+
+    write_eprom(protocol)
+    settings = time_calls(protocol.ProcessSettings, SETTINGS_ROUNDS) * 1e3
+    if len(protocol.pmSensorDev_t) != ZONES:
+        raise RuntimeError("ProcessSettings found {0} zones, expected {1}".format(len(protocol.pmSensorDev_t), ZONES))
+
+    # the decoders are timed with the sensors there, so that a change to a zone updates its sensor
+    handlers = {}
+    for name, bodies in MESSAGES.items():
+        handlers[name] = time_handler(protocol, bodies, CALLS) * 1e6
+
+    get_sensor = time_calls(lambda: protocol.GetSensor(0), CALLS) * 1e6
+
+    stop_loop(loop)
+    return {
+        "handler_usec_per_call" : handlers,
+        "process_settings_msec" : settings,
+        "get_sensor_usec" : get_sensor
+    }
+
+
+def run():
+    results = measure()
+    print("message decoders")
+    for name, per_call in results["handler_usec_per_call"].items():
+        print("    handle_msgtype{0:<5} {1:10.2f} usec/call".format(name, per_call))
+    print("ProcessSettings with {0} zones".format(ZONES))
+    print("    {0:10.2f} msec".format(results["process_settings_msec"]))
+    print("GetSensor")
+    print("    {0:10.2f} usec".format(results["get_sensor_usec"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
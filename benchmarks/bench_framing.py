@@ -0,0 +1,131 @@
+"""Receive framing benchmark for pyvisonic.
+
+  Feeds a stream of PDUs, like the ones the panel sends during an EPROM download, to
+  VisonicProtocol.data_received in chunks, and to handle_received_byte a byte at a time,
+  and reports bytes/sec and frames/sec.
+
+  Run from the repository root:
+      python benchmarks/bench_framing.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pyvisonic
+
+CHUNK_SIZE = 64      # bytes per data_received call, a typical serial/tcp read
+ROUNDS = 20
+BYTE_ROUNDS = 3
+
+
+class NullTransport:
+    def write(self, data):
+        pass
+
+
+def make_pdu(body):
+    """ Add header, checksum and footer to a message """
+    checksum = 0xFF - (sum(body) % 0xFF)
+    if checksum == 0xFF:
+        checksum = 0x00
+    return bytes([0x0D]) + bytes(body) + bytes([checksum, 0x0A])
+
+
+def make_stream():
+    """ 0x3F download blocks (full of 0x0A bytes) and 0x33 settings mixed with A5 status messages """
+    pdus = []
+    for page in range(0, 32):
+        for index in range(0, 0x100, 0xB0):
+            length = min(0xB0, 0x100 - index)
+            data = bytes(((page + index + i) * 7) & 0xFF if i % 5 else 0x0A for i in range(length))
+            pdus.append(make_pdu(bytes([0x3F, index, page, length]) + data))
+        for index in range(0, 0x100, 8):
+            pdus.append(make_pdu(bytes([0x33, index, page]) + bytes(range(index, index + 8))))
+        pdus.append(make_pdu(bytes.fromhex('A5 00 02 00 00 00 00 00 00 00 00 43')))
+        pdus.append(make_pdu(bytes.fromhex('A5 00 04 00 61 03 05 00 05 00 00 43')))
+    return pdus, b''.join(pdus)
+
+
+def new_protocol(loop):
+    protocol = pyvisonic.VisonicProtocol(loop=loop)
+    protocol.transport = NullTransport()
+    # collect the PDUs in receive_log rather than decoding them, this measures the framing only
+    protocol.coordinating_powerlink = True
+    return protocol
+
+
+def stop_loop(loop):
+    """ Stop the protocol timers that were started and close the loop """
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    if len(tasks) > 0:
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+
+
+def best_time(protocol, rounds, feed):
+    best = None
+    for r in range(0, rounds):
+        protocol.receive_log = []
+        start = time.perf_counter()
+        feed()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure():
+    """ Return the results as a dictionary """
+    pyvisonic.log.setLevel(logging.WARNING)
+    loop = asyncio.new_event_loop()
+    pdus, stream = make_stream()
+    chunks = [stream[i : i + CHUNK_SIZE] for i in range(0, len(stream), CHUNK_SIZE)]
+    protocol = new_protocol(loop)
+
+    def feed_chunks():
+        for chunk in chunks:
+            protocol.data_received(chunk)
+
+    def feed_bytes():
+        for b in stream:
+            protocol.handle_received_byte(b)
+
+    feed_chunks()
+    if [bytes(p) for p in protocol.receive_log] != pdus:
+        raise RuntimeError("the framer did not return the expected PDUs")
+    chunk_time = best_time(protocol, ROUNDS, feed_chunks)
+    byte_time = best_time(protocol, BYTE_ROUNDS, feed_bytes)
+    if [bytes(p) for p in protocol.receive_log] != pdus:
+        raise RuntimeError("the framer did not return the expected PDUs a byte at a time")
+
+    stop_loop(loop)
+    return {
+        "stream_bytes" : len(stream),
+        "stream_frames" : len(pdus),
+        "chunk_size" : CHUNK_SIZE,
+        "data_received_bytes_per_sec" : len(stream) / chunk_time,
+        "data_received_frames_per_sec" : len(pdus) / chunk_time,
+        "handle_received_byte_bytes_per_sec" : len(stream) / byte_time,
+        "handle_received_byte_frames_per_sec" : len(pdus) / byte_time
+    }
+
+
+def run():
+    results = measure()
+    print("framing: {0} bytes  {1} frames".format(results["stream_bytes"], results["stream_frames"]))
+    print("  data_received in chunks of {0} bytes".format(results["chunk_size"]))
+    print("    {0:12.0f} bytes/sec".format(results["data_received_bytes_per_sec"]))
+    print("    {0:12.0f} frames/sec".format(results["data_received_frames_per_sec"]))
+    print("  handle_received_byte")
+    print("    {0:12.0f} bytes/sec".format(results["handle_received_byte_bytes_per_sec"]))
+    print("    {0:12.0f} frames/sec".format(results["handle_received_byte_frames_per_sec"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,109 @@
+"""Resynchronisation benchmark for pyvisonic.
+
+  Feeds a stream of PDUs, with a byte corrupted in some of them, to VisonicProtocol.data_received
+  and reports how many of the good PDUs were recovered, how many received bytes were discarded
+  and how long it took to get back in step with the panel.
+
+  Run from the repository root:
+      python benchmarks/bench_resync.py
+"""
+
+import os
+import sys
+import random
+import asyncio
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_framing import make_pdu, new_protocol, stop_loop
+
+import pyvisonic
+
+FRAMES = 5000
+CORRUPT = 0.05       # the fraction of PDUs with a corrupted byte
+CHUNK_SIZE = 32
+BAUD = 9600          # to show the bytes discarded per resync as time on the serial line
+SEED = 1
+
+
+def make_frames(rnd):
+    """ A mix of status, event, ack and 0xB0 messages, each is different so that they can be counted """
+    frames = []
+    for i in range(0, FRAMES):
+        seq = [i & 0xFF, i >> 8]
+        kind = rnd.random()
+        if kind < 0.4:
+            body = bytes([0xA5, 0x00] + seq + [rnd.randint(0, 255) for n in range(0, 7)] + [0x43])
+        elif kind < 0.6:
+            body = bytes([0xA7] + seq + [rnd.randint(0, 255) for n in range(0, 8)] + [0x43])
+        elif kind < 0.8:
+            body = bytes([0x02, 0x43])
+        else:
+            body = bytes([0xB0, 0x03, 0x24] + seq + [rnd.choice([0x0A, 0x0D, rnd.randint(0, 255)]) for n in range(0, rnd.randint(4, 40))] + [0x43])
+        frames.append(make_pdu(body))
+    return frames
+
+
+def make_stream(rnd, frames):
+    """ Corrupt a byte in some of the frames, return the stream and the frames that were sent intact """
+    stream = bytearray()
+    intact = []
+    for frame in frames:
+        frame = bytearray(frame)
+        if rnd.random() < CORRUPT:
+            pos = rnd.randrange(len(frame))
+            frame[pos] = frame[pos] ^ rnd.randint(1, 255)
+        else:
+            intact.append(bytes(frame))
+        stream += frame
+    return bytes(stream), intact
+
+
+def measure():
+    """ Return the results as a dictionary """
+    pyvisonic.log.setLevel(logging.CRITICAL)
+    rnd = random.Random(SEED)
+    loop = asyncio.new_event_loop()
+    frames = make_frames(rnd)
+    stream, intact = make_stream(rnd, frames)
+
+    protocol = new_protocol(loop)
+    protocol.receive_log = []
+    for i in range(0, len(stream), CHUNK_SIZE):
+        protocol.data_received(stream[i : i + CHUNK_SIZE])
+
+    wanted = set(intact)
+    received = [bytes(p) for p in protocol.receive_log]
+    recovered = sum(1 for p in received if p in wanted)
+
+    stop_loop(loop)
+    return {
+        "frames" : len(frames),
+        "corrupted" : len(frames) - len(intact),
+        "stream_bytes" : len(stream),
+        "chunk_size" : CHUNK_SIZE,
+        "recovered" : recovered,
+        "recovered_percent" : 100.0 * recovered / len(intact),
+        "lost" : len(intact) - recovered,
+        "bogus" : len(received) - recovered,
+        "resyncs" : protocol.pmResyncCount,
+        "discarded_bytes" : protocol.pmDiscardedBytes
+    }
+
+
+def run():
+    results = measure()
+    print("resync: {0} frames, {1} with a corrupted byte, {2} bytes in chunks of {3} bytes".format(results["frames"], results["corrupted"], results["stream_bytes"], results["chunk_size"]))
+    print("    {0:8} intact frames recovered ({1:.1f}%)".format(results["recovered"], results["recovered_percent"]))
+    print("    {0:8} intact frames lost".format(results["lost"]))
+    print("    {0:8} PDUs framed that were not sent intact (the checksum is a single byte)".format(results["bogus"]))
+    print("    {0:8} resyncs".format(results["resyncs"]))
+    print("    {0:8} bytes discarded".format(results["discarded_bytes"]))
+    if results["resyncs"] > 0:
+        per_resync = results["discarded_bytes"] / results["resyncs"]
+        print("    {0:8.1f} bytes discarded per resync, {1:.1f} ms at {2} baud".format(per_resync, 1000.0 * 10 * per_resync / BAUD, BAUD))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,132 @@
+"""Sensor read and update benchmark for pyvisonic.
+
+  Reports the cost of reading a sensor with GetSensor, with GetSensorSnapshot and with
+  copy.deepcopy (what GetSensor used to do), of comparing two sensors and two snapshots,
+  of an A5 zone status message that opens or closes a door with a change handler on each
+  of ZONES sensors that reads the sensor that changed, and the memory of a sensor and of
+  a snapshot.
+
+  Run from the repository root:
+      python benchmarks/bench_sensors.py
+"""
+
+import os
+import sys
+import copy
+import time
+import asyncio
+import logging
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_framing import NullTransport, stop_loop
+
+import pyvisonic
+
+CALLS = 20000
+EVENTS = 5000
+ZONES = 64          # a PowerMaster 30
+MEMORY_SENSORS = 1000
+
+
+def new_sensor(i):
+    return pyvisonic.SensorDevice(stype = "Magnet", sid = 0x2A, ztype = 5, ztypeName = "Perimeter", zname = "Front door",
+                                  zchime = "Off", dname = "Z{0:0>2}".format(i + 1), partition = [1], id = i + 1, enrolled = True)
+
+
+def new_protocol(loop):
+    protocol = pyvisonic.VisonicProtocol(loop=loop)
+    protocol.transport = NullTransport()
+    protocol.coordinating_powerlink = False
+    for i in range(0, ZONES):
+        protocol.pmSensorDev_t[i] = new_sensor(i)
+    return protocol
+
+
+def time_calls(func, calls):
+    start = time.perf_counter()
+    for i in range(0, calls):
+        func()
+    return (time.perf_counter() - start) / calls
+
+
+def memory_per_object(make):
+    """ The memory, in bytes, of each of the objects that make returns """
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    objects = [make(i) for i in range(0, MEMORY_SENSORS)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # take off the list that holds them
+    return (current - base - sys.getsizeof(objects)) / len(objects)
+
+
+def time_events(protocol, read):
+    """ A5 zone status messages that open and close the door in zone 4, every sensor has a change handler that calls read """
+    for key, sensor in protocol.pmSensorDev_t.items():
+        sensor.install_change_handler(lambda change, key = key: read(key), changes = True)
+    handler = protocol.pmMessageTable_t[0xA5].handler
+    messages = [memoryview(bytes.fromhex(m)).toreadonly() for m in ('00 02 08 00 00 00 00 00 00 00 00 43', '00 02 00 00 00 00 00 00 00 00 00 43')]
+    handler(protocol, messages[1])
+    start = time.perf_counter()
+    for i in range(0, EVENTS):
+        handler(protocol, messages[i & 1])
+    return (time.perf_counter() - start) / EVENTS
+
+
+def measure():
+    """ Return the results as a dictionary """
+    pyvisonic.log.setLevel(logging.WARNING)
+    loop = asyncio.new_event_loop()
+    protocol = new_protocol(loop)
+    sensor = protocol.pmSensorDev_t[3]
+    other = new_sensor(3)
+    snapshot = sensor.snapshot()
+    other_snapshot = other.snapshot()
+
+    read = {
+        "GetSensor" : time_calls(lambda: protocol.GetSensor(3), CALLS) * 1e6,
+        "GetSensorSnapshot" : time_calls(lambda: protocol.GetSensorSnapshot(3), CALLS) * 1e6,
+        "deepcopy" : time_calls(lambda: copy.deepcopy(sensor), CALLS) * 1e6
+    }
+    compare = {
+        "sensor" : time_calls(lambda: sensor == other, CALLS) * 1e6,
+        "snapshot" : time_calls(lambda: snapshot == other_snapshot, CALLS) * 1e6
+    }
+    event = {
+        "GetSensor" : time_events(protocol, protocol.GetSensor) * 1e6,
+        "GetSensorSnapshot" : time_events(protocol, protocol.GetSensorSnapshot) * 1e6
+    }
+    memory = {
+        "sensor" : memory_per_object(new_sensor),
+        "snapshot" : memory_per_object(lambda i: new_sensor(i).snapshot())
+    }
+    stop_loop(loop)
+    return {
+        "zones" : ZONES,
+        "read_usec" : read,
+        "compare_usec" : compare,
+        "event_usec" : event,
+        "bytes_per_object" : memory
+    }
+
+
+def run():
+    results = measure()
+    print("read a sensor")
+    for name, per_call in results["read_usec"].items():
+        print("    {0:<18} {1:10.2f} usec".format(name, per_call))
+    print("compare two")
+    for name, per_call in results["compare_usec"].items():
+        print("    {0:<18} {1:10.2f} usec".format(name, per_call))
+    print("A5 zone status door open/close with {0} sensors, the change handler reads the sensor with".format(results["zones"]))
+    for name, per_call in results["event_usec"].items():
+        print("    {0:<18} {1:10.2f} usec/event".format(name, per_call))
+    print("memory")
+    for name, size in results["bytes_per_object"].items():
+        print("    {0:<18} {1:10.0f} bytes".format(name, size))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
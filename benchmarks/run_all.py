@@ -0,0 +1,140 @@
+"""Run all of the pyvisonic benchmarks and write the results as JSON.
+
+  The JSON has the pyvisonic and python versions, the time of the run and the results of each
+  benchmark so that the results can be compared between releases.
+
+  Run from the repository root:
+      python benchmarks/run_all.py                              all benchmarks, JSON to stdout
+      python benchmarks/run_all.py --output results.json        JSON to a file
+      python benchmarks/run_all.py framing decode               just the named benchmarks
+      python benchmarks/run_all.py --replay mylog.txt           also replay a debug log as fast as possible
+      python benchmarks/run_all.py --compare results.json       exit with 1 if a result is more than --tolerance worse than in
+                                                                an earlier run on the same machine
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import contextlib
+import importlib
+import platform
+
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import replay
+
+# The benchmarks are the bench_<name>.py modules, each has a measure() that returns a dictionary of results
+BENCHMARKS = ["framing", "decode", "checksum", "resync", "allocations", "sensors"]
+
+# The results that --compare checks, the first of these that is in the name of a result says whether more is better (True) or worse (False)
+#    Anything else (counts, sizes of the test data and so on) is not checked
+REGRESSION_METRICS = (("per_sec", True), ("recovered_percent", True), ("usec", False), ("msec", False), ("bytes_per_object", False), ("peak_bytes", False))
+
+# How much worse (as a fraction) a result can be than in the earlier run before --compare says that it has regressed
+#    The timings vary from run to run, by more than this on a busy or virtual machine, use a larger --tolerance there
+DEFAULT_TOLERANCE = 0.3
+
+
+def measure_replay(pyvisonic, frames):
+    """ Replay the received frames from a debug log as fast as possible """
+    inbound = sum(1 for frame in frames if frame.inbound)
+    pyvisonic.log.setLevel(logging.WARNING)
+    protocol, elapsed = replay.replay(pyvisonic, frames)
+    return {
+        "frames" : inbound,
+        "seconds" : elapsed,
+        "frames_per_sec" : inbound / elapsed
+    }
+
+
+def leaves(results, path = ()):
+    """ Yield the name (e.g. "framing/data_received_frames_per_sec") and value of each result """
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from leaves(value, path + (key,))
+        else:
+            yield "/".join(path + (key,)), value
+
+
+def compare(results, baseline, tolerance):
+    """ Return a line for each result that is more than tolerance worse than it was in baseline """
+    old = dict(leaves(baseline["benchmarks"]))
+    regressions = []
+    for name, value in leaves(results["benchmarks"]):
+        better = next((more for metric, more in REGRESSION_METRICS if metric in name), None)
+        was = old.get(name)
+        if better is None or not isinstance(value, (int, float)) or not isinstance(was, (int, float)) or was == 0:
+            continue
+        change = (value - was) / was
+        if (change < -tolerance) if better else (change > tolerance):
+            regressions.append("{0}  {1:.4g}, was {2:.4g} ({3:+.0%})".format(name, value, was, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run the pyvisonic benchmarks and write the results as JSON")
+    parser.add_argument("names", nargs = "*", help = "the benchmarks to run ({0}), all of them if none are given".format(", ".join(BENCHMARKS)))
+    parser.add_argument("--output", help = "write the JSON to this file rather than to stdout")
+    parser.add_argument("--replay", help = "a debug log to replay, see replay.py")
+    parser.add_argument("--compare", help = "the JSON of an earlier run, exit with 1 if any result is more than --tolerance worse")
+    parser.add_argument("--tolerance", type = float, default = DEFAULT_TOLERANCE, help = "how much worse, as a fraction, a result can be with --compare")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark {0}".format(name))
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    # Read the replay log before pyvisonic is imported, the import starts a new log.txt in the current directory
+    frames = None
+    if args.replay is not None:
+        frames = replay.read_log(args.replay)
+        if not any(frame.inbound for frame in frames):
+            parser.error("no received frames in {0}".format(args.replay))
+
+    # pyvisonic logs to stdout, send that to stderr so that stdout is just the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        import pyvisonic
+    results = {
+        "pyvisonic" : pyvisonic.PLUGIN_VERSION,
+        "python" : platform.python_version(),
+        "platform" : platform.platform(),
+        "time" : datetime.now().isoformat(timespec = 'seconds'),
+        "benchmarks" : {}
+    }
+    for name in (args.names or BENCHMARKS):
+        start = time.perf_counter()
+        results["benchmarks"][name] = importlib.import_module("bench_" + name).measure()
+        print("{0} took {1:.1f} seconds".format(name, time.perf_counter() - start), file = sys.stderr)
+    if frames is not None:
+        results["benchmarks"]["replay"] = measure_replay(pyvisonic, frames)
+        results["benchmarks"]["replay"]["capture"] = os.path.basename(args.replay)
+
+    text = json.dumps(results, indent = 2, sort_keys = True)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line, file = sys.stderr)
+        print("{0} results more than {1:.0%} worse than {2}".format(len(regressions), args.tolerance, args.compare), file = sys.stderr)
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,11 +23,16 @@ import threading
 import collections
 import time
 import copy
+import bisect
+import heapq
+import itertools
+import json
+import operator
+import types
 
 from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict
 from datetime import datetime
-from time import sleep
 from datetime import timedelta
 from dateutil.relativedelta import *
 from functools import partial
@@ -40,6 +45,8 @@ HOMEASSISTANT = False
 PLUGIN_VERSION = "0.0.1"
 
 MAX_CRC_ERROR = 5
+# The longest PDU that we keep building while looking for the end of it, anything longer is dumped
+MAX_PDU_LEN = 0xC1
 POWERLINK_RETRIES = 4
 
 # If we are waiting on a message back from the panel or we are explicitly waiting for an acknowledge,
@@ -47,6 +54,45 @@ POWERLINK_RETRIES = 4
 #  Note that not all messages will get a resend, only ones waiting for a specific response and/or are blocking on an ack
 RESEND_MESSAGE_TIMEOUT = timedelta(seconds=10)
 
+# The time, in seconds, that the awaitable commands (like RequestArmAsync) wait for the reply from the panel by default
+#    This is long enough for the command to wait in the send queue and be resent once
+COMMAND_TIMEOUT = 30
+
+# The time, in seconds, between sending messages to the panel until we know the panel type
+#    After that it starts from the default for the panel type (pmPacingDefault_t) and is learned from how quickly the panel acks
+MESSAGE_SEND_GAP = 1.0
+
+# The limits of the learned gap between messages, in seconds, and how quickly it changes
+#    Each ack that comes back in less than half of the gap shortens it by PACING_SHRINK
+#    A timeout (0x06), a download retry (0x25) or a resend lengthens it by PACING_BACKOFF
+PACING_MIN_GAP = 0.2
+PACING_MAX_GAP = 4.0
+PACING_SHRINK = 0.95
+PACING_BACKOFF = 1.5
+# How many messages can be sent one after another (PACING_MIN_GAP apart) after a quiet period
+PACING_BURST = 2
+
+# The panel needs a pause, in seconds, after each acknowledge that we send before we send it anything else
+ACK_SEND_GAP = 0.1
+
+# The pause, in seconds, before sending the auto-enroll to the panel
+ENROLL_SEND_GAP = 1.0
+
+# Send an I'm alive message to the panel when nothing has been sent for this many seconds
+KEEP_ALIVE_PERIOD = 20
+
+# How often, in seconds, the loop lag monitor checks how late the event loop is in running it, the other timers are checked too
+#    A warning is logged when a timer is more than LOOP_LAG_WARNING seconds late, something is blocking the loop
+LOOP_LAG_INTERVAL = 1.0
+LOOP_LAG_WARNING = 0.5
+
+# The A5 status messages have a bitmask (bit 0 is zone 1) of the zone status, low battery, tamper, enrolled and bypass of zones 1 to 32
+#    The PowerMaster B0 zone messages have wider bitmasks (up to 64 zones for a PowerMaster 30), both are kept in the same bitmasks
+#    ZONE_MASK_A5 has a bit for each of the zones in an A5 message
+#    "zonestatus" is the PowerMaster B0 03 04 bitmask, it is kept (see GetZoneMasks) but not set in the sensors until we know what it is
+ZONE_MASKS = ("status", "lowbatt", "tamper", "enrolled", "bypass", "zonestatus")
+ZONE_MASK_A5 = 0xFFFFFFFF
+
 # We must get specific messages from the panel, if we do not in this time period then trigger a restore/status request
 WATCHDOG_TIMEOUT = 60
 
@@ -57,8 +103,12 @@ DOWNLOAD_TIMEOUT = 120
 
 DownloadCode = bytearray.fromhex('56 50')
 
+# The upper limits (in milliseconds) of the buckets in the command latency histograms, the last bucket is for anything longer
+LATENCY_BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
 PanelSettings = {
    "MotionOffDelay"      : 120,
+   "ZoneOffDelay"        : {},     # zone number : seconds, the motion off delay for these zones instead of MotionOffDelay
    "OverrideCode"        : "",
    "PluginLanguage"      : "EN",
    "PluginDebug"         : False,
@@ -67,10 +117,27 @@ PanelSettings = {
    "AutoSyncTime"        : True,
    "EnableRemoteArm"     : False,
    "EnableRemoteDisArm"  : False,  #
-   "EnableSensorBypass"  : False   # Does user allow sensor bypass / arming
+   "EnableSensorBypass"  : False,  # Does user allow sensor bypass / arming
+   "PacingFile"          : "",     # A file to keep the learned gap between messages for each panel type in, "" to not keep it
+   "CoalesceWindow"      : 0.0,    # Seconds to gather the changes to the sensors for before calling the change handlers, 0 to call them straight away
+   "LoopLagMonitor"      : False,  # Wake the event loop every LOOP_LAG_INTERVAL seconds to measure its lag when there is nothing else to do, see GetLoopLag
+   "PowerMasterZoneMasks": True    # Decode the PowerMaster B0 zone bitmasks so that zones 33 to 64 are updated, False to ignore them if the layout turns out to be wrong for a panel
 }
 
-PanelStatus = {
+# PanelStatus is a dictionary that counts the changes made to it, so that pmPublishState only compares a number to see if it has changed
+#    version goes up by one each time a value is set to something different, it is only set with [] (not update, pop and so on)
+#    It is changed in place by the event loop thread without a lock, other threads should use GetState (of the protocol or VisonicConnectionThread)
+class VisonicStatus(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        if key not in self or dict.__getitem__(self, key) != value:
+            dict.__setitem__(self, key, value)
+            self.version = self.version + 1
+
+PanelStatus = VisonicStatus({
    "PluginVersion"      : PLUGIN_VERSION,
    "CommExceptionCount" : 0,
    "Mode"               : "Unknown",
@@ -112,40 +179,110 @@ PanelStatus = {
    "SilentPanic"        : False,
    "QuickArm"           : False,
    "BypassOff"          : False
-}
+})
 
 # use a named tuple for data and acknowledge
-#    replytype is a message type from the Panel that we should get in response
+#    data is the message without the header, checksum and footer, it is bytes so that sending a message with options can not change it
+#    replytype is a tuple of the message types from the Panel that we should get in response
 #    waitforack, if True means that we should wait for the acknowledge from the Panel before progressing
 VisonicCommand = collections.namedtuple('VisonicCommand', 'data replytype waitforack msg')
+
+# The reply to a command that the awaitable commands return
+#    msgtype is the type of the message from the panel that completed the command (0x02 when it is an acknowledge)
+#    data is that message without the type, the checksum and the footer. It has already been decoded in to the panel status and sensors
+VisonicReply = collections.namedtuple('VisonicReply', 'msgtype data')
 pmSendMsg = {
-   "MSG_INIT"        : VisonicCommand(bytearray.fromhex('AB 0A 00 01 00 00 00 00 00 00 00 43'), None  ,  True, "Initializing PowerMax/Master PowerLink Connection" ),
-   "MSG_ALIVE"       : VisonicCommand(bytearray.fromhex('AB 03 00 00 00 00 00 00 00 00 00 43'), None  , False, "I'm Alive Message To Panel" ),
-   "MSG_ZONENAME"    : VisonicCommand(bytearray.fromhex('A3 00 00 00 00 00 00 00 00 00 00 43'), [0xA3], False, "Requesting Zone Names" ),
-   "MSG_ZONETYPE"    : VisonicCommand(bytearray.fromhex('A6 00 00 00 00 00 00 00 00 00 00 43'), [0xA6], False, "Requesting Zone Types" ),
-   "MSG_X10NAMES"    : VisonicCommand(bytearray.fromhex('AC 00 00 00 00 00 00 00 00 00 00 43'), None  , False, "Requesting X10 Names" ),
-   "MSG_RESTORE"     : VisonicCommand(bytearray.fromhex('AB 06 00 00 00 00 00 00 00 00 00 43'), [0xA5], False, "Restore PowerMax/Master Connection" ), # It can take multiple of these to put the panel back in to powerlink
-   "MSG_ENROLL"      : VisonicCommand(bytearray.fromhex('AB 0A 00 00 99 99 00 00 00 00 00 43'), [0xAB], False, "Auto-Enroll of the PowerMax/Master" ),
-   "MSG_EVENTLOG"    : VisonicCommand(bytearray.fromhex('A0 00 00 00 99 99 00 00 00 00 00 43'), None  , False, "Retrieving Event Log" ),  # replytype is 0xA0
-   "MSG_ARM"         : VisonicCommand(bytearray.fromhex('A1 00 00 00 99 99 00 00 00 00 00 43'), None  , False, "(Dis)Arming System" ),
-   "MSG_STATUS"      : VisonicCommand(bytearray.fromhex('A2 00 00 00 00 00 00 00 00 00 00 43'), [0xA5], False, "Getting Status" ),
-   "MSG_BYPASSTAT"   : VisonicCommand(bytearray.fromhex('A2 00 00 20 00 00 00 00 00 00 00 43'), [0xA5], False, "Bypassing" ),
-   "MSG_X10PGM"      : VisonicCommand(bytearray.fromhex('A4 00 00 00 00 00 99 99 00 00 00 43'), None  , False, "X10 Data" ),
-   "MSG_BYPASSEN"    : VisonicCommand(bytearray.fromhex('AA 99 99 00 00 00 00 00 00 00 00 43'), None  , False, "BYPASS Enable" ),
-   "MSG_BYPASSDIS"   : VisonicCommand(bytearray.fromhex('AA 99 99 00 00 00 00 00 00 00 00 43'), None  , False, "BYPASS Disable" ),
+   "MSG_INIT"        : VisonicCommand(bytes.fromhex('AB 0A 00 01 00 00 00 00 00 00 00 43')    , None   ,  True, "Initializing PowerMax/Master PowerLink Connection" ),
+   "MSG_ALIVE"       : VisonicCommand(bytes.fromhex('AB 03 00 00 00 00 00 00 00 00 00 43')    , None   , False, "I'm Alive Message To Panel" ),
+   "MSG_ZONENAME"    : VisonicCommand(bytes.fromhex('A3 00 00 00 00 00 00 00 00 00 00 43')    , (0xA3,), False, "Requesting Zone Names" ),
+   "MSG_ZONETYPE"    : VisonicCommand(bytes.fromhex('A6 00 00 00 00 00 00 00 00 00 00 43')    , (0xA6,), False, "Requesting Zone Types" ),
+   "MSG_X10NAMES"    : VisonicCommand(bytes.fromhex('AC 00 00 00 00 00 00 00 00 00 00 43')    , None   , False, "Requesting X10 Names" ),
+   "MSG_RESTORE"     : VisonicCommand(bytes.fromhex('AB 06 00 00 00 00 00 00 00 00 00 43')    , (0xA5,), False, "Restore PowerMax/Master Connection" ), # It can take multiple of these to put the panel back in to powerlink
+   "MSG_ENROLL"      : VisonicCommand(bytes.fromhex('AB 0A 00 00 99 99 00 00 00 00 00 43')    , (0xAB,), False, "Auto-Enroll of the PowerMax/Master" ),
+   "MSG_EVENTLOG"    : VisonicCommand(bytes.fromhex('A0 00 00 00 99 99 00 00 00 00 00 43')    , None   , False, "Retrieving Event Log" ),  # replytype is 0xA0
+   "MSG_ARM"         : VisonicCommand(bytes.fromhex('A1 00 00 00 99 99 00 00 00 00 00 43')    , None   , False, "(Dis)Arming System" ),
+   "MSG_STATUS"      : VisonicCommand(bytes.fromhex('A2 00 00 00 00 00 00 00 00 00 00 43')    , (0xA5,), False, "Getting Status" ),
+   "MSG_BYPASSTAT"   : VisonicCommand(bytes.fromhex('A2 00 00 20 00 00 00 00 00 00 00 43')    , (0xA5,), False, "Bypassing" ),
+   "MSG_X10PGM"      : VisonicCommand(bytes.fromhex('A4 00 00 00 00 00 99 99 00 00 00 43')    , None   , False, "X10 Data" ),
+   "MSG_BYPASSEN"    : VisonicCommand(bytes.fromhex('AA 99 99 00 00 00 00 00 00 00 00 43')    , None   , False, "BYPASS Enable" ),
+   "MSG_BYPASSDIS"   : VisonicCommand(bytes.fromhex('AA 99 99 00 00 00 00 00 00 00 00 43')    , None   , False, "BYPASS Disable" ),
    # Command codes (powerlink) do not have the 0x43 on the end and are only 11 values
-   "MSG_DOWNLOAD"    : VisonicCommand(bytearray.fromhex('24 00 00 99 99 00 00 00 00 00 00')   , None  ,  True, "Start Download Mode" ),  #[0x3C]
-   "MSG_SETTIME"     : VisonicCommand(bytearray.fromhex('46 F8 00 01 02 03 04 05 06 FF FF')   , None  , False, "Setting Time" ),   # may not need an ack
-   "MSG_DL"          : VisonicCommand(bytearray.fromhex('3E 00 00 00 00 B0 00 00 00 00 00')   , [0x3F], False, "Download Data Set" ),
-   "MSG_SER_TYPE"    : VisonicCommand(bytearray.fromhex('5A 30 04 01 00 00 00 00 00 00 00')   , [0x33], False, "Get Serial Type" ),
+   "MSG_DOWNLOAD"    : VisonicCommand(bytes.fromhex('24 00 00 99 99 00 00 00 00 00 00')       , None   ,  True, "Start Download Mode" ),  #[0x3C]
+   "MSG_SETTIME"     : VisonicCommand(bytes.fromhex('46 F8 00 01 02 03 04 05 06 FF FF')       , None   , False, "Setting Time" ),   # may not need an ack
+   "MSG_DL"          : VisonicCommand(bytes.fromhex('3E 00 00 00 00 B0 00 00 00 00 00')       , (0x3F,), False, "Download Data Set" ),
+   "MSG_SER_TYPE"    : VisonicCommand(bytes.fromhex('5A 30 04 01 00 00 00 00 00 00 00')       , (0x33,), False, "Get Serial Type" ),
    # quick command codes to start and stop download/powerlink are a single value
-   "MSG_START"       : VisonicCommand(bytearray.fromhex('0A')                                 , [0x0B], False, "Start" ),    # waiting for download complete from panel
-   "MSG_STOP"        : VisonicCommand(bytearray.fromhex('0B')                                 , None  , False, "Stop" ),     #
-   "MSG_EXIT"        : VisonicCommand(bytearray.fromhex('0F')                                 , None  , False, "Exit" ),
-   "MSG_ACK"         : VisonicCommand(bytearray.fromhex('02')                                 , None  , False, "Ack" ),
-   "MSG_ACKLONG"     : VisonicCommand(bytearray.fromhex('02 43')                              , None  , False, "Ack Long" ),
+   "MSG_START"       : VisonicCommand(bytes.fromhex('0A')                                     , (0x0B,), False, "Start" ),    # waiting for download complete from panel
+   "MSG_STOP"        : VisonicCommand(bytes.fromhex('0B')                                     , None   , False, "Stop" ),     #
+   "MSG_EXIT"        : VisonicCommand(bytes.fromhex('0F')                                     , None   , False, "Exit" ),
+   "MSG_ACK"         : VisonicCommand(bytes.fromhex('02')                                     , None   , False, "Ack" ),
+   "MSG_ACKLONG"     : VisonicCommand(bytes.fromhex('02 43')                                  , None   , False, "Ack Long" ),
    # PowerMaster specific
-   "MSG_POWERMASTER" : VisonicCommand(bytearray.fromhex('B0 01 00 00 00 00 00 00 00 00 43')   , [0xB0], False, "Powermaster Command" )
+   "MSG_POWERMASTER" : VisonicCommand(bytes.fromhex('B0 01 00 00 00 00 00 00 00 00 43')       , (0xB0,), False, "Powermaster Command" )
+}
+
+# Build the frame that is sent to the panel: the header (0x0D), the data with the options put in to it, the checksum and the footer (0x0A)
+#    options is a list of couples: byte offset in the data, bytes to put in to the data at that offset. Examples are the pin or the specific command
+#    The frame is built in a single bytearray, data is not changed
+def pmEncodeFrame(data, options = None) -> bytearray:
+    frame = bytearray(len(data) + 3)
+    frame[0] = 0x0D
+    frame[1:-2] = data
+    if options is not None:
+        # the length of options has to be an even number
+        for o in range(0, len(options) // 2):
+            s = options[o * 2] + 1      # the byte offset in the frame
+            a = options[o * 2 + 1]      # the bytes to insert
+            frame[s : s + len(a)] = a
+    # the checksum and footer are still 0 so they do not add to the sum
+    checksum = 0xFF - ((sum(frame) - 0x0D) % 0xFF)
+    frame[-2] = 0x00 if checksum == 0xFF else checksum
+    frame[-1] = 0x0A
+    return frame
+
+# The complete frames of the commands in pmSendMsg for when they are sent without options (like MSG_ACK, MSG_ALIVE and MSG_STATUS)
+#    These are built once so that sending them, especially the acknowledge to every message from the panel, does not build anything
+pmSendFrame_t = { command : bytes(pmEncodeFrame(command.data)) for command in pmSendMsg.values() }
+
+# The priority classes of the send queue, highest priority first
+#    control    : arming, disarming and bypassing sensors, these are never queued behind the other classes
+#    user       : the other requests from the user, such as getting the event log
+#    background : keep-alives, status requests, the powerlink startup and the EPROM download
+#                 these are one class as the startup and download messages must be sent in the order they were queued
+SEND_PRIORITY = ("control", "user", "background")
+
+# The most messages that can wait in each priority class of the send queue, a message is dropped when its class is full
+SEND_QUEUE_LIMIT = { "control" : 10, "user" : 20, "background" : 100 }
+
+# The most callbacks that can wait to be delivered to the event_callback, the sensor change handlers and the disconnect_callback
+#    when they are called on another loop or in an executor, see SetCallbackTarget
+CALLBACK_QUEUE_LIMIT = 1000
+
+# What to do with a callback when the callback queue is full, drop the oldest one that is waiting or drop the new one
+CALLBACK_OVERFLOW = ("drop_oldest", "drop_newest")
+
+# The priority class of the messages in pmSendMsg, anything that is not here is "user"
+pmSendMsgPriority_t = {
+   "MSG_ARM"         : "control",
+   "MSG_BYPASSEN"    : "control",
+   "MSG_BYPASSDIS"   : "control",
+   "MSG_BYPASSTAT"   : "control",   # sent after a bypass to check that it worked
+   "MSG_INIT"        : "background",
+   "MSG_ALIVE"       : "background",
+   "MSG_ZONENAME"    : "background",
+   "MSG_ZONETYPE"    : "background",
+   "MSG_X10NAMES"    : "background",
+   "MSG_RESTORE"     : "background",
+   "MSG_ENROLL"      : "background",
+   "MSG_STATUS"      : "background",
+   "MSG_DOWNLOAD"    : "background",
+   "MSG_SETTIME"     : "background",
+   "MSG_DL"          : "background",
+   "MSG_SER_TYPE"    : "background",
+   "MSG_START"       : "background",
+   "MSG_STOP"        : "background",
+   "MSG_EXIT"        : "background",
+   "MSG_POWERMASTER" : "background"
 }
 
 pmSendMsgB0_t = {
@@ -206,12 +343,25 @@ pmReceiveMsg_t = {
    0xF1 : PanelCallBack(    9, False, False )    # 9
 }
 
+# An entry in the message dispatch table, the details from pmReceiveMsg_t and the function to decode the message
+#    handler is called as handler(protocol, data) where data is the message without the header, type, checksum and footer
+#    data is a read only memoryview that is reused for the next message, use bytes(data) to keep a copy of it
+PanelMessage = collections.namedtuple("PanelMessage", 'length ackneeded variablelength handler' )
+
 pmReceiveMsgB0_t = {
    0x04 : "Zone status",
    0x18 : "Open/close status",
    0x39 : "Activity"
 }
 
+# The PowerMaster B0 messages (from the panel, msgType 0x03) that have a zone bitmask and which of ZONE_MASKS it is
+#    Each subtype has its own bitmask, if two subtypes shared one then each message would change the zones back from the other
+#    Only 0x18 (open/close) is used for the sensors, 0x04 is kept as "zonestatus" until we know what it holds
+pmReceiveMsgB0Zones_t = {
+   0x04 : "zonestatus",
+   0x18 : "status"
+}
+
 pmLogEvent_t = {
    "EN" : (
            "None", "Interior Alarm", "Perimeter Alarm", "Delay Alarm", "24h Silent Alarm", "24h Audible Alarm",
@@ -272,6 +422,12 @@ pmLogUser_t = [
    "PTag 01", "PTag 02", "PTag 03", "PTag 04", "PTag 05", "PTag 06", "PTag 07", "PTag 08"
 ]
 
+# The PowerMaster panels have more zones, keyfobs, users, keypads, sirens and proximity tags than pmLogUser_t
+pmLogPowerMasterUser_t = ( [ "System " ] + [ "Zone {0:0>2}".format(i) for i in range(1, 65) ] + [ "Fob  {0:0>2}".format(i) for i in range(1, 33) ] +
+                           [ "User {0:0>2}".format(i) for i in range(1, 49) ] + [ "Pad  {0:0>2}".format(i) for i in range(1, 33) ] +
+                           [ "Sir  {0:0>2}".format(i) for i in range(1, 9) ] + [ "2Pad {0:0>2}".format(i) for i in range(1, 33) ] +
+                           [ "X10  {0:0>2}".format(i) for i in range(1, 16) ] + [ "PGM    ", "P-LINK " ] + [ "PTag {0:0>2}".format(i) for i in range(1, 33) ] )
+
 pmSysStatus_t = {
    "EN" : (
            "Disarmed", "Home Exit Delay", "Away Exit Delay", "Entry Delay", "Armed Home", "Armed Away", "User Test",
@@ -331,6 +487,11 @@ pmPanelType_t = {
    5  : "PowerMax Complete Part", 6 : "PowerMax Express", 7 : "PowerMaster10",   8 : "PowerMaster30"
 }
 
+# The starting gap (in seconds) between messages for each panel type, the panel needs about 500 ms
+pmPacingDefault_t = {
+   0 : 1.0, 1 : 0.8, 2 : 0.6, 3 : 0.6, 4 : 0.6, 5 : 0.6, 6 : 0.6, 7 : 0.5, 8 : 0.5
+}
+
 # Config for each panel type (1-9)
 pmPanelConfig_t = {
    "CFG_PARTITIONS"  : (   1,   1,   1,   1,   3,   3,   1,   3,   3 ),
@@ -488,7 +649,39 @@ class LogEvent:
         strn = strn + ("    event=None" if self.event == None else "    event={0:<2}".format(self.event))
         return strn
 
+# A change to a sensor, given to the change handlers that are installed with changes=True
+#    zone is the zone number (the sensor id), sequence is a number that goes up by one with every change to any sensor
+#    changes is a dictionary of attribute name : (old value, new value) for each attribute that has changed since the last one
+SensorChange = collections.namedtuple('SensorChange', 'zone sequence changes')
+
+# The attributes of a sensor, these are in a SensorSnapshot and pushChange compares them to find what has changed
+SENSOR_ATTRIBUTES = ("id", "dname", "stype", "sid", "ztype", "zname", "ztypeName", "zchime", "partition",
+                     "bypass", "lowbatt", "status", "tamper", "enrolled", "triggered", "triggertime")
+pmSensorChangeSequence = itertools.count(1)
+pmSensorValues = operator.attrgetter(*SENSOR_ATTRIBUTES)
+
+# An immutable copy of the attributes of a sensor, see SensorDevice.snapshot. It is a tuple so it is quick to make and to compare
+SensorSnapshot = collections.namedtuple('SensorSnapshot', SENSOR_ATTRIBUTES)
+
+# A consistent view of the panel that any thread can read, see GetState. It is never changed, a new one is made when anything in it changes
+#    version goes up by one with each new state, mode is PanelStatus["Mode"]
+#    panel is a read only dictionary copy of PanelStatus and sensors is a read only dictionary of zone slot : SensorSnapshot
+VisonicState = collections.namedtuple('VisonicState', 'version mode panel sensors')
+
+# The state before anything has been published
+NO_STATE = VisonicState(0, None, types.MappingProxyType({}), types.MappingProxyType({}))
+
+# The attributes that SensorDevice.__str__ shows and their format
+#    sid, ztype, zchime and partition are missed out to shorten the line in debug messages
+SENSOR_STR_FORMAT = (("id", "{0:<2}"), ("dname", "{0:<4}"), ("stype", "{0:<8}"), ("zname", "{0:<14}"), ("ztypeName", "{0:<10}"), ("bypass", "{0:<2}"),
+                     ("lowbatt", "{0:<2}"), ("status", "{0:<2}"), ("tamper", "{0:<2}"), ("enrolled", "{0:<2}"), ("triggered", "{0:<2}"))
+
 class SensorDevice:
+    # There can be 64 of these with a PowerMaster 30, __slots__ makes them smaller and quicker to copy
+    __slots__ = ("id", "dname", "stype", "sid", "ztype", "zname", "ztypeName", "zchime", "_partition",
+                 "bypass", "lowbatt", "status", "tamper", "enrolled", "triggered", "triggertime", "_change_handler", "_change_detail", "_pushed", "_changed",
+                 "_coalescer", "_delivery", "_sensors")
+
     def __init__(self, **kwargs):
         self.id = kwargs.get('id', None)                # int   device id
         self.dname = kwargs.get('dname', None)          # str   device name
@@ -498,7 +691,7 @@ class SensorDevice:
         self.zname = kwargs.get('zname', None)          # str   zone name
         self.ztypeName = kwargs.get('ztypeName', None)  # str   Zone Type Name
         self.zchime = kwargs.get('zchime', None)        # str   zone chime
-        self.partition = kwargs.get('partition', None)  # set   partition set (could be in more than one partition)
+        self.partition = kwargs.get('partition', None)  # tuple partitions (could be in more than one partition)
         self.bypass = kwargs.get('bypass', False)       # bool  if bypass is set on this sensor
         self.lowbatt = kwargs.get('lowbatt', False)     # bool  if this sensor has a low battery
         self.status = kwargs.get('status', False)       # bool  status, as returned by the A5 message
@@ -507,30 +700,36 @@ class SensorDevice:
         self.triggered = kwargs.get('triggered', False) # bool  triggered, as returned by the A5 message
         self.triggertime = None                         # datetime  This is used to time out the triggered value and set it back to false
         self._change_handler = None
+        self._change_detail = False
+        # the VisonicCoalescer that gathers the changes, set when the sensor is put in VisonicSensors
+        self._coalescer = None
+        # the VisonicDelivery that calls the change handler, set when the sensor is put in VisonicSensors
+        self._delivery = None
+        # the VisonicSensors that the sensor is in, pushChange marks it as dirty
+        self._sensors = None
+        # the snapshot of the sensor when the last change was pushed
+        self._pushed = self.snapshot()
+        # set when the sensor has changed since pmPublishState made a snapshot of it, see pushChange and VisonicSensors.touch
+        self._changed = True
+
+    # The partitions are kept as a tuple so that nothing can change them in a copy or a snapshot
+    @property
+    def partition(self):
+        return self._partition
+
+    @partition.setter
+    def partition(self, value):
+        self._partition = None if value is None else tuple(value)
 
     def __str__(self):
-        strn = ""
-        strn = strn + ("id=None" if self.id == None else "id={0:<2}".format(self.id, type(self.id)))
-        strn = strn + (" dname=None"     if self.dname == None else     " dname={0:<4}".format(self.dname, type(self.dname)))
-        strn = strn + (" stype=None"     if self.stype == None else     " stype={0:<8}".format(self.stype, type(self.stype)))
-# temporarily miss it out to shorten the line in debug messages        strn = strn + (" sid=None"       if self.sid == None else       " sid={0:<3}".format(self.sid, type(self.sid)))
-# temporarily miss it out to shorten the line in debug messages        strn = strn + (" ztype=None"     if self.ztype == None else     " ztype={0:<2}".format(self.ztype, type(self.ztype)))
-        strn = strn + (" zname=None"     if self.zname == None else     " zname={0:<14}".format(self.zname, type(self.zname)))
-        strn = strn + (" ztypeName=None" if self.ztypeName == None else " ztypeName={0:<10}".format(self.ztypeName, type(self.ztypeName)))
-# temporarily miss it out to shorten the line in debug messages        strn = strn + (" zchime=None"    if self.zchime == None else    " zchime={0:<12}".format(self.zchime, type(self.zchime)))
-# temporarily miss it out to shorten the line in debug messages        strn = strn + (" partition=None" if self.partition == None else " partition={0}".format(self.partition, type(self.partition)))
-        strn = strn + (" bypass=None"    if self.bypass == None else    " bypass={0:<2}".format(self.bypass, type(self.bypass)))
-        strn = strn + (" lowbatt=None"   if self.lowbatt == None else   " lowbatt={0:<2}".format(self.lowbatt, type(self.lowbatt)))
-        strn = strn + (" status=None"    if self.status == None else    " status={0:<2}".format(self.status, type(self.status)))
-        strn = strn + (" tamper=None"    if self.tamper == None else    " tamper={0:<2}".format(self.tamper, type(self.tamper)))
-        strn = strn + (" enrolled=None"  if self.enrolled == None else  " enrolled={0:<2}".format(self.enrolled, type(self.enrolled)))
-        strn = strn + (" triggered=None" if self.triggered == None else " triggered={0:<2}".format(self.triggered, type(self.triggered)))
-        return strn
+        strn = []
+        for name, form in SENSOR_STR_FORMAT:
+            value = getattr(self, name)
+            strn.append(name + "=" + ("None" if value is None else form.format(value)))
+        return " ".join(strn)
 
     def __eq__(self, other):
-        if other is None:
-            return False
-        if self is None:
+        if not isinstance(other, SensorDevice):
             return False
         return (self.id == other.id and self.dname == other.dname and self.stype == other.stype and self.sid == other.sid and self.ztype == other.ztype and
             self.zname == other.zname and self.zchime == other.zchime and self.partition == other.partition and self.bypass == other.bypass and
@@ -540,17 +739,309 @@ class SensorDevice:
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    # A copy (as from GetSensor) is detached, it is not in the VisonicSensors and has no change handler so changing it does not affect the sensor.
+    #    All of the other attributes are immutable so a deepcopy is the same as a copy
+    def __copy__(self):
+        sensor = SensorDevice.__new__(SensorDevice)
+        for name in SensorDevice.__slots__:
+            setattr(sensor, name, getattr(self, name))
+        sensor._change_handler = None
+        sensor._coalescer = None
+        sensor._delivery = None
+        sensor._sensors = None
+        return sensor
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    # Return a SensorSnapshot of the sensor
+    def snapshot(self) -> SensorSnapshot:
+        return SensorSnapshot._make(pmSensorValues(self))
+
     def getDeviceID(self):
         return self.id
         
-    def install_change_handler(self, ch):
+    # Install the handler that is called when the sensor changes
+    #    When changes is True the handler is given a SensorChange with what has changed, otherwise it is called with no arguments
+    def install_change_handler(self, ch, changes = False):
         log.info("Installing update handler for device {}".format(self.id))
         self._change_handler = ch
+        self._change_detail = changes
 
+    # Call the change handler when something has changed since the last time, nothing is called when nothing has changed
+    #    When changes are being coalesced the change is given to the VisonicCoalescer, it calls deliverChange later
     def pushChange(self):
+        snapshot = self.snapshot()
+        if snapshot == self._pushed:
+            return
+        changes = { name : (old, new) for name, old, new in zip(SENSOR_ATTRIBUTES, self._pushed, snapshot) if old != new }
+        self._pushed = snapshot
+        self._changed = True
+        if self._sensors is not None:
+            self._sensors.dirty = True
+        if self._coalescer is not None and self._coalescer.hold(self, changes):
+            return
+        self.deliverChange(changes)
+
+    # Call the change handler with changes (a dictionary of attribute name : (old value, new value)) and return the SensorChange
+    def deliverChange(self, changes) -> SensorChange:
+        change = SensorChange(self.id, next(pmSensorChangeSequence), changes)
         if self._change_handler is not None:
             #log.info("Calling update handler for device")
-            self._change_handler()
+            args = (change,) if self._change_detail else ()
+            if self._delivery is None:
+                self._change_handler(*args)
+            else:
+                self._delivery.deliver(self._change_handler, *args)
+        return change
+
+
+# The sensors, a dictionary keyed by the 0-based zone slot (zone 1 is slot 0) as pmSensorDev_t always has been
+#    It also has indexes by the zone number (the sensor id, 1-based as it is in the panel messages) and by the device name (e.g. "Z01")
+#    Call reindex when the id or dname of a sensor in it is changed
+class VisonicSensors(dict):
+    def __init__(self):
+        super().__init__()
+        self.zones = {}     # zone number : slot
+        self.names = {}     # device name : slot
+        self.changed = True # set when a sensor is added or removed
+        self.dirty = False  # set when a sensor in it has changed, pmPublishState only looks at the sensors when this (or changed) is set
+        self.coalescer = None   # the VisonicCoalescer for the sensors that are put in to it
+        self.delivery = None    # the VisonicDelivery for the sensors that are put in to it
+
+    def __setitem__(self, slot, sensor):
+        if slot in self:
+            self.unindex(slot)
+        super().__setitem__(slot, sensor)
+        self.zones[sensor.id] = slot
+        self.names[sensor.dname] = slot
+        self.changed = True
+        sensor._coalescer = self.coalescer
+        sensor._delivery = self.delivery
+        sensor._sensors = self
+
+    def __delitem__(self, slot):
+        self.unindex(slot)
+        super().__delitem__(slot)
+        self.changed = True
+
+    def pop(self, slot, *default):
+        if slot in self:
+            self.unindex(slot)
+            self.changed = True
+        return super().pop(slot, *default)
+
+    def clear(self):
+        self.zones.clear()
+        self.names.clear()
+        super().clear()
+        self.changed = True
+
+    def unindex(self, slot):
+        sensor = self[slot]
+        if self.zones.get(sensor.id) == slot:
+            del self.zones[sensor.id]
+        if self.names.get(sensor.dname) == slot:
+            del self.names[sensor.dname]
+
+    # Index the sensor in slot again after its id or dname has changed
+    def reindex(self, slot):
+        for zone in [z for z, s in self.zones.items() if s == slot]:
+            del self.zones[zone]
+        for name in [n for n, s in self.names.items() if s == slot]:
+            del self.names[name]
+        sensor = self[slot]
+        self.zones[sensor.id] = slot
+        self.names[sensor.dname] = slot
+
+    # Mark the sensor in slot as changed, for when its attributes are set without calling pushChange, so that pmPublishState makes a new snapshot of it
+    def touch(self, slot):
+        self[slot]._changed = True
+        self.dirty = True
+
+    # The slot of the sensor for zone number, None if there isn't one
+    def slot(self, zone):
+        return self.zones.get(zone)
+
+    # The sensor for zone number, None if there isn't one
+    def zone(self, zone) -> SensorDevice:
+        slot = self.zones.get(zone)
+        return None if slot is None else self[slot]
+
+    # The sensor with the device name dname, None if there isn't one
+    def name(self, dname) -> SensorDevice:
+        slot = self.names.get(dname)
+        return None if slot is None else self[slot]
+
+
+# Gathers the changes to the sensors for window seconds and then calls the change handlers once for each sensor that has changed
+#    The changes to a sensor in the window are merged, each attribute has the value from before the first change and after the last one
+#    An alarm (see isAlarm) is delivered straight away, with anything else that was waiting for that sensor
+#    batch_handler, if set, is called with the list of SensorChange each time that they are delivered
+class VisonicCoalescer:
+    def __init__(self, timers, window = 0.0, delivery = None):
+        self.timers = timers
+        self.window = window
+        self.delivery = delivery    # the VisonicDelivery that calls batch_handler, None to call it directly
+        self.pending = {}           # zone : (SensorDevice, { attribute : (old, new) })
+        self.batch_handler = None
+        self.received = 0           # changes from pushChange
+        self.folded = 0             # changes merged in to one that was already waiting for the same sensor
+        self.cancelled = 0          # merged changes that ended up with nothing changed, so nothing was called
+        self.immediate = 0          # alarms delivered straight away
+        self.delivered = 0          # changes given to the change handlers
+        self.batches = 0
+
+    # A tamper or, when the panel is armed, a sensor being triggered is delivered straight away
+    def isAlarm(self, changes) -> bool:
+        if "tamper" in changes and changes["tamper"][1]:
+            return True
+        return PanelStatus["PanelArmed"] and "triggered" in changes and changes["triggered"][1]
+
+    # Keep the changes to sensor until the end of the window, return False when changes are not being coalesced
+    def hold(self, sensor, changes) -> bool:
+        if self.window <= 0:
+            return False
+        self.received = self.received + 1
+        waiting = self.pending.get(sensor.id)
+        if waiting is None:
+            self.pending[sensor.id] = (sensor, dict(changes))
+        else:
+            self.folded = self.folded + 1
+            waiting = waiting[1]
+            for name, (old, new) in changes.items():
+                if name in waiting:
+                    old = waiting[name][0]
+                waiting[name] = (old, new)
+        if self.isAlarm(changes):
+            self.immediate = self.immediate + 1
+            self.deliver([self.pending.pop(sensor.id)])
+        elif self.timers.when("coalesce") is None:
+            self.timers.set("coalesce", self.timers.loop.time() + self.window, self.flush)
+        return True
+
+    # Deliver all of the changes that are waiting
+    def flush(self):
+        self.timers.cancel("coalesce")
+        pending = self.pending
+        self.pending = {}
+        self.deliver(pending.values())
+
+    def deliver(self, items):
+        delivered = []
+        for sensor, changes in items:
+            changes = { name : change for name, change in changes.items() if change[0] != change[1] }
+            if len(changes) == 0:
+                self.cancelled = self.cancelled + 1
+            else:
+                delivered.append(sensor.deliverChange(changes))
+        if len(delivered) > 0:
+            self.delivered = self.delivered + len(delivered)
+            self.batches = self.batches + 1
+            if self.batch_handler is not None:
+                if self.delivery is None:
+                    self.batch_handler(delivered)
+                else:
+                    self.delivery.deliver(self.batch_handler, delivered)
+
+    def summary(self) -> dict:
+        return { "window" : self.window, "received" : self.received, "folded" : self.folded, "cancelled" : self.cancelled,
+                 "immediate" : self.immediate, "delivered" : self.delivered, "batches" : self.batches, "pending" : len(self.pending) }
+
+
+# Calls the callbacks (the event_callback, the sensor change handlers and so on) away from the frame parsing
+#    target is None to call them straight away (on the protocol's loop, as they always were), an asyncio loop to call them on
+#    that loop (it can be in another thread) or a concurrent.futures.Executor to call them in that
+#    When there is a target the callbacks wait in a queue of at most limit, overflow (one of CALLBACK_OVERFLOW) says what to do when it is full,
+#    and they are called one at a time in the order that they were queued. Parsing the frames and acking the panel never waits for them.
+class VisonicDelivery:
+    def __init__(self, target = None, limit = CALLBACK_QUEUE_LIMIT, overflow = "drop_oldest"):
+        self.target = target
+        self.limit = limit
+        self.overflow = overflow
+        self.queue = collections.deque()    # (time.monotonic() when queued, function, args)
+        self.lock = threading.Lock()        # the queue is filled on the protocol's thread and emptied on the target's
+        self.scheduled = False              # True when drain has been given to the target and hasn't finished
+        self.maxdepth = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.errors = 0
+        # the time (in milliseconds) from queueing a callback to calling it
+        self.latency = LatencyHistogram()
+
+    # Call function(*args) on the target
+    def deliver(self, function, *args):
+        if self.target is None:
+            self.delivered = self.delivered + 1
+            function(*args)
+            return
+        with self.lock:
+            if len(self.queue) >= self.limit:
+                self.dropped = self.dropped + 1
+                if self.overflow == "drop_newest":
+                    log.debug("[Delivery] The callback queue is full, dropping the new callback")
+                    return
+                log.debug("[Delivery] The callback queue is full, dropping the oldest callback")
+                self.queue.popleft()
+            self.queue.append((time.monotonic(), function, args))
+            self.maxdepth = max(self.maxdepth, len(self.queue))
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.schedule()
+
+    def schedule(self):
+        try:
+            if isinstance(self.target, asyncio.AbstractEventLoop):
+                self.target.call_soon_threadsafe(self.drain)
+            else:
+                self.target.submit(self.drain)
+        except RuntimeError as e:
+            # the loop is closed or the executor has been shut down
+            with self.lock:
+                self.dropped = self.dropped + len(self.queue)
+                self.queue.clear()
+                self.scheduled = False
+            log.warning("[Delivery] Cannot deliver the callbacks: {0}".format(e))
+
+    # Call the callbacks that were waiting when it started, then give it back to the target if more have been queued
+    #    so that a busy protocol does not keep the target's loop to itself
+    def drain(self):
+        for i in range(len(self.queue)):
+            with self.lock:
+                if len(self.queue) == 0:
+                    break
+                queued, function, args = self.queue.popleft()
+            self.latency.add(1000 * (time.monotonic() - queued))
+            try:
+                function(*args)
+                self.delivered = self.delivered + 1
+            except Exception:
+                self.errors = self.errors + 1
+                log.exception("[Delivery] The callback {0} failed".format(function))
+        with self.lock:
+            if len(self.queue) == 0:
+                self.scheduled = False
+                return
+        self.schedule()
+
+    def summary(self) -> dict:
+        return {
+            "target" : None if self.target is None else type(self.target).__name__,
+            "depth" : len(self.queue),
+            "max_depth" : self.maxdepth,
+            "limit" : self.limit,
+            "overflow" : self.overflow,
+            "dropped" : self.dropped,
+            "delivered" : self.delivered,
+            "errors" : self.errors,
+            "latency_ms" : self.latency.summary()
+        }
+
+
+# The awaitable commands raise this when the command could not be sent or the panel did not accept it
+class VisonicCommandError(Exception):
+    pass
 
 
 class VisonicListEntry:
@@ -562,18 +1053,306 @@ class VisonicListEntry:
         #self.receivecountfixed = kwargs.get('receivecountfixed', None) # Need to store it extra, because with a re-List it can get lost
         #self.receiveretries = kwargs.get('receiveretries', None)
         self.options = kwargs.get('options', None)
+        # the key in pmSendMsg (e.g. "MSG_ARM"), None for messages that do not go through the send queue
+        self.message_type = kwargs.get('message_type', None)
+        # the send queue priority class, one of SEND_PRIORITY
+        self.priority = pmSendMsgPriority_t.get(self.message_type, "user")
+        # when (loop time) the message was put in the send queue, sent to the panel and acknowledged by the panel
+        self.queued = kwargs.get('queued', None)
+        self.sent = None
+        self.acked = None
+        # an asyncio Future that is given the VisonicReply from the panel, None when nobody is waiting for it
+        self.reply = kwargs.get('reply', None)
+        # list of message reply needed, this is a copy as the acknowledge may be added to it
         if self.command.replytype is None:
             self.response = []
         else:
-            self.response = self.command.replytype  # list of message reply needed
+            self.response = list(self.command.replytype)
         # are we waiting for an acknowledge from the panel (do not send a message until we get it)
-        if self.command.waitforack:
+        #    when somebody is waiting for the reply and there is no reply type then the acknowledge is the reply
+        if self.command.waitforack or (self.reply is not None and len(self.response) == 0):
             self.response.append(0x02)              # add an acknowledge to the list
         self.triedResendingMessage = False
 
     def __str__(self):
         return "Command:{0}    Options:{1}".format(self.command.msg, self.options)
 
+    # Give the reply to whoever is waiting for it
+    def replied(self, msgtype, data):
+        if self.reply is not None and not self.reply.done():
+            self.reply.set_result(VisonicReply(msgtype, bytes(data)))
+
+    # Tell whoever is waiting for the reply that it is not going to come
+    def failed(self, why):
+        if self.reply is not None and not self.reply.done():
+            self.reply.set_exception(VisonicCommandError("{0}: {1}".format(self.command.msg, why)))
+
+
+# A histogram of times in milliseconds with the fixed buckets in LATENCY_BUCKETS, so it does not grow however many times are added
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, ms)] += 1
+        self.count = self.count + 1
+        self.total = self.total + ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+
+    # An estimate of the p (0 to 1) percentile, the upper limit of the bucket that it is in
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        running = 0
+        for i, c in enumerate(self.counts):
+            running = running + c
+            if running >= p * self.count:
+                return self.max if i == len(LATENCY_BUCKETS) else min(self.max, LATENCY_BUCKETS[i])
+        return self.max
+
+    def summary(self) -> dict:
+        buckets = ["<={0}".format(b) for b in LATENCY_BUCKETS] + [">{0}".format(LATENCY_BUCKETS[-1])]
+        return {
+            "count" : self.count,
+            "min" : self.min,
+            "mean" : None if self.count == 0 else self.total / self.count,
+            "p50" : self.percentile(0.5),
+            "p95" : self.percentile(0.95),
+            "p99" : self.percentile(0.99),
+            "max" : self.max,
+            "buckets" : dict(zip(buckets, self.counts))
+        }
+
+
+# The queue of messages waiting to be sent to the panel, a deque for each priority class in SEND_PRIORITY
+#    Messages are sent from the highest priority class that has any, oldest first
+class VisonicSendQueue:
+    def __init__(self):
+        self.queues = { priority : collections.deque() for priority in SEND_PRIORITY }
+        self.maxdepth = { priority : 0 for priority in SEND_PRIORITY }
+        self.dropped = { priority : 0 for priority in SEND_PRIORITY }
+        # the time (in milliseconds) that messages waited in each class
+        self.wait = { priority : LatencyHistogram() for priority in SEND_PRIORITY }
+        # the number of messages in all of the classes, kept as they are added and removed as this is checked after every PDU
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # Add a VisonicListEntry to the end of its class, return False if the class is full
+    def append(self, instruction) -> bool:
+        queue = self.queues[instruction.priority]
+        if len(queue) >= SEND_QUEUE_LIMIT[instruction.priority]:
+            self.dropped[instruction.priority] += 1
+            return False
+        queue.append(instruction)
+        self.count = self.count + 1
+        self.maxdepth[instruction.priority] = max(self.maxdepth[instruction.priority], len(queue))
+        return True
+
+    # Remove and return the next message to send, or None if there isn't one
+    #    now is the loop time, to record how long the message waited
+    #    when downloading is True the user class waits, the control class (arm, disarm, bypass) and the background class are still sent
+    def pop(self, now, downloading = False):
+        for priority in SEND_PRIORITY:
+            queue = self.queues[priority]
+            if len(queue) > 0 and (priority != "user" or not downloading):
+                instruction = queue.popleft()
+                self.count = self.count - 1
+                self.wait[priority].add(1000 * (now - instruction.queued))
+                return instruction
+        return None
+
+    # Empty the queue, return the messages that were in it
+    def clear(self) -> list:
+        removed = [instruction for queue in self.queues.values() for instruction in queue]
+        for queue in self.queues.values():
+            queue.clear()
+        self.count = 0
+        return removed
+
+    def summary(self) -> dict:
+        return { priority : {
+                    "depth" : len(self.queues[priority]),
+                    "max_depth" : self.maxdepth[priority],
+                    "limit" : SEND_QUEUE_LIMIT[priority],
+                    "dropped" : self.dropped[priority],
+                    "wait_ms" : self.wait[priority].summary()
+                 } for priority in SEND_PRIORITY }
+
+
+# The pacing of the messages sent to the panel, the gap between them is learned from how quickly the panel acks them
+#    It works like a token bucket, a token is added every gap seconds up to PACING_BURST tokens and each message sent uses one.
+#    So after a quiet period a few messages can be sent without waiting the whole gap, but never closer together than PACING_MIN_GAP
+class VisonicPacing:
+    def __init__(self, gap = MESSAGE_SEND_GAP):
+        self.gap = gap
+        self.tokens = 1.0
+        self.updated = None     # the loop time when tokens was last worked out
+        self.lastsent = None    # the loop time when the last message was sent
+        self.promptacks = 0
+        self.backoffs = 0
+
+    def refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(PACING_BURST, self.tokens + (now - self.updated) / self.gap)
+        self.updated = now
+
+    # The loop time when the next message can be sent
+    def nextSendTime(self, now):
+        self.refill(now)
+        when = now if self.tokens >= 1.0 else now + (1.0 - self.tokens) * self.gap
+        if self.lastsent is not None:
+            when = max(when, self.lastsent + PACING_MIN_GAP)
+        return when
+
+    def sent(self, now):
+        self.refill(now)
+        self.tokens = max(0.0, self.tokens - 1.0)
+        self.lastsent = now
+
+    # The panel acked (or replied to) a message ack seconds after it was sent, if that was quick then shorten the gap
+    def ack(self, ack):
+        if ack < self.gap / 2:
+            self.gap = max(PACING_MIN_GAP, self.gap * PACING_SHRINK)
+            self.promptacks = self.promptacks + 1
+
+    # The panel is struggling to keep up, lengthen the gap and use up the tokens
+    def backoff(self):
+        self.gap = min(PACING_MAX_GAP, self.gap * PACING_BACKOFF)
+        self.tokens = 0.0
+        self.backoffs = self.backoffs + 1
+
+    def summary(self) -> dict:
+        return {
+            "gap" : self.gap,
+            "tokens" : self.tokens,
+            "prompt_acks" : self.promptacks,
+            "backoffs" : self.backoffs
+        }
+
+
+# The timers of a connection (watchdog, keep alive, send queue, download timeout and so on)
+#    Each timer is a name with a deadline (loop time) and a function to call, the deadlines are kept in a heap and
+#    a single loop timer is set for the earliest one, so nothing wakes up until there is something to do
+#    Setting a timer that is already set moves it, the old entry is left in the heap and skipped when it gets to the top
+#    lag is how late (in milliseconds) the timers were called, anything that blocks the event loop shows up here
+class VisonicTimers:
+    def __init__(self, loop, after = None):
+        self.loop = loop
+        self.after = after      # called after the timers that are due have been called
+        self.heap = []          # (deadline, sequence, name)
+        self.timers = {}        # name : (deadline, sequence, function) for the timers that are set
+        self.sequence = 0
+        self.handle = None      # the loop timer for the earliest deadline
+        self.handlewhen = None
+        self.closed = False
+        self.wakeups = 0
+        self.lag = LatencyHistogram()
+
+    def __len__(self):
+        return len(self.timers)
+
+    # Call function at loop time when, instead of when it was set for before
+    def set(self, name, when, function):
+        if self.closed:
+            return
+        self.sequence = self.sequence + 1
+        self.timers[name] = (when, self.sequence, function)
+        heapq.heappush(self.heap, (when, self.sequence, name))
+        if len(self.heap) > 2 * len(self.timers) + 16:
+            # too many old entries, build the heap again from the timers that are set
+            self.heap = [(t[0], t[1], n) for n, t in self.timers.items()]
+            heapq.heapify(self.heap)
+        self.reschedule()
+
+    def cancel(self, name):
+        if self.timers.pop(name, None) is not None:
+            self.reschedule()
+
+    # The deadline of the named timer, None when it is not set
+    def when(self, name):
+        timer = self.timers.get(name)
+        return None if timer is None else timer[0]
+
+    # Cancel all of the timers, none can be set after this
+    def close(self):
+        self.closed = True
+        self.timers = {}
+        self.heap = []
+        self.reschedule()
+
+    # Remove the old entries from the top of the heap and make sure that the loop timer goes off by the earliest deadline
+    def reschedule(self):
+        while len(self.heap) > 0:
+            when, sequence, name = self.heap[0]
+            timer = self.timers.get(name)
+            if timer is not None and timer[1] == sequence:
+                break
+            heapq.heappop(self.heap)
+        when = self.heap[0][0] if len(self.heap) > 0 else None
+        # when the earliest deadline has moved later (like the watchdog being reset) the loop timer is left to go off early, it is
+        #    then set again for the new deadline. This saves making a new loop timer each time that a timer is moved on
+        if when is None or self.handle is None or when < self.handlewhen:
+            if self.handle is not None:
+                self.handle.cancel()
+            self.handle = None if when is None else self.loop.call_at(when, self.expired)
+            self.handlewhen = when
+
+    # Call the function of each timer that is due, they can set their timer again
+    def expired(self):
+        self.handle = None
+        self.handlewhen = None
+        self.wakeups = self.wakeups + 1
+        now = self.loop.time()
+        due = []
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            when, sequence, name = heapq.heappop(self.heap)
+            timer = self.timers.get(name)
+            if timer is not None and timer[1] == sequence:
+                del self.timers[name]
+                due.append((name, when, timer[2]))
+        for name, when, function in due:
+            self.lag.add(1000 * (now - when))
+            if now - when > LOOP_LAG_WARNING:
+                log.warning("[Timers] The {0} timer is {1:.2f} seconds late, the event loop was blocked".format(name, now - when))
+            try:
+                function()
+            except Exception:
+                log.exception("[Timers] The {0} timer failed".format(name))
+        if len(due) > 0 and self.after is not None:
+            self.after()
+        self.reschedule()
+
+
+# The latency of one kind of command (e.g. MSG_ARM)
+#    queue is the time from SendCommand to the message being sent to the panel
+#    ack is the time from sending the message to the panel acknowledging it (0x02)
+#    reply is the time from sending the message to getting all of the responses in pmExpectedResponse (including the ack)
+#    resends is the number of times the message was sent again and failures the number of times that a resend didn't work either
+#       and the send queue was reset with triggerRestoreStatus
+class CommandLatency:
+    def __init__(self):
+        self.queue = LatencyHistogram()
+        self.ack = LatencyHistogram()
+        self.reply = LatencyHistogram()
+        self.resends = 0
+        self.failures = 0
+
+    def summary(self) -> dict:
+        return {
+            "queue_ms" : self.queue.summary(),
+            "ack_ms" : self.ack.summary(),
+            "reply_ms" : self.reply.summary(),
+            "resends" : self.resends,
+            "failures" : self.failures
+        }
+
 
 # This class handles the detailed low level interface to the panel.
 #    It sends the messages
@@ -586,18 +1365,31 @@ class ProtocolBase(asyncio.Protocol):
     # Are we expecting a variable length message from the panel
     pmVarLenMsg = False
     pmIncomingPduLen = 0
+    # How far we have got through the PDU at the start of the receive buffer, 0 when looking for a new PDU
+    pmScanOffset = 0
+    # The running sum of the PDU bytes from offset 1 up to pmSumOffset, so that the checksum for each possible end of the PDU is quick to check
+    pmRunningSum = 0
+    pmSumOffset = 1
     pmSendMsgRetries = 0
 
     # The CRC Error Count for Received Messages
     pmCrcErrorCount = 0
+    # Set when a PDU has failed and we are looking for the next 0x0D followed by a known message type
+    pmResyncing = False
+    # When the current resync started, the number of resyncs, the total number of received bytes discarded and
+    #    how long it took to get the next valid PDU after the last resync (a timedelta)
+    pmResyncStartTime = None
+    pmResyncCount = 0
+    pmDiscardedBytes = 0
+    pmResyncTime = None
     # Whether its a powermax or powermaster
     PowerMaster = False
+    # The panel type from the panel info message (3C), an index in to pmPanelType_t
+    PanelType = None
     # the current receiving message type
     msgType_t = None
     # The last sent message
     pmLastSentMessage = None
-    # keep alive counter for the timer 
-    keep_alive_counter = 0    # only used in keep_alive_messages_timer
     # a list of message types we are expecting from the panel
     pmExpectedResponse = []
     # whether we are in powerlink state
@@ -614,27 +1406,78 @@ class ProtocolBase(asyncio.Protocol):
 
     receive_log = []
 
-    watchdogcounter = 0
-
     log.info("Initialising Protocol")
 
-    def __init__(self, loop=None, disconnect_callback=None, event_callback: Callable = None ) -> None:
+    def __init__(self, loop=None, disconnect_callback=None, event_callback: Callable = None, callback_target = None ) -> None:
         """Initialize class."""
         if loop:
             self.loop = loop
         else:
             self.loop = asyncio.get_event_loop()
         self.event_callback = event_callback
+        # Calls the event_callback, the sensor change handlers and the disconnect_callback, see SetCallbackTarget
+        self.pmDelivery = VisonicDelivery(callback_target)
         # The receive byte array for receiving a message
         self.ReceiveData = bytearray()
+        # Each received PDU is copied in to the frame buffer, the message decoders get a read only view of it
+        self.pmFrame = bytearray(MAX_PDU_LEN + 1)
+        self.pmFrameView = memoryview(self.pmFrame).toreadonly()
         self.disconnect_callback = disconnect_callback
         # A queue of messages to send
-        self.SendList = []
+        self.SendList = VisonicSendQueue()
+        # The message types that we are waiting for, each connection has its own list (the class attribute would be shared)
+        self.pmExpectedResponse = []
         # This is the time stamp of the last Send or Receive
         self.pmLastTransactionTime = self.pmTimeFunction() - timedelta(seconds=1)  # take off 1 second so the first command goes through immediately
+        # The pacing of the messages that we send
+        self.pmPacing = VisonicPacing()
+        # Nothing is sent from the send queue before this loop time, see pmPauseSending
+        self.pmSendPausedUntil = 0.0
+        # True when the send timer was set to resend while waiting for a response, False when it was set to send from the send queue
+        self.pmSendTimerResend = False
+        # All of the timers of this connection, they are all cancelled when the connection is lost
+        self.pmTimers = VisonicTimers(self.loop, after = self.pmPublishState)
+        # The tasks started for this connection (like the powerlink startup), they are cancelled when the connection is lost
+        self.pmTasks = set()
+        # Count the keep alive messages, a status request is sent with every fifth one (and the first one)
+        self.pmKeepAliveCount = 1000
         self.ForceStandardMode = False # until defined by HA
         self.coordinate_powerlink_startup_count = 0
         self.suspendAllOperations = False
+        # The message dispatch table, a copy so that handlers can be registered for this connection only
+        self.pmMessageTable_t = dict(self.buildMessageTable())
+        # Registered handlers for the PowerMaster B0 message subtypes
+        self.pmMessageB0Table_t = {}
+        # The CommandLatency for each message type in pmSendMsg that has been sent
+        self.pmCommandLatency = {}
+
+    # Build the message dispatch table for this class, this is only done once for each class
+    #    The decoder for message type XX is the function handle_msgtypeXX, if there is one
+    @classmethod
+    def buildMessageTable(cls) -> dict:
+        if "pmClassMessageTable_t" not in cls.__dict__:
+            table = {}
+            for msgType, callback in pmReceiveMsg_t.items():
+                handler = getattr(cls, "handle_msgtype{0:02X}".format(msgType), None)
+                table[msgType] = PanelMessage(callback.length, callback.ackneeded, callback.variablelength, handler)
+            cls.pmClassMessageTable_t = table
+        return cls.pmClassMessageTable_t
+
+    # Add or replace the decoder for a message type, without having to subclass the protocol
+    #    handler is called as handler(protocol, data)
+    #    callback is a PanelCallBack with the length and ack details, if None then keep the existing details
+    #       (or for a new message type assume an unknown length that needs an ACK)
+    #    subType, if given, registers a handler for that subtype of the PowerMaster B0 message
+    def register_message_handler(self, msgType, handler, callback: PanelCallBack = None, subType = None):
+        """ Register a decoder for a message type """
+        if subType is not None:
+            log.debug("[register_message_handler] Registering handler for message {0} subtype {1}".format(hex(msgType).upper(), hex(subType).upper()))
+            self.pmMessageB0Table_t[subType] = handler
+            return
+        log.debug("[register_message_handler] Registering handler for message {0}".format(hex(msgType).upper()))
+        if callback is None:
+            callback = self.pmMessageTable_t.get(msgType) or PanelCallBack( None, True, False )
+        self.pmMessageTable_t[msgType] = PanelMessage(callback.length, callback.ackneeded, callback.variablelength, handler)
 
     def toString(self, array_alpha: bytearray):
         return "".join("%02x " % b for b in array_alpha)
@@ -660,57 +1503,46 @@ class ProtocolBase(asyncio.Protocol):
     # This is a timeout function for a watchdog. If we are in powerlink, we should get a AB 03 message every 20 to 30 seconds
     #    If we haven't got one in the timeout period then reset the send queues and state and then call a MSG_RESTORE
     # In standard mode, this command asks the panel for a status
-    async def watchdog_timer(self):
+    def watchdog_timer(self):
         """We timed out, try to restore the connection."""
-        self.reset_watchdog_timeout()
-        while not self.suspendAllOperations:
+        if self.DownloadMode:
             # Disable during download
-            if self.DownloadMode:
-                self.watchdogcounter = 0
-            self.watchdogcounter = self.watchdogcounter + 1
-            #log.debug("[WatchDogTimeout] is {0}".format(self.watchdogcounter))
-            if self.watchdogcounter >= WATCHDOG_TIMEOUT:   #  the clock runs at 1 second
-                log.info("[WatchDogTimeout] ****************************** WatchDog Timer Expired ********************************")
-                self.triggerRestoreStatus()
-            # sleep, doesn't need to be highly accurate so just count each second
-            await asyncio.sleep(1.0)
+            self.reset_watchdog_timeout()
+        else:
+            log.info("[WatchDogTimeout] ****************************** WatchDog Timer Expired ********************************")
+            self.triggerRestoreStatus()
 
     # This function needs to be called within the timeout to reset the timer period
     def reset_watchdog_timeout(self):
-        self.watchdogcounter = 0
+        self.pmTimers.set("watchdog", self.loop.time() + WATCHDOG_TIMEOUT, self.watchdog_timer)
         
-    # Function to send I'm Alive and status request messages to the panel
-    async def keep_alive_messages_timer(self):
-        self.keep_alive_counter = 0
-        status_counter = 1000  # trigger first time!
-        while not self.suspendAllOperations:
-            # Disable during download
-            if self.DownloadMode:
-                self.keep_alive_counter = 0
-            self.keep_alive_counter = self.keep_alive_counter + 1
-            #log.debug("[KeepaliveTimeout] is {0}   DownloadMode {1}".format(self.keep_alive_counter, self.DownloadMode))
-            if len(self.SendList) == 0 and self.keep_alive_counter >= 20:   #
-                # Every 20 seconds, unless watchdog has been reset
-                #log.debug("Send list is empty so sending I'm alive message")
-                # reset counter
-                self.keep_alive_counter = 0
-                # Send I'm Alive and request status
-                self.SendCommand("MSG_ALIVE")
-                # When is standard mode, sending this asks the panel to send us the status so we know that the panel is ok.
-                # When in powerlink mode, it makes no difference as we get the AB messages from the panel, but this also keeps our status updated
-                if status_counter > 4:
-                    status_counter = 0
-                    self.SendCommand("MSG_STATUS")  # Asks the panel to send us the A5 message set
-                status_counter = status_counter + 1
-            else:
-                # Every 1.0 seconds, try to flush the send queue
-                self.SendCommand(None)  # check send queue
-            # sleep, doesn't need to be highly accurate so just count each second
-            await asyncio.sleep(1.0)
-            #self.reset_keep_alive_messages()
-
+    # Function to send I'm Alive and status request messages to the panel, KEEP_ALIVE_PERIOD seconds after we last sent anything
+    #    The send queue is not flushed from here, SendCommand sets its own timer for when the next message can be sent
+    def keep_alive_messages_timer(self):
+        self.reset_keep_alive_messages()
+        if self.DownloadMode or len(self.SendList) > 0:
+            # Disable during download, and there's no need when there are messages waiting to be sent
+            return
+        #log.debug("Send list is empty so sending I'm alive message")
+        # Send I'm Alive and request status
+        self.SendCommand("MSG_ALIVE")
+        # When is standard mode, sending this asks the panel to send us the status so we know that the panel is ok.
+        # When in powerlink mode, it makes no difference as we get the AB messages from the panel, but this also keeps our status updated
+        if self.pmKeepAliveCount > 4:
+            self.pmKeepAliveCount = 0
+            self.SendCommand("MSG_STATUS")  # Asks the panel to send us the A5 message set
+        self.pmKeepAliveCount = self.pmKeepAliveCount + 1
+
+    # Move the keep alive timer on, it is called each time that a message is sent
     def reset_keep_alive_messages(self):
-        self.keep_alive_counter = 0
+        self.pmTimers.set("keepalive", self.loop.time() + KEEP_ALIVE_PERIOD, self.keep_alive_messages_timer)
+
+    # Run a coroutine as a task of this connection, so that it is cancelled when the connection is lost
+    def pmStartTask(self, coro):
+        task = asyncio.ensure_future(coro, loop = self.loop)
+        self.pmTasks.add(task)
+        task.add_done_callback(self.pmTasks.discard)
+        return task
 
     # This is called from the loop handler when the connection to the transport is made
     def connection_made(self, transport):
@@ -739,37 +1571,41 @@ class ProtocolBase(asyncio.Protocol):
             # attempt to coordinate powerlink connectivity
             #     during early initialisation we need to ignore all incoming data to establish a known state in the panel
             #     the first time, set the counter as 1 as we can assume that it's going to be OK!!!!
-            asyncio.ensure_future(self.coordinate_powerlink_startup(1), loop=self.loop)
+            self.pmStartTask(self.coordinate_powerlink_startup(1))
         else:
-            self.gotoStandardMode()
+            self.pmStartTask(self.gotoStandardMode())
 
-        asyncio.ensure_future(self.keep_alive_messages_timer(), loop=self.loop)
-        asyncio.ensure_future(self.watchdog_timer(), loop=self.loop)
+        self.reset_keep_alive_messages()
+        # the other timers measure the lag anyway, this only adds a measurement every second when the loop would otherwise be idle
+        if PanelSettings["LoopLagMonitor"]:
+            self.loop_lag_timer()
         
-    def resetPanelSequence(self):   # This should re-initialise the panel, most of the time it works!
+    # The waits are awaited so the loop keeps running, the send timer sends the queued messages while we wait
+    async def resetPanelSequence(self):   # This should re-initialise the panel, most of the time it works!
         self.ClearList()
         
         self.pmExpectedResponse = []
         self.SendCommand("MSG_EXIT")
-        sleep(1.0)
+        await asyncio.sleep(1.0)
         
         self.pmExpectedResponse = []
         self.SendCommand("MSG_STOP")
-        sleep(1.0)
+        await asyncio.sleep(1.0)
 
         while not self.suspendAllOperations and len(self.SendList) > 0:
             log.debug("[ResetPanel]       Waiting")
-            self.SendCommand(None)  # check send queue
+            await asyncio.sleep(0.1)
 
         self.pmExpectedResponse = []
         self.SendCommand("MSG_INIT")
-        sleep(1.0)
+        await asyncio.sleep(1.0)
         
         
-    def gotoStandardMode(self):
+    async def gotoStandardMode(self):
         PanelStatus["Mode"] = "Standard"
         self.pmPowerlinkMode = False
-        self.resetPanelSequence()
+        self.pmPublishState()
+        await self.resetPanelSequence()
         self.SendCommand("MSG_STATUS")
 
         
@@ -782,7 +1618,7 @@ class ProtocolBase(asyncio.Protocol):
             self.pmExpectedResponse = []
             self.reset_keep_alive_messages()
             self.reset_watchdog_timeout()
-            self.gotoStandardMode()
+            await self.gotoStandardMode()
         elif self.coordinate_powerlink_startup_count <= POWERLINK_RETRIES:
             # TRY POWERLINK MODE
             # by setting this, we do not process incoming data, 
@@ -798,7 +1634,7 @@ class ProtocolBase(asyncio.Protocol):
 
                 # send EXIT and INIT and then wait to make certain they have been sent
                 self.receive_log = []
-                self.resetPanelSequence()
+                await self.resetPanelSequence()
                 self.pmExpectedResponse = []
                 # Wait to gather any panel responses
                 await asyncio.sleep(4.0)
@@ -830,135 +1666,226 @@ class ProtocolBase(asyncio.Protocol):
             self.reset_watchdog_timeout()
             self.Start_Download()
 
-    # Process any received bytes (in data as a bytearray)            
+    # Process any received bytes (in data as a bytearray)
+    #    The bytes are added to the receive buffer and complete PDUs are then cut from the buffer a chunk at a time
     def data_received(self, data):
+        """Add incoming data to ReceiveData."""
         if self.suspendAllOperations:
             return
-        """Add incoming data to ReceiveData."""
         #log.debug('[data receiver] received data: %s', self.toString(data))
-        for databyte in data:
-            #log.debug("[data receiver] Processing " + hex(databyte).upper())
-            # process a single byte at a time
-            self.handle_received_byte(databyte)
+        self.ReceiveData += data
+        self.handle_received_data()
 
-    # Process one received byte at a time to build up the received messages
-    #       pmIncomingPduLen is only used in this function
+    # Process one received byte, kept for anything that feeds the protocol a byte at a time
     def handle_received_byte(self, data):
         """Process a single byte as incoming data."""
-        # Length of the received data so far
-        pdu_len = len(self.ReceiveData)
-
-        # If we were expecting a message of a particular length and what we have is already greater then that length then dump the message and resynchronise.
-        if 0 < self.pmIncomingPduLen <= pdu_len:   # waiting for pmIncomingPduLen bytes but got more and haven't been able to validate a PDU
-            log.debug("[data receiver] Building PDU: Dumping Current PDU " + self.toString(self.ReceiveData))
-            # Reset the incoming data to 0 length and clear the receive buffer
-            self.ReceiveData = bytearray(b'')
-            pdu_len = len(self.ReceiveData)
-
-        # If the length is 4 bytes and we're receiving a variable length message, the panel tells us the length we're expecting to receive
-        if pdu_len == 4 and self.pmVarLenMsg:
-            # Determine length of variable size message
-            # The message type is in the second byte
-            msgType = self.ReceiveData[1]
-            self.pmIncomingPduLen = 7 + int(data) # (((int(self.ReceiveData[2]) * 0x100) + int(self.ReceiveData[3])))
-            #if self.pmIncomingPduLen >= 0xB0:  # then more than one message
-            #    self.pmIncomingPduLen = 0 # set it to 0 for this loop around
-            #log.debug("[data receiver] Variable length Message Being Receive  Message {0}     pmIncomingPduLen {1}".format(hex(msgType).upper(), self.pmIncomingPduLen))
-
-        # If this is the start of a new message, then check to ensure it is a 0x0D (message header)
-        if pdu_len == 0:
-            self.msgType_t = None
-            if data == 0x0D:  # preamble
-                #log.debug("[data receiver] Start of new PDU detected, expecting response " + response)
-                #log.debug("[data receiver] Start of new PDU detected")
-                # reset the message and add the received header
-                self.ReceiveData = bytearray(b'')
-                self.ReceiveData.append(data)
-                #log.debug("[data receiver] Starting PDU " + self.toString(self.ReceiveData))
-        elif pdu_len == 1:
-            # The second byte is the message type
-            msgType = data
-            #log.debug("[data receiver] Received message Type %d", data)
-            # Is it a message type that we know about
-            if msgType in pmReceiveMsg_t:
-                self.msgType_t = pmReceiveMsg_t[msgType]
-                self.pmIncomingPduLen = (self.msgType_t is not None) and self.msgType_t.length or 0
-                self.pmVarLenMsg = pmReceiveMsg_t[msgType].variablelength
-                #if msgType == 0x3F: # and self.msgType_t != None and self.pmIncomingPduLen == 0:
-                #    self.pmVarLenMsg = True
+        self.data_received(bytes([data]))
+
+    # Cut as many PDUs as possible from the start of the receive buffer
+    #    A PDU starts with a 0x0D (message header), the second byte is the message type
+    #    self.pmScanOffset is 0 when looking for the header, otherwise it is how far we got through the current PDU
+    def handle_received_data(self):
+        """Frame the receive buffer in to PDUs."""
+        buf = self.ReceiveData
+        start = 0
+        end = len(buf)
+        while start < end:
+            if self.pmScanOffset == 0:
+                # If this is the start of a new message, then check to ensure it is a 0x0D (message header)
+                if buf[start] != 0x0D or self.pmResyncing:
+                    pos = self.pmFindHeader(buf, start, end)
+                    self.pmDiscardedBytes = self.pmDiscardedBytes + pos - start
+                    start = pos
+                    if start == end:
+                        break
+                if end - start < 2:
+                    break
+                # The second byte is the message type, is it a message type that we know about
+                msgType = buf[start + 1]
+                self.msgType_t = self.pmMessageTable_t.get(msgType)
+                if self.msgType_t is not None:
+                    self.pmIncomingPduLen = self.msgType_t.length or 0
+                    self.pmVarLenMsg = self.msgType_t.variablelength
+                else:
+                    log.warning("[data receiver] Warning : Construction of incoming packet unknown - Message Type {0}".format(hex(msgType).upper()))
+                    self.pmIncomingPduLen = 0
+                    self.pmVarLenMsg = False
+                self.pmScanOffset = 2
+                self.pmRunningSum = 0
+                self.pmSumOffset = 1
+            used = self.pmFramePdu(buf, start, end)
+            if used == 0:
+                break   # wait for more data
+            start = start + used
+            self.pmScanOffset = 0
+        # remove everything that we have dealt with from the front of the buffer
+        if start > 0:
+            del buf[:start]
+
+    # Find the next message header (0x0D) in buf[start:end] and return its position, or end if there isn't one
+    #    When resynchronising after a failed PDU, only a 0x0D followed by a message type that we know about is a header
+    def pmFindHeader(self, buf, start, end) -> int:
+        while start < end:
+            pos = buf.find(b'\x0D', start, end)
+            if pos < 0:
+                return end
+            if not self.pmResyncing or pos + 1 == end or buf[pos + 1] in self.pmMessageTable_t:
+                return pos
+            start = pos + 1
+        return end
+
+    # The PDU at the start of the receive buffer has failed, drop its 0x0D and rescan the bytes after it for the next PDU
+    #    Any good PDUs already in the buffer are framed from there rather than being dropped with the failed one
+    #    Return the number of bytes used
+    def pmResync(self) -> int:
+        if not self.pmResyncing:
+            self.pmResyncing = True
+            self.pmResyncCount = self.pmResyncCount + 1
+            self.pmResyncStartTime = self.pmTimeFunction()
+        self.pmDiscardedBytes = self.pmDiscardedBytes + 1
+        return 1
+
+    # Try to complete the PDU that starts at buf[start]
+    #   Return the number of bytes used (whether it was a valid PDU or it was dumped) or 0 if we need more data
+    def pmFramePdu(self, buf, start, end) -> int:
+        avail = end - start
+        if self.pmIncomingPduLen == 0:
+            # Unknown length, each 0x0A (message footer) could be the end of the PDU so check the CRC
+            #   For a variable length message the length is in the 5th byte, until then treat it as unknown length
+            limit = min(avail, 4 if self.pmVarLenMsg else MAX_PDU_LEN + 1)
+            scan = self.pmScanOffset
+            while scan < limit:
+                pos = buf.find(b'\x0A', start + scan, start + limit)
+                if pos < 0:
+                    scan = limit
+                    break
+                pdu_len = pos - start + 1
+                if buf[pos - 1] == self.pmRunningChecksum(buf, start, pdu_len - 2):
+                    self.pmTakePdu(buf, start, pdu_len)
+                    return pdu_len
+                if pdu_len > 0xB0:
+                    self.pmHandleCrcError(buf[start : pos + 1])
+                    return self.pmResync()
+                # CRC check failed. However, it could be an 0x0A in the middle of the data packet and not the terminator of the message
+                #log.debug("[data receiver] Building PDU: Length is now %d bytes (apparently PDU not complete)", pdu_len)
+                scan = pdu_len
+            self.pmScanOffset = scan
+            if self.pmVarLenMsg and avail > 4:
+                # Determine length of variable size message
+                self.pmIncomingPduLen = 7 + buf[start + 4]
+            elif avail > MAX_PDU_LEN:
+                log.debug("[data receiver] Dumping Current PDU " + self.toString(buf[start : start + MAX_PDU_LEN]))
+                return self.pmResync()   # messages should never be longer than 0xC0
             else:
-                log.warning("[data receiver] Warning : Construction of incoming packet unknown - Message Type {0}".format(hex(msgType).upper()))
-            #log.debug("[data receiver] Building PDU: It's a message %02X; pmIncomingPduLen = %d", data, self.pmIncomingPduLen)
-            # Add on the message type to the buffer
-            self.ReceiveData.append(data)
-        elif (self.pmIncomingPduLen == 0 and data == 0x0A) or (pdu_len + 1 == self.pmIncomingPduLen): # postamble   (standard length message and data terminator) OR (actual length == calculated length)
-            # add to the message buffer
-            self.ReceiveData.append(data)
-            #log.debug("[data receiver] Building PDU: Checking it " + self.toString(self.ReceiveData))
-            msgType = self.ReceiveData[1]
-            if (data != 0x0A) and (self.ReceiveData[pdu_len] == 0x43):
+                return 0
+
+        # Known length
+        while True:
+            pdu_len = self.pmIncomingPduLen
+            if pdu_len > MAX_PDU_LEN + 1:
+                if avail <= MAX_PDU_LEN:
+                    return 0
+                log.debug("[data receiver] Dumping Current PDU " + self.toString(buf[start : start + MAX_PDU_LEN]))
+                return self.pmResync()   # messages should never be longer than 0xC0
+            if avail < pdu_len:
+                return 0
+            last = buf[start + pdu_len - 1]
+            if last != 0x0A and last == 0x43:
                 log.info("[data receiver] Building PDU: Special Case 42 ********************************************************************************************")
-                self.pmIncomingPduLen = self.pmIncomingPduLen + 1 # for 0x43
-            elif self.validatePDU(self.ReceiveData):
-                # We've got a validated message
-                #log.debug("[data receiver] Building PDU: Got Validated PDU type 0x%02x   full data %s", int(msgType), self.toString(self.ReceiveData))
-                # Reset some variable ready for next time
-                self.pmVarLenMsg = False
-                self.pmLastPDU = self.ReceiveData
-                self.pmLogPdu(self.ReceiveData, "<-PM  ")
-                # Record the transaction time with the panel
-                #pmLastTransactionTime = self.pmTimeFunction()  # get time now to track how long it takes for a reply
-
-                # Unknown Message has been received
-                if self.msgType_t is None:
-                    log.info("[data receiver] Unhandled message {0}".format(hex(msgType)))
-                    self.pmSendAck()
-                else:
-                    # Send an ACK if needed
-                    if not self.coordinating_powerlink and self.msgType_t.ackneeded:
-                        #log.debug("[data receiver] Sending an ack as needed by last panel status message " + hex(msgType).upper())
-                        self.pmSendAck()
-                    # Handle the message
-                    #log.debug("[data receiver] Received message " + hex(msgType).upper())
-                    self.handle_packet(self.ReceiveData)
-                    # Check response
-                    if len(self.pmExpectedResponse) > 0 and msgType != 2:   # 2 is a simple acknowledge from the panel so ignore those
-                        # We've sent something and are waiting for a reponse - this is it
-                        #log.debug("[data receiver] msgType {0}  expected one of {1}".format(hex(msgType).upper(), [hex(no).upper() for no in self.pmExpectedResponse]))
-                        if (msgType in self.pmExpectedResponse):
-                            self.pmExpectedResponse.remove(msgType)
-                            log.debug("[data receiver] msgType {0} got it so removed from list, list is now {1}".format(hex(msgType).upper(), [hex(no).upper() for no in self.pmExpectedResponse]))
-                            self.pmSendMsgRetries = 0
-                        else:
-                            log.debug("[data receiver] msgType not in self.pmExpectedResponse   Waiting for next PDU :  expected {0}   got {1}".format([hex(no).upper() for no in self.pmExpectedResponse], hex(msgType).upper()))
-                self.ReceiveData = bytearray(b'')
-            else: # CRC check failed. However, it could be an 0x0A in the middle of the data packet and not the terminator of the message
-                if len(self.ReceiveData) > 0xB0:
-                    log.info("[data receiver] PDU with CRC error %s", self.toString(self.ReceiveData))
-                    self.pmLogPdu(self.ReceiveData, "<-PM   PDU with CRC error")
-                    #pmLastTransactionTime = self.pmTimeFunction() - timedelta(seconds=1)
-                    self.ReceiveData = bytearray(b'')
-                    if msgType != 0xF1:        # ignore CRC errors on F1 message
-                        self.pmCrcErrorCount = self.pmCrcErrorCount + 1
-                    if (self.pmCrcErrorCount > MAX_CRC_ERROR):
-                        self.pmCrcErrorCount = 0
-                        self.pmHandleCommException("CRC errors")
-                else:
-                    a = self.calculate_crc(self.ReceiveData[1:-2])[0]
-                    log.debug("[data receiver] Building PDU: Length is now %d bytes (apparently PDU not complete)    %s    checksum calcs %02x", len(self.ReceiveData), self.toString(self.ReceiveData), a)
-        elif pdu_len <= 0xC0:
-            #log.debug("[data receiver] Current PDU " + self.toString(self.ReceiveData) + "    adding " + str(hex(data).upper()))
-            self.ReceiveData.append(data)
+                self.pmIncomingPduLen = pdu_len + 1 # for 0x43
+                continue
+            if last == 0x0A and buf[start + pdu_len - 2] == self.pmRunningChecksum(buf, start, pdu_len - 2):
+                self.pmTakePdu(buf, start, pdu_len)
+                return pdu_len
+            if pdu_len > 0xB0:
+                self.pmHandleCrcError(buf[start : start + pdu_len])
+            else:
+                # If we were expecting a message of a particular length and what we have is already greater then that length then dump the message and resynchronise.
+                log.debug("[data receiver] Building PDU: Dumping Current PDU " + self.toString(buf[start : start + pdu_len]))
+            return self.pmResync()
+
+    # The checksum of the PDU bytes buf[start + 1 : start + upto], this is called with an increasing upto for each possible end of the PDU
+    #    so only the bytes since the last call are added to the running sum
+    def pmRunningChecksum(self, buf, start, upto) -> int:
+        if self.pmSumOffset < upto:
+            with memoryview(buf) as view:
+                self.pmRunningSum = self.pmRunningSum + sum(view[start + self.pmSumOffset : start + upto])
+            self.pmSumOffset = upto
+        checksum = 0xFF - (self.pmRunningSum % 0xFF)
+        if checksum == 0xFF:
+            checksum = 0x00
+        return checksum
+
+    # Copy the valid PDU of pdu_len bytes at buf[start] in to the frame buffer and handle it
+    #    The frame buffer is the only place the PDU is copied to
+    def pmTakePdu(self, buf, start, pdu_len):
+        if self.pmResyncing:
+            self.pmResyncing = False
+            self.pmResyncTime = self.pmTimeFunction() - self.pmResyncStartTime
+            log.debug("[data receiver] Resynchronised in {0}, {1} bytes discarded in total".format(self.pmResyncTime, self.pmDiscardedBytes))
+        with memoryview(buf) as view:
+            self.pmFrame[0:pdu_len] = view[start : start + pdu_len]
+        self.handle_pdu(self.pmFrameView[0:pdu_len])
+
+    # We've got a validated message
+    #    packet is a read only memoryview of the frame buffer, it is only valid until the next PDU is received
+    def handle_pdu(self, packet):
+        """Process a validated PDU."""
+        msgType = packet[1]
+        #log.debug("[data receiver] Building PDU: Got Validated PDU type 0x%02x   full data %s", int(msgType), self.toString(packet))
+        # Reset some variable ready for next time
+        self.pmVarLenMsg = False
+        self.pmLogPdu(packet, "<-PM  ")
+        # Record the transaction time with the panel
+        #pmLastTransactionTime = self.pmTimeFunction()  # get time now to track how long it takes for a reply
+
+        # Unknown Message has been received
+        if self.msgType_t is None:
+            log.info("[data receiver] Unhandled message {0}".format(hex(msgType)))
+            self.pmSendAck()
         else:
-            log.debug("[data receiver] Dumping Current PDU " + self.toString(self.ReceiveData))
-            self.ReceiveData = bytearray(b'') # messages should never be longer than 0xC0
-        #log.debug("[data receiver] Building PDU " + self.toString(self.ReceiveData))
+            # Send an ACK if needed
+            if not self.coordinating_powerlink and self.msgType_t.ackneeded:
+                #log.debug("[data receiver] Sending an ack as needed by last panel status message " + hex(msgType).upper())
+                self.pmSendAck()
+            # Handle the message
+            #log.debug("[data receiver] Received message " + hex(msgType).upper())
+            # the message handler can clear pmExpectedResponse and send the next message itself, so check whether this was expected first
+            waiting = self.pmLastSentMessage if msgType != 2 and msgType in self.pmExpectedResponse else None
+            self.handle_packet(packet)
+            # Check response
+            if len(self.pmExpectedResponse) > 0 and msgType != 2:   # 2 is a simple acknowledge from the panel so ignore those
+                # We've sent something and are waiting for a reponse - this is it
+                #log.debug("[data receiver] msgType {0}  expected one of {1}".format(hex(msgType).upper(), [hex(no).upper() for no in self.pmExpectedResponse]))
+                if (msgType in self.pmExpectedResponse):
+                    self.pmExpectedResponse.remove(msgType)
+                    log.debug("[data receiver] msgType {0} got it so removed from list, list is now {1}".format(hex(msgType).upper(), [hex(no).upper() for no in self.pmExpectedResponse]))
+                    self.pmSendMsgRetries = 0
+                else:
+                    log.debug("[data receiver] msgType not in self.pmExpectedResponse   Waiting for next PDU :  expected {0}   got {1}".format([hex(no).upper() for no in self.pmExpectedResponse], hex(msgType).upper()))
+            if waiting is not None and len(self.pmExpectedResponse) == 0:
+                self.pmResponseComplete(waiting, msgType, packet[2:-2])
+            self.pmPublishState()
+        # send the next message as soon as it is allowed
+        self.pmScheduleSend()
+
+    # A PDU has been received that is too long and it does not have a valid CRC
+    def pmHandleCrcError(self, packet):
+        log.info("[data receiver] PDU with CRC error %s", self.toString(packet))
+        self.pmLogPdu(packet, "<-PM   PDU with CRC error")
+        #pmLastTransactionTime = self.pmTimeFunction() - timedelta(seconds=1)
+        if packet[1] != 0xF1:        # ignore CRC errors on F1 message
+            self.pmCrcErrorCount = self.pmCrcErrorCount + 1
+        if (self.pmCrcErrorCount > MAX_CRC_ERROR):
+            self.pmCrcErrorCount = 0
+            self.pmHandleCommException("CRC errors")
 
     # PDUs can be logged in a file. We use this to discover new never before seen
     #      PowerMax messages we need to decode and make sense of in long evenings...
+    #   The received PDUs are in the debug log in the same "raw data" form as pmSendPdu so that replay.py can feed them back through the protocol
     def pmLogPdu(self, PDU, message):
-        a = 0
-        #log.debug("Logging PDU " + message + "   :    " + self.toString(PDU))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("[pmLogPdu] " + message + "    raw data " + self.toString(PDU))
 #        if pmLogDebug:
 #            logfile = pmLogFilename
 #            outf = io.open(logfile , 'a')
@@ -980,41 +1907,37 @@ class ProtocolBase(asyncio.Protocol):
     # Send an achnowledge back to the panel
     def pmSendAck(self, type_of_ack = False):
         """ Send ACK if packet is valid """
-        lastType = self.pmLastPDU[1]
-        #normalMode = (lastType >= 0x80) or ((lastType < 0x10) and (self.pmLastPDU[len(self.pmLastPDU) - 2] == 0x43))
-
-        log.debug("[sending ack] Sending an ack back to Alarm powerlink = {0}{1}".format(self.pmPowerlinkMode, type_of_ack))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("[sending ack] Sending an ack back to Alarm powerlink = {0}{1}".format(self.pmPowerlinkMode, type_of_ack))
         # There are 2 types of acknowledge that we can send to the panel
         #    Normal    : For a normal message
         #    Powerlink : For when we are in powerlink mode
         if self.pmPowerlinkMode or type_of_ack:   # type_of_ack is True when panel has sent us an AB message
-            #self.transport.write(bytearray.fromhex('0D 02 43 BA 0A'))
-            message = pmSendMsg["MSG_ACKLONG"]
-            assert(message is not None)
-            e = VisonicListEntry(command = message, options = None)
-            self.pmSendPdu(e)
+            command = pmSendMsg["MSG_ACKLONG"]    # 0D 02 43 BA 0A
         else:
-            #self.transport.write(bytearray.fromhex('0D 02 FD 0A'))
-            message = pmSendMsg["MSG_ACK"]
-            assert(message is not None)
-            e = VisonicListEntry(command = message, options = None)
-            self.pmSendPdu(e)
-        #yield from asyncio.sleep(0.25)
-        sleep(0.1)
-
-    def validatePDU(self, packet : bytearray) -> bool:
+            command = pmSendMsg["MSG_ACK"]        # 0D 02 FD 0A
+        # The frame is sent straight from pmSendFrame_t, an acknowledge does not go through the send queue so it does not need a VisonicListEntry
+        self.pmWriteFrame(command, pmSendFrame_t[command])
+        # give the panel a moment before we send it anything else, this does not hold up receiving or acknowledging messages
+        #    when the panel sends messages quicker than ACK_SEND_GAP do not keep putting off a message that is waiting to be sent
+        if len(self.SendList) == 0 or self.loop.time() >= self.pmSendPausedUntil:
+            self.pmPauseSending(ACK_SEND_GAP)
+
+    def validatePDU(self, packet) -> bool:
         """Verify if packet is valid.
             >>> Packets start with a preamble (\x0D) and end with postamble (\x0A)
         """
         # Validate a received message
+        if len(packet) < 3:
+            return False
         # Does it start with a header
-        if packet[:1] != b'\x0D':
+        if packet[0] != 0x0D:
             return False
         # Does it end with a footer
-        if packet[-1:] != b'\x0A':
+        if packet[-1] != 0x0A:
             return False
         # Check the CRC
-        if packet[-2:-1] == self.calculate_crc(packet[1:-2]):
+        if packet[-2] == self.calculate_checksum(packet[1:-2]):
             #log.debug("[validatePDU] VALID PACKET!")
             return True
 
@@ -1023,57 +1946,44 @@ class ProtocolBase(asyncio.Protocol):
 
     def calculate_crc(self, msg: bytearray):
         """ Calculate CRC Checksum """
-        #log.debug("[calculate_crc] Calculating for: %s", self.toString(msg))
-        # Calculate the checksum
-        checksum = 0
-        for char in msg[0:len(msg)]:
-            checksum += char
-        checksum = 0xFF - (checksum % 0xFF)
+        #log.debug("[calculate_crc] Calculating for: %s     calculated CRC is: %s", self.toString(msg), self.toString(bytearray([checksum])))
+        return bytearray([self.calculate_checksum(msg)])
+
+    # The checksum as an integer, msg can be anything that gives integers when iterated (bytes, bytearray or memoryview)
+    def calculate_checksum(self, msg) -> int:
+        checksum = 0xFF - (sum(msg) % 0xFF)
         if checksum == 0xFF:
             checksum = 0x00
-#            log.debug("[calculate_crc] Checksum was 0xFF, forsing to 0x00")
-        #log.debug("[calculate_crc] Calculating for: %s     calculated CRC is: %s", self.toString(msg), self.toString(bytearray([checksum])))
-        return bytearray([checksum])
+        return checksum
 
     def pmSendPdu(self, instruction : VisonicListEntry):
         """Encode and put packet string onto write buffer."""
 
-        if self.suspendAllOperations:
-            return
-            
-        # Send a command to the panel     
+        # Send a command to the panel
         command = instruction.command
-        data = command.data
-        # push in the options in to the appropriate places in the message. Examples are the pin or the specific command
-        if instruction.options != None:
-            # the length of instruction.options has to be an even number
-            # it is a list of couples:  bitoffset , bytearray to insert
-            op = int(len(instruction.options) / 2)
-            #log.debug("[pmSendPdu] Options {0} {1}".format(instruction.options, op))
-            for o in range(0, op):
-                s = instruction.options[o * 2]      # bit offset as an integer
-                a = instruction.options[o * 2 + 1]  # the bytearray to insert
-                #log.debug("[pmSendPdu] Options {0} {1} {2} {3} {4}".format(type(s), type(a), s, a, len(a)))
-                for i in range(0, len(a)):
-                    data[s + i] = a[i]
-                    #log.debug("[pmSendPdu]        Inserting at {0}".format(s+i))
-
-        #log.debug('[pmSendPdu] input data: %s', self.toString(packet))
-        # First add header (0x0D), then the packet, then crc and footer (0x0A)
-        sData = b'\x0D'
-        sData += data
-        sData += self.calculate_crc(data)
-        sData += b'\x0A'
+        if instruction.options is None and command in pmSendFrame_t:
+            sData = pmSendFrame_t[command]
+        else:
+            # push in the options in to the appropriate places in a new frame. Examples are the pin or the specific command
+            sData = pmEncodeFrame(command.data, instruction.options)
+        if self.pmWriteFrame(command, sData):
+            log.debug("[pmSendPdu]      waiting for message response {}".format([hex(no).upper() for no in self.pmExpectedResponse]))
 
+    # Write a complete frame (from pmEncodeFrame or pmSendFrame_t) to the panel, returns False when nothing was written
+    def pmWriteFrame(self, command : VisonicCommand, sData) -> bool:
+        if self.suspendAllOperations:
+            return False
         # Log some usefull information in debug mode
-        log.info("[pmSendPdu] Sending Command ({0})    raw data {1}".format(command.msg, self.toString(sData)))
+        if log.isEnabledFor(logging.INFO):
+            log.info("[pmSendPdu] Sending Command ({0})    raw data {1}".format(command.msg, self.toString(sData)))
         self.transport.write(sData)
-        log.debug("[pmSendPdu]      waiting for message response {}".format([hex(no).upper() for no in self.pmExpectedResponse]))
-        #yield from asyncio.sleep(0.25)
-        #sleep(0.1)
+        return True
 
     # This is called to queue a command.
     # If it is possible, then also send the message
+    #    options is a list of couples: byte offset, bytes to put in to the message
+    #    reply is an asyncio Future that is given the VisonicReply when all of the responses to the message have been received
+    #       (or the acknowledge if there aren't any), or a VisonicCommandError when it is not going to be
     def SendCommand(self, message_type, **kwargs):
         """ Add a command to the send List 
             The List is needed to prevent sending messages too quickly normally it requires 500msec between messages """
@@ -1086,9 +1996,12 @@ class ProtocolBase(asyncio.Protocol):
             message = pmSendMsg[message_type]
             assert(message is not None)
             options = kwargs.get('options', None)
-            e = VisonicListEntry(command = message, options = options)
-            self.SendList.append(e)
-            log.info("[QueueMessage] %s" % message.msg)
+            e = VisonicListEntry(command = message, options = options, message_type = message_type, queued = self.loop.time(), reply = kwargs.get('reply', None))
+            if self.SendList.append(e):
+                log.info("[QueueMessage] %s" % message.msg)
+            else:
+                log.warning("[QueueMessage] The {0} send queue is full, not sending {1}".format(e.priority, message.msg))
+                e.failed("the {0} send queue is full".format(e.priority))
 
         # self.pmExpectedResponse will prevent us sending another message to the panel
         #   If the panel is lazy or we've got the timing wrong........
@@ -1100,35 +2013,242 @@ class ProtocolBase(asyncio.Protocol):
                 log.info("[SendCommand] Re-Sending last message  {0}".format(self.pmLastSentMessage.command.msg))
                 self.pmSendPdu(self.pmLastSentMessage)
                 self.pmLastTransactionTime = self.pmTimeFunction()
+                self.pmPacing.sent(self.loop.time())
+                self.pmPacingBackoff("resend")
                 self.pmLastSentMessage.triedResendingMessage = True
+                self.pmGetCommandLatency(self.pmLastSentMessage).resends += 1
             else:
                 # tried resending once, no point in trying again so reset settings, start from scratch
                 log.info("[SendCommand] Tried Re-Sending last message but didn't work. Assume a powerlink timeout state and reset")
+                self.pmGetCommandLatency(self.pmLastSentMessage).failures += 1
+                self.pmLastSentMessage.failed("no reply from the panel after resending it")
                 self.triggerRestoreStatus() # this will call this function recursivelly to send the MSG_RESTORE.
                 return
-        elif len(self.SendList) > 0:    # This will send commands from the list, oldest first
-            if interval is not None and len(self.pmExpectedResponse) == 0: # we are ready to send
-                # check if the last command was sent at least 500 ms ago
-                td = timedelta(milliseconds=1000)
-                ok_to_send = (interval > td) # pmMsgTiming_t[pmTiming].wait)
-                #log.debug("[SendCommand]        ok_to_send {0}    {1}  {2}".format(ok_to_send, interval, td))
-                if ok_to_send:
-                    # pop the oldest item from the list, this could be the only item.
-                    instruction = self.SendList.pop(0)
+        elif len(self.SendList) > 0:    # This will send commands from the list, highest priority first and then oldest first
+            if len(self.pmExpectedResponse) == 0: # we are ready to send
+                # check that the pacing allows another message yet
+                now = self.loop.time()
+                ok_to_send = (now >= self.pmPacing.nextSendTime(now) and now >= self.pmSendPausedUntil)
+                # Hold back the user messages while downloading, the control messages still go so that the alarm can be armed and disarmed
+                instruction = self.SendList.pop(now, downloading = self.DownloadMode) if ok_to_send else None
+                # do not send a message when whoever was waiting for the reply has given up (e.g. timed out)
+                while instruction is not None and instruction.reply is not None and instruction.reply.cancelled():
+                    log.info("[SendCommand] Not sending {0}, nobody is waiting for it anymore".format(instruction.command.msg))
+                    instruction = self.SendList.pop(now, downloading = self.DownloadMode)
+                if instruction is not None:
                     # Do we have to receive an acknowledge from the panel before we sent more messages
                     #self.pmWaitingForAckFromPanel = instruction.command.waitforack
                     self.reset_keep_alive_messages()   # no need to send i'm alive message for a while as we're about to send a command anyway
                     self.pmLastTransactionTime = self.pmTimeFunction()
                     self.pmLastSentMessage = instruction
                     self.pmExpectedResponse.extend(instruction.response) # if an ack is needed it will already be in this list
+                    self.pmPacing.sent(now)
+                    instruction.sent = now
+                    self.pmGetCommandLatency(instruction).queue.add(1000 * (instruction.sent - instruction.queued))
                     self.pmSendPdu(instruction)
+        self.pmScheduleSend()
+
+    # Send a command and wait for its reply, see SendCommand
+    #    Return the VisonicReply, raise a VisonicCommandError if the command could not be sent or asyncio.TimeoutError if there's no reply in timeout seconds
+    async def SendCommandAsync(self, message_type, options = None, timeout = COMMAND_TIMEOUT) -> VisonicReply:
+        """ Send a command to the panel and wait for the reply """
+        reply = self.loop.create_future()
+        self.SendCommand(message_type, options = options, reply = reply)
+        return await asyncio.wait_for(reply, timeout)
+
+    # Set the send timer to call SendCommand when it can next do something
+    #    When we are waiting for a response that is when the last message can be resent,
+    #       otherwise if there's anything in the send queue it is when the gap after the last message has passed
+    #    The receiver calls this after each PDU so that a response that we were waiting for sends the next message straight away
+    #    It returns straight away when there is nothing to send, or the send timer is already set for the same reason as working it out
+    #       again would not make it any earlier (the resend time and the pacing only move later until something is sent)
+    def pmScheduleSend(self):
+        resend = len(self.pmExpectedResponse) > 0
+        if self.suspendAllOperations or (not resend and self.SendList.count == 0):
+            return
+        if self.pmSendTimerResend == resend and self.pmTimers.when("send") is not None:
+            return
+        now = self.loop.time()
+        if resend:
+            when = now + (self.pmLastTransactionTime + RESEND_MESSAGE_TIMEOUT - self.pmTimeFunction()).total_seconds()
+            if when <= now:
+                # the resend time has passed but we can't resend yet (e.g. during download), check again in a second
+                when = now + 1.0
+        else:
+            when = max(self.pmPacing.nextSendTime(now), self.pmSendPausedUntil)
+        # a timer that goes off earlier than needed does no harm, SendCommand sets it again
+        current = self.pmTimers.when("send")
+        if current is None or when < current:
+            self.pmTimers.set("send", when, self.pmSendTimerExpired)
+            self.pmSendTimerResend = resend
+
+    def pmSendTimerExpired(self):
+        self.SendCommand(None)
+
+    # Do not send anything from the send queue for the next seconds, the pause is scheduled rather than slept so the loop keeps running
+    def pmPauseSending(self, seconds):
+        self.pmSendPausedUntil = max(self.pmSendPausedUntil, self.loop.time() + seconds)
+
+    # A timer that does nothing but go off every LOOP_LAG_INTERVAL, so that pmTimers measures how late the event loop is even when
+    #    there is nothing else to do. Anything that blocks the loop (like a time.sleep) shows up in GetLoopLag
+    #    It is only started when PanelSettings["LoopLagMonitor"] is True as it keeps waking the loop
+    def loop_lag_timer(self):
+        self.pmTimers.set("looplag", self.loop.time() + LOOP_LAG_INTERVAL, self.loop_lag_timer)
+
+    # Return how late the timers have been (in milliseconds) as a dictionary with the count, min, mean, p50, p95, p99, max and buckets
+    def GetLoopLag(self) -> dict:
+        """ Return the event loop lag statistics """
+        return self.pmTimers.lag.summary()
+
+    # The latency statistics for the message type of instruction
+    def pmGetCommandLatency(self, instruction : VisonicListEntry) -> CommandLatency:
+        latency = self.pmCommandLatency.get(instruction.message_type)
+        if latency is None:
+            latency = CommandLatency()
+            self.pmCommandLatency[instruction.message_type] = latency
+        return latency
+
+    # The panel has acknowledged the last message that we sent
+    def pmAckReceived(self):
+        instruction = self.pmLastSentMessage
+        if instruction is not None and instruction.sent is not None and instruction.acked is None:
+            instruction.acked = self.loop.time()
+            self.pmGetCommandLatency(instruction).ack.add(1000 * (instruction.acked - instruction.sent))
+            self.pmPacing.ack(instruction.acked - instruction.sent)
+            PanelStatus["MessageGap"] = self.pmPacing.gap
+
+    # We have got all of the responses that we were waiting for to instruction, the last one was msgtype with data
+    def pmResponseComplete(self, instruction : VisonicListEntry, msgtype, data):
+        if instruction is not None:
+            instruction.replied(msgtype, data)
+        if instruction is not None and instruction.sent is not None:
+            now = self.loop.time()
+            self.pmGetCommandLatency(instruction).reply.add(1000 * (now - instruction.sent))
+            if instruction.acked is None:
+                # a message that doesn't wait for an ack, the reply tells us how quick the panel is instead
+                self.pmPacing.ack(now - instruction.sent)
+                PanelStatus["MessageGap"] = self.pmPacing.gap
+            log.debug("[data receiver] {0} complete after {1:.0f} ms, it was queued for {2:.0f} ms".format(instruction.message_type, 1000 * (now - instruction.sent), 1000 * (instruction.sent - instruction.queued)))
+            instruction.sent = None
+
+    # Return the latency statistics for each type of command sent to the panel as a dictionary, for example
+    #    { "MSG_ARM" : { "queue_ms" : {...}, "ack_ms" : {...}, "reply_ms" : {...}, "resends" : 0, "failures" : 0 } }
+    #    where each of the "_ms" entries has the count, min, mean, p50, p95, p99, max and the histogram buckets in milliseconds
+    def GetCommandLatency(self) -> dict:
+        """ Return the command latency statistics """
+        return { message_type : latency.summary() for message_type, latency in self.pmCommandLatency.items() }
+
+    # The panel has timed out, asked for a download retry or not answered a message, so slow down
+    def pmPacingBackoff(self, why):
+        self.pmPacing.backoff()
+        PanelStatus["MessageGap"] = self.pmPacing.gap
+        log.debug("[Pacing] Backing off after a {0}, the gap between messages is now {1:.2f} seconds".format(why, self.pmPacing.gap))
+
+    # Start the pacing from the gap that was learned for this panel type before, or the default for it
+    def pmLoadPacing(self):
+        gap = pmPacingDefault_t.get(self.PanelType, MESSAGE_SEND_GAP)
+        if PanelSettings["PacingFile"]:
+            try:
+                with open(PanelSettings["PacingFile"]) as f:
+                    learned = json.load(f)
+            except (OSError, ValueError) as e:
+                log.debug("[Pacing] Cannot read the pacing file {0}: {1}".format(PanelSettings["PacingFile"], e))
+                learned = {}
+            if not isinstance(learned, dict):
+                log.warning("[Pacing] The pacing file {0} is not a JSON object, using the default gap".format(PanelSettings["PacingFile"]))
+                learned = {}
+            saved = learned.get(pmPanelType_t.get(self.PanelType, "Unknown"), gap)
+            if isinstance(saved, (int, float)) and not isinstance(saved, bool):
+                gap = saved
+            else:
+                log.warning("[Pacing] The gap in the pacing file {0} is not a number, using the default gap".format(PanelSettings["PacingFile"]))
+        self.pmPacing.gap = min(PACING_MAX_GAP, max(PACING_MIN_GAP, gap))
+        PanelStatus["MessageGap"] = self.pmPacing.gap
+        log.debug("[Pacing] Starting with a gap between messages of {0:.2f} seconds".format(self.pmPacing.gap))
+
+    # Keep the learned gap for this panel type in the pacing file
+    def pmSavePacing(self):
+        if PanelSettings["PacingFile"] and self.PanelType is not None:
+            try:
+                try:
+                    with open(PanelSettings["PacingFile"]) as f:
+                        learned = json.load(f)
+                except (OSError, ValueError):
+                    learned = {}
+                if not isinstance(learned, dict):
+                    learned = {}
+                learned[pmPanelType_t.get(self.PanelType, "Unknown")] = self.pmPacing.gap
+                with open(PanelSettings["PacingFile"], 'w') as f:
+                    json.dump(learned, f, indent = 2, sort_keys = True)
+            except OSError as e:
+                log.warning("[Pacing] Cannot write the pacing file {0}: {1}".format(PanelSettings["PacingFile"], e))
+
+    # Return the learned gap between messages (in seconds), the tokens in the bucket and the number of prompt acks and back offs
+    def GetPacing(self) -> dict:
+        """ Return the message pacing details """
+        return self.pmPacing.summary()
+
+    # Return the depth, the largest depth, the limit, the number of messages dropped and the wait time (as in GetCommandLatency)
+    #    of each priority class of the send queue as a dictionary, for example { "control" : { "depth" : 0, ... }, "user" : ... }
+    def GetSendQueueStats(self) -> dict:
+        """ Return the send queue statistics """
+        return self.SendList.summary()
+
+    # Set how long, in seconds, to gather the sensor changes for before calling the change handlers, 0 to call them straight away
+    def SetCoalesceWindow(self, seconds):
+        """ Set the sensor change coalescing window """
+        self.pmCoalescer.window = seconds
+        if seconds <= 0:
+            self.pmCoalescer.flush()
+
+    # Set a handler that is called with a list of SensorChange each time that sensor changes are delivered, None to remove it
+    #    When the changes are being coalesced this is once for each window
+    def SetChangeBatchHandler(self, handler):
+        """ Set the sensor change batch handler """
+        self.pmCoalescer.batch_handler = handler
+
+    # Return the coalescing window and how many sensor changes were received, folded in to another change for the same sensor,
+    #    cancelled (changed back in the window), delivered straight away as an alarm and delivered, the number of batches and how many are waiting
+    def GetCoalesceStats(self) -> dict:
+        """ Return the sensor change coalescing statistics """
+        return self.pmCoalescer.summary()
+
+    # Set where the event_callback, the sensor change handlers, the change batch handler and the disconnect_callback are called
+    #    target is None to call them straight away while the message from the panel is being decoded, an asyncio loop
+    #    (for example the consumer's loop when the connection is in its own thread) or a concurrent.futures.Executor
+    #    limit is the most callbacks that can wait and overflow (one of CALLBACK_OVERFLOW) what to do when that many are waiting
+    #    Callbacks that are already waiting are still delivered to the old target
+    def SetCallbackTarget(self, target, limit = None, overflow = None):
+        """ Set the loop or executor that the callbacks are called on """
+        if overflow is not None and overflow not in CALLBACK_OVERFLOW:
+            raise ValueError("overflow must be one of {0}".format(CALLBACK_OVERFLOW))
+        old = self.pmDelivery
+        delivery = VisonicDelivery(target, old.limit if limit is None else limit, old.overflow if overflow is None else overflow)
+        self.pmDelivery = delivery
+        self.pmCoalescer.delivery = delivery
+        self.pmSensorDev_t.delivery = delivery
+        for sensor in self.pmSensorDev_t.values():
+            sensor._delivery = delivery
+
+    # Return the callback target, the depth of the callback queue, its largest depth, limit and overflow, the number of callbacks
+    #    dropped, delivered and that raised an exception, and the time from queueing to calling them (as in GetCommandLatency)
+    def GetCallbackStats(self) -> dict:
+        """ Return the callback delivery statistics """
+        return self.pmDelivery.summary()
+
+    def ResetCommandLatency(self):
+        """ Start the command latency statistics again """
+        self.pmCommandLatency = {}
 
     # Clear the send queue and reset the associated parameters
     def ClearList(self):
         """ Clear the List, preventing any retry causing issue. """
         # Clear the List
         log.debug("[ClearList] Setting queue empty")
-        self.SendList = []
+        for instruction in self.SendList.clear():
+            instruction.failed("the send queue was cleared")
+        if self.pmLastSentMessage is not None:
+            self.pmLastSentMessage.failed("the send queue was cleared")
         self.pmLastSentMessage = None
 
     # This is called by the parent when the connection is lost
@@ -1139,17 +2259,29 @@ class ProtocolBase(asyncio.Protocol):
         else:
             log.debug('ERROR Connection Lost : disconnected because of close/abort.')
         self.suspendAllOperations = True
-        sleep(5.0) # i bit of time for the watchdog timers and keep alive loops to self terminate
+        # the sensor changes that are waiting for the coalesce timer would be lost with it, so deliver them first
+        self.pmCoalescer.flush()
+        # stop all of the timers and tasks straight away
+        self.pmTimers.close()
+        for task in list(self.pmTasks):
+            task.cancel()
+        for instruction in self.SendList.clear():
+            instruction.failed("the connection was lost")
+        if self.pmLastSentMessage is not None:
+            self.pmLastSentMessage.failed("the connection was lost")
+        if self.pmEventLogReply is not None and not self.pmEventLogReply.done():
+            self.pmEventLogReply.set_exception(VisonicCommandError("Retrieving Event Log: the connection was lost"))
+        self.pmSavePacing()
         if self.disconnect_callback:
-            self.disconnect_callback(exc)
+            self.pmDelivery.deliver(self.disconnect_callback, exc)
 
-    async def download_timer(self):
-        # sleep for the duration that download is supposed to take
-        await asyncio.sleep(DOWNLOAD_TIMEOUT)
-        # if we're still doing download then do something
+    # The download has taken longer than DOWNLOAD_TIMEOUT
+    def download_timer(self):
+        # if we're still doing download then give up on it, otherwise DownloadMode would hold back the user messages for ever
         if self.DownloadMode:
             log.warning("********************** Download Timer has Expired, Download has taken too long *********************")
-            # what to do here??????????????
+            self.DownloadMode = False
+            self.SendCommand("MSG_EXIT")
 
     # This puts the panel in to download mode. It is the start of determining powerlink access
     def Start_Download(self):
@@ -1161,7 +2293,7 @@ class ProtocolBase(asyncio.Protocol):
             log.info("[Start_Download] Starting download mode")
             self.SendCommand("MSG_DOWNLOAD", options = [3, DownloadCode]) #
             self.DownloadMode = True
-            asyncio.ensure_future(self.download_timer(), loop = self.loop)
+            self.pmTimers.set("download", self.loop.time() + DOWNLOAD_TIMEOUT, self.download_timer)
         else:
             log.debug("[Start_Download] Already in Download Mode (so not doing anything)")
 
@@ -1205,8 +2337,8 @@ class ProtocolBase(asyncio.Protocol):
         """ Auto enroll the PowerMax/Master unit """
         if not self.doneAutoEnroll:
             self.doneAutoEnroll = True
-            #yield from asyncio.sleep(1.0)
-            sleep(1.0)
+            # give the panel a moment before the enroll is sent, the messages queued after it wait too
+            self.pmPauseSending(ENROLL_SEND_GAP)
             log.info("[SendMsg_ENROLL]  download pin will be " + self.toString(DownloadCode))
             # Remove anything else from the List, we need to restart
             self.pmExpectedResponse = []
@@ -1252,13 +2384,20 @@ class PacketHandling(ProtocolBase):
             self.exclude_sensor_list = excludes
         self.pmPhoneNr_t = {}
         self.pmEventLogDictionary = {}
+        self.eventCount = 0
+        # an asyncio Future that is given the event log when all of it has been received, see GetEventLogAsync
+        self.pmEventLogReply = None
         # We do not put these pin codes in to the panel status
         self.pmPincode_t = [ ]  # allow maximum of 48 user pin codes
 
         self.lastSendOfDownloadEprom = self.pmTimeFunction() - timedelta(seconds=100)  # take off 100 seconds so the first command goes through immediately
         
         # Store the sensor details
-        self.pmSensorDev_t = {}
+        self.pmSensorDev_t = VisonicSensors()
+        # Gathers the sensor changes for PanelSettings["CoalesceWindow"] seconds, see SetCoalesceWindow
+        self.pmCoalescer = VisonicCoalescer(self.pmTimers, PanelSettings["CoalesceWindow"], self.pmDelivery)
+        self.pmSensorDev_t.coalescer = self.pmCoalescer
+        self.pmSensorDev_t.delivery = self.pmDelivery
         # Used to deepcopy to see if anything has changed with the sensors
         self.pmSensorDevOld_t = {}
 
@@ -1267,6 +2406,8 @@ class PacketHandling(ProtocolBase):
         self.pmRemoteDisArm = PanelSettings["EnableRemoteDisArm"] # INTERFACE : Does the user allow remote disarming of the alarm
         self.pmSensorBypass = PanelSettings["EnableSensorBypass"] # INTERFACE : Does the user allow sensor bypass, True or False
         self.MotionOffDelay = PanelSettings["MotionOffDelay"]     # INTERFACE : Get the motion sensor off delay time (between subsequent triggers)
+        self.pmZoneOffDelay = dict(PanelSettings["ZoneOffDelay"]) # INTERFACE : Get the motion sensor off delay time for individual zones
+        self.pmDecodeB0Zones = PanelSettings["PowerMasterZoneMasks"]  # Decode the PowerMaster B0 zone bitmasks
         self.pmAutoCreate = True # What else can we do????? # PanelSettings["AutoCreate"]         # INTERFACE : Whether to automatically create devices
         self.OverrideCode = PanelSettings["OverrideCode"]         # INTERFACE : Get the override code (must be set if forced standard and not powerlink)
 
@@ -1277,69 +2418,112 @@ class PacketHandling(ProtocolBase):
         # Status in "Starting" mode
         PanelStatus["Mode"] = "Starting"
         
-        # These are used in the A5 message to reduce processing but mainly to reduce the amount of callbacks in to HA when nothing changes
-        self.lowbatt_old = -1
-        self.tamper_old = -1
-        self.enrolled_old = 0   # means nothing enrolled
-        self.status_old = -1
-        self.bypass_old = -1
-
-        asyncio.ensure_future(self.reset_triggered_state_timer(), loop=self.loop)
+        # The last zone bitmasks from the A5 messages, None until the first one. Only the zones that have changed from these are updated,
+        #    to reduce processing but mainly to reduce the amount of callbacks in to HA when nothing changes
+        self.pmZoneMask = { name : None for name in ZONE_MASKS }
+
+        # The published VisonicState, the PanelStatus and the sensor snapshots in it, and what is waiting for the next one
+        self.pmState = NO_STATE
+        self.pmStatePanel = {}
+        self.pmStatePanelVersion = None     # the PanelStatus.version that pmStatePanel is a copy of
+        self.pmStateSensors = {}
+        self.pmStateCondition = threading.Condition()
+        self.pmStateWaiters = []
+        self.pmPublishState()
+
+    # Publish a new VisonicState when PanelStatus or a sensor has changed since the last one. This is called after each message from the panel
+    #    and each timer, so when nothing has changed it only looks at the PanelStatus version and the flags of pmSensorDev_t
+    #    The dictionaries in the old state are not changed, new ones are made, so a thread reading the old state sees it all from before
+    def pmPublishState(self):
+        sensors = self.pmSensorDev_t
+        if not sensors.changed and not sensors.dirty and PanelStatus.version == self.pmStatePanelVersion:
+            return
+        panel = PanelStatus.version != self.pmStatePanelVersion
+        if panel:
+            self.pmStatePanel = dict(PanelStatus)
+            self.pmStatePanelVersion = PanelStatus.version
+        changed = []
+        if sensors.changed:
+            # a sensor has been added or removed, start again
+            sensors.changed = False
+            changed = list(sensors)
+            self.pmStateSensors = {}
+        elif sensors.dirty:
+            changed = [slot for slot, sensor in sensors.items() if sensor._changed]
+            if len(changed) > 0:
+                self.pmStateSensors = dict(self.pmStateSensors)
+            elif not panel:
+                sensors.dirty = False
+                return
+        sensors.dirty = False
+        for slot in changed:
+            sensor = sensors[slot]
+            sensor._changed = False
+            self.pmStateSensors[slot] = sensor.snapshot()
+        state = VisonicState(self.pmState.version + 1, self.pmStatePanel.get("Mode"),
+                             types.MappingProxyType(self.pmStatePanel), types.MappingProxyType(self.pmStateSensors))
+        with self.pmStateCondition:
+            self.pmState = state
+            self.pmStateCondition.notify_all()
+        waiters = self.pmStateWaiters
+        self.pmStateWaiters = []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(state)
+
     
     
-    async def reset_triggered_state_timer(self):
+    # The trigger timer of the sensor in slot goes off when it has been triggered for its motion off delay, set triggered back to False
+    def reset_triggered_state_timer(self, slot):
         """ reset triggered state"""
-        while not self.suspendAllOperations:
-            # cycle through the sensors and set the triggered value back to False after the timeout duration
-            for key in self.pmSensorDev_t:
-                if self.pmSensorDev_t[key].triggered:
-                    interval = self.pmTimeFunction() - self.pmSensorDev_t[key].triggertime
-                    td = timedelta(seconds=self.MotionOffDelay)  # at least self.MotionOffDelay seconds as it also depends on the frequency the panel sends messages
-                    if interval > td:
-                        self.pmSensorDev_t[key].triggered = False
-                        self.pmSensorDev_t[key].pushChange()
-            # check every 2 seconds
-            await asyncio.sleep(2.0)  # must be less than 5 seconds for self.suspendAllOperations:
+        sensor = self.pmSensorDev_t.get(slot)
+        if sensor is not None and sensor.triggered:
+            sensor.triggered = False
+            self.pmSensorDev_t.touch(slot)
+            sensor.pushChange()
+
+    # The sensor in slot has just been triggered, set (or move on if it is triggered again) its trigger timer for when its motion off delay has gone by
+    #    Each triggered sensor has its own timer in pmTimers, so nothing is done for the sensors that are not triggered
+    def pmSensorTriggered(self, slot):
+        self.pmSensorDev_t.touch(slot)
+        delay = self.pmZoneOffDelay.get(slot + 1, self.MotionOffDelay)
+        self.pmTimers.set("trigger {0}".format(slot), self.loop.time() + delay, partial(self.reset_triggered_state_timer, slot))
+
+    # The sensor in slot is no longer triggered, cancel its trigger timer
+    def pmSensorReset(self, slot):
+        self.pmSensorDev_t.touch(slot)
+        self.pmTimers.cancel("trigger {0}".format(slot))
 
             
     # pmWriteSettings: add a certain setting to the settings table
     #  So, to explain
     #      When we send a MSG_DL and insert the 4 bytes from pmDownloadItem_t, what we're doing is setting the page, index and len
+    #      The setting is written straight in to the 256 byte page(s) of the EPROM image, it can be a memoryview of the received message
     def pmWriteSettings(self, page, index, setting):
         settings_len = len(setting)
         wrap = (index + settings_len - 0x100)
-        sett = [bytearray(b''), bytearray(b'')]
+        sett = [setting, None]
 
         if settings_len > 0xB1:
             log.info("[Write Settings] Write Settings too long *****************")
             return
         if wrap > 0:
-            sett[0] = setting[ : settings_len - wrap - 1]
+            sett[0] = setting[ : settings_len - wrap]
             sett[1] = setting[settings_len - wrap : ]
             wrap = 1
         else:
-            sett[0] = setting
             wrap = 0
 
         for i in range(0, wrap+1):
             if (page + i) not in self.pmRawSettings:
-                self.pmRawSettings[page + i] = bytearray()
-                for v in range(0, 256):
-                    self.pmRawSettings[page + i].append(255)
-                if len(self.pmRawSettings[page + i]) != 256:
-                    log.info("[Write Settings] The EPROM settings is incorrect for page {0}".format(page+i))
-                #else:
-                #    log.debug("[Write Settings] WHOOOPEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEE")
+                self.pmRawSettings[page + i] = bytearray(b'\xFF' * 0x100)
 
             settings_len = len(sett[i])
             if i == 1:
                 index = 0
             #log.debug("[Write Settings] Writing settings page {0}  index {1}    setting {2}".format(page+i, index, self.toString(sett[i])))
-            self.pmRawSettings[page + i] = self.pmRawSettings[page + i][0:index] + sett[i] + self.pmRawSettings[page + i][index + settings_len :]
-            if len(self.pmRawSettings[page + i]) != 256:
-                log.info("[Write Settings] OOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOO len = {0}".format(len(self.pmRawSettings[page + i])))
-            #else:
-            #    log.debug("[Write Settings] Page {0} is now {1}".format(page+i, self.toString(self.pmRawSettings[page + i])))
+            self.pmRawSettings[page + i][index : index + settings_len] = sett[i]
+            #log.debug("[Write Settings] Page {0} is now {1}".format(page+i, self.toString(self.pmRawSettings[page + i])))
 
     # pmReadSettings
     def pmReadSettingsA(self, page, index, settings_len):
@@ -1634,10 +2818,13 @@ class PacketHandling(ProtocolBase):
                                 self.pmSensorDev_t[i].dname="Z{0:0>2}".format(i+1)
                                 self.pmSensorDev_t[i].partition = part
                                 self.pmSensorDev_t[i].id=i+1
+                                self.pmSensorDev_t.reindex(i)
+                                self.pmSensorDev_t.touch(i)
                             elif (i+1) not in self.exclude_sensor_list:
                                 self.pmSensorDev_t[i] = SensorDevice(stype = sensorTypeStr, sid = sensorID_c, ztype = zoneType,
                                              ztypeName = pmZoneType_t[self.pmLang][zoneType], zname = zoneName, zchime = pmZoneChime_t[zoneChime],
                                              dname="Z{0:0>2}".format(i+1), partition = part, id=i+1)
+                                self.pmSetFromZoneMasks(i)
                                 visonic_devices['sensor'].append(self.pmSensorDev_t[i])
 
                             if i in self.pmSensorDev_t:
@@ -1721,7 +2908,7 @@ class PacketHandling(ProtocolBase):
                 PanelStatus["Devices"] = devices
 
                 if self.event_callback is not None:
-                    self.event_callback( visonic_devices )
+                    self.pmDelivery.deliver(self.event_callback, visonic_devices)
 
             # INTERFACE : Create Partitions in the interface
             #for i in range(1, 2): # TODO: partitionCnt
@@ -1792,6 +2979,7 @@ class PacketHandling(ProtocolBase):
             PanelStatus["Mode"] = "Standard"
             self.SendCommand("MSG_STATUS")
         log.info("[Process Settings] Ready for use")
+        self.pmSavePacing()
         self.DumpSensorsToDisplay()
 
     def handle_packet(self, packet):
@@ -1799,47 +2987,20 @@ class PacketHandling(ProtocolBase):
 
         # during early initialisation we need to ignore all incoming data to establish a known state in the panel
         if self.coordinating_powerlink:
-            self.receive_log.append(packet)
+            self.receive_log.append(bytes(packet))   # a copy, packet is only valid until the next PDU
             return
 
         #log.debug("[handle_packet] Parsing complete valid packet: %s", self.toString(packet))
 
         if len(packet) < 4:  # there must at least be a header, command, checksum and footer
             log.warning("[handle_packet] Received invalid packet structure, not processing it " + self.toString(packet))
-        elif packet[1] == 0x02: # ACK
-            self.handle_msgtype02(packet[2:-2])  # remove the header and command bytes as the start. remove the footer and the checksum at the end
-        elif packet[1] == 0x06: # Timeout
-            self.handle_msgtype06(packet[2:-2])
-        elif packet[1] == 0x08: # Access Denied
-            self.handle_msgtype08(packet[2:-2])
-        elif packet[1] == 0x0B: # Stopped
-            self.handle_msgtype0B(packet[2:-2])
-        elif packet[1] == 0x25: # Download retry
-            self.handle_msgtype25(packet[2:-2])
-        elif packet[1] == 0x33: # Settings send after a MSGV_START
-            self.handle_msgtype33(packet[2:-2])
-        elif packet[1] == 0x3c: # Message when start the download
-            self.handle_msgtype3C(packet[2:-2])
-        elif packet[1] == 0x3f: # Download information
-            self.handle_msgtype3F(packet[2:-2])
-        elif packet[1] == 0xa0: # Event log
-            self.handle_msgtypeA0(packet[2:-2])
-        elif packet[1] == 0xa3: # Event log
-            self.handle_msgtypeA3(packet[2:-2])
-        elif packet[1] == 0xa5: # General Event
-            self.handle_msgtypeA5(packet[2:-2])
-        elif packet[1] == 0xa6: # General Event
-            self.handle_msgtypeA6(packet[2:-2])
-        elif packet[1] == 0xa7: # General Event
-            self.handle_msgtypeA7(packet[2:-2])
-        elif packet[1] == 0xab and not self.ForceStandardMode: # PowerLink Event. Only process AB if not forced standard
-            self.handle_msgtypeAB(packet[2:-2])
-        elif packet[1] == 0xb0: # PowerMaster Event
-            self.handle_msgtypeB0(packet[2:-2])
+            return
+
+        message = self.pmMessageTable_t.get(packet[1])
+        if message is not None and message.handler is not None:
+            message.handler(self, packet[2:-2])  # remove the header and command bytes as the start. remove the footer and the checksum at the end
         else:
             log.info("[handle_packet] Unknown/Unhandled packet type {0}".format(packet[1:2]))
-        # clear our buffer again so we can receive a new packet.
-        self.ReceiveData = bytearray(b'')
 
     def displayzonebin(self, bits):
         """ Display Zones in reverse binary format
@@ -1851,14 +3012,19 @@ class PacketHandling(ProtocolBase):
         # Normal acknowledges have msgtype 0x02 but no data, when in powerlink the panel also sends data byte 0x43
         #    I have not found this on the internet, this is my hypothesis
         log.debug("[handle_msgtype02] Ack Received  data = {0}".format(self.toString(data)))
-        while 0x02 in self.pmExpectedResponse:
-            self.pmExpectedResponse.remove(0x02)
+        if 0x02 in self.pmExpectedResponse:
+            self.pmAckReceived()
+            while 0x02 in self.pmExpectedResponse:
+                self.pmExpectedResponse.remove(0x02)
+            if len(self.pmExpectedResponse) == 0:
+                self.pmResponseComplete(self.pmLastSentMessage, 0x02, data)
         #self.pmWaitingForAckFromPanel = False
 
     def handle_msgtype06(self, data):
         """ MsgType=06 - Time out
         Timeout message from the PM, most likely we are/were in download mode """
         log.info("[handle_msgtype06] Timeout Received  data {0}".format(self.toString(data)))
+        self.pmPacingBackoff("timeout")
         if self.DownloadMode:
             self.DownloadMode = False
             self.SendCommand("MSG_EXIT")
@@ -1870,6 +3036,13 @@ class PacketHandling(ProtocolBase):
 
     def handle_msgtype08(self, data):
         log.info("[handle_msgtype08] Access Denied  len {0} data {1}".format(len(data), self.toString(data)))
+        # tell whoever is waiting for the last command that it was denied, probably the wrong pin code was used
+        if self.pmLastSentMessage is not None:
+            self.pmLastSentMessage.failed("access denied by the panel")
+        # the panel will not go in to download mode with the wrong download code, so stop waiting for it
+        if self.DownloadMode:
+            self.DownloadMode = False
+            self.pmTimers.cancel("download")
 
 #        if self.pmLastSentMessage is not None:
 #            lastCommandData = self.pmLastSentMessage.command.data
@@ -1887,6 +3060,7 @@ class PacketHandling(ProtocolBase):
         log.info("[handle_msgtype0B] Stop    data is {0}".format(self.toString(data)))
         # This is the message to tell us that the panel has finished download mode, so we too should stop download mode
         self.DownloadMode = False
+        self.pmTimers.cancel("download")
         self.pmExpectedResponse = []
         #self.pmWaitingForAckFromPanel = False
         if self.pmLastSentMessage is not None:
@@ -1907,11 +3081,12 @@ class PacketHandling(ProtocolBase):
         # Format: <MsgType> <?> <?> <delay in sec>
         iDelay = data[2]
         log.info("[handle_msgtype25] Download Retry, have to wait {0} seconds     data is {1}".format(iDelay, self.toString(data)))
+        self.pmPacingBackoff("download retry")
         # self.loop.call_later(int(iDelay), self.download_retry())
         self.DownloadMode = False
         self.doneAutoEnroll = False
         ## dont bother with another download attemp as they never work, attempt to start again
-        asyncio.ensure_future(self.coordinate_powerlink_startup(4), loop = self.loop)
+        self.pmStartTask(self.coordinate_powerlink_startup(4))
         #asyncio.ensure_future(self.download_retry(int(iDelay) * 2), loop = self.loop)
 
 #    async def download_retry(self, d):
@@ -1927,8 +3102,8 @@ class PacketHandling(ProtocolBase):
         Message send after a MSG_START. We will store the information in an internal array/collection """
 
         if len(data) != 10:
-            log.info("[handle_msgtype33] ERROR: MSGTYPE=0x33 Expected len=14, Received={0}".format(len(self.ReceiveData)))
-            log.info("[handle_msgtype33]                            " + self.toString(self.ReceiveData))
+            log.info("[handle_msgtype33] ERROR: MSGTYPE=0x33 Expected len=14, Received={0}".format(len(data) + 4))
+            log.info("[handle_msgtype33]                            " + self.toString(data))
             return
 
         # Data Format is: <index> <page> <8 data bytes>
@@ -1947,7 +3122,9 @@ class PacketHandling(ProtocolBase):
            4=Sub model type of the panel - just informational, not used
            """
         self.ModelType = data[4]
-        self.PanelType = data[5]
+        if self.PanelType != data[5]:
+            self.PanelType = data[5]
+            self.pmLoadPacing()
 
         self.PowerMaster = (self.PanelType >= 7)
         modelname = pmPanelType_t[self.PanelType] or "UNKNOWN"  # INTERFACE set this in the user interface
@@ -2006,7 +3183,7 @@ class PacketHandling(ProtocolBase):
         # Check length and data-length
         if iLength != len(data) - 3:  # 3 because -->   index & page & length
             log.info("[handle_msgtype3F] ERROR: Type=3F has an invalid length, Received: {0}, Expected: {1}".format(len(data)-3, iLength))
-            log.info("[handle_msgtype3F]                            " + self.toString(self.ReceiveData))
+            log.info("[handle_msgtype3F]                            " + self.toString(data))
             return
 
         # Write to memory map structure, but remove the first 4 bytes (3F/index/page/length) from the data
@@ -2021,6 +3198,7 @@ class PacketHandling(ProtocolBase):
         if eventNum == 0x01:
             log.debug("[handle_msgtypeA0] Eventlog received")
             self.eventCount = data[0]
+            self.pmEventLogDictionary = {}
         else:
             iSec = data[2]
             iMin = data[3]
@@ -2031,7 +3209,7 @@ class PacketHandling(ProtocolBase):
 
             iEventZone = data[8]
             iLogEvent = data[9]
-            zoneStr = pmLogUser_t[iEventZone] or "UNKNOWN"
+            zoneStr = self.pmLogUser(iEventZone)
             eventStr = pmLogEvent_t[self.pmLang][iLogEvent] or "UNKNOWN"
 
             idx = eventNum - 1
@@ -2054,6 +3232,8 @@ class PacketHandling(ProtocolBase):
             #self.pmEventLogDictionary.items = idx
             #self.pmEventLogDictionary.done = (eventNum == self.eventCount)
             log.debug("Log Event {0}".format(self.pmEventLogDictionary[idx]))
+            if eventNum == self.eventCount and self.pmEventLogReply is not None and not self.pmEventLogReply.done():
+                self.pmEventLogReply.set_result([self.pmEventLogDictionary[i] for i in sorted(self.pmEventLogDictionary)])
 
             
     def handle_msgtypeA3(self, data):
@@ -2064,10 +3244,11 @@ class PacketHandling(ProtocolBase):
         for i in range(0, 8):
             zoneName = pmZoneName_t[int(data[2+i])]
             log.info("                        Zone name for {0} is {1}".format( offset+i+1, zoneName ))
-            if offset+i in self.pmSensorDev_t:
-                if not self.pmSensorDev_t[offset+i].zname:     # if not already set
-                    self.pmSensorDev_t[offset+i].zname = zoneName
-                    self.pmSensorDev_t[offset+i].pushChange()
+            sensor = self.pmSensorDev_t.zone(offset+i+1)
+            if sensor is not None:
+                if not sensor.zname:     # if not already set
+                    sensor.zname = zoneName
+                    sensor.pushChange()
                     log.info("                        Found Sensor")
         
     def handle_msgtypeA6(self, data):
@@ -2112,13 +3293,71 @@ class PacketHandling(ProtocolBase):
 		 #    c) the system is armed home (mode = 5) and the zone is not interior(-follow) (6,12)
 #         armed = ((zoneType > 0) and (sensor['bypass'] ~= true) and ((alwaysOn[zoneType] ~= nil) or (mode == 0x5) or ((mode == 0x4) and (zoneType % 6 ~= 0)))) and "1" or "0"
 
+    # Yield the bit number of each bit that is set in mask, lowest first
+    def pmZoneBits(self, mask):
+        while mask != 0:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask = mask ^ low
+
+    # Store the zone bitmask name (e.g. "status") from a message, return a bitmask of the zones that have changed since the last one
+    #    covered is a bitmask of the zones that are in the message (ZONE_MASK_A5 for zones 1 to 32), the other zones are left as they are
+    def pmZoneMaskChanged(self, name, val, covered = ZONE_MASK_A5) -> int:
+        old = self.pmZoneMask[name]
+        if old is None:
+            self.pmZoneMask[name] = val
+            return covered
+        new = (old & ~covered) | (val & covered)
+        self.pmZoneMask[name] = new
+        return old ^ new
+
+    # Set the attribute name (e.g. "lowbatt") of the sensors in zones (a bitmask) from val, the sensors are added to changed
+    #    A sensor is triggered when its status is set
+    def pmUpdateZones(self, name, val, zones, changed):
+        for i in self.pmZoneBits(zones):
+            sensor = self.pmSensorDev_t.get(i)
+            if sensor is not None:
+                value = (val >> i) & 1 != 0
+                if name == "status" and value and not sensor.status:
+                    sensor.triggered = True
+                    sensor.triggertime = self.pmTimeFunction()
+                    self.pmSensorTriggered(i)
+                setattr(sensor, name, value)
+                self.pmSensorDev_t.touch(i)
+                changed[i] = sensor
+
+    # Set or clear the bit for zone i in the zone bitmask name, when the state of a zone comes from a zone event instead of a bitmask
+    def pmSetZoneBit(self, name, i, value):
+        mask = self.pmZoneMask[name]
+        if mask is not None:
+            self.pmZoneMask[name] = (mask | (1 << i)) if value else (mask & ~(1 << i))
+
+    # A new sensor for zone i gets its status, low battery, tamper and bypass from the zone bitmasks that we already have
+    def pmSetFromZoneMasks(self, i):
+        sensor = self.pmSensorDev_t[i]
+        for name in ("status", "lowbatt", "tamper", "bypass"):
+            mask = self.pmZoneMask[name]
+            if mask is not None:
+                setattr(sensor, name, (mask >> i) & 1 != 0)
+        # these are the values that the sensor starts with, not changes, so they are not pushed (when changes are being coalesced
+        #    pushChange would give them to the change handler later as a change)
+        sensor._pushed = sensor.snapshot()
+
+    # Call the change handler once for each of the sensors that changed in a message
+    def pmPushChanges(self, changed):
+        for sensor in changed.values():
+            sensor.pushChange()
+
+    # The name of the zone or user in a log event (e.g. "Zone 01"), PowerMaster panels have more of them
+    def pmLogUser(self, user) -> str:
+        users = pmLogPowerMasterUser_t if self.PowerMaster else pmLogUser_t
+        if 0 <= user < len(users):
+            return users[user]
+        return "UNKNOWN"
+
     def makeInt(self, data) -> int:
         if len(data) == 4:
-            val = data[0]
-            val = val + (0x100 * data[1])
-            val = val + (0x10000 * data[2])
-            val = val + (0x1000000 * data[3])
-            return int(val)
+            return int.from_bytes(data, 'little')
         return 0
 
     # captured examples of A5 data
@@ -2138,27 +3377,20 @@ class PacketHandling(ProtocolBase):
                 log.debug("Got A5 02 message, resetting watchdog")
                 self.reset_watchdog_timeout()
 
+            changed = {}
             val = self.makeInt(data[2:6])
-            if val != self.status_old:
-                self.status_old = val
+            zones = self.pmZoneMaskChanged("status", val)
+            if zones != 0:
                 log.debug("[handle_msgtypeA5]      Open Door/Window Status Zones 32-01: {:032b}".format(val))
-                for i in range(0, 32):
-                    if i in self.pmSensorDev_t:
-                        alreadyset = self.pmSensorDev_t[i].status
-                        self.pmSensorDev_t[i].status = (val & (1 << i) != 0)
-                        if not alreadyset and self.pmSensorDev_t[i].status:
-                            self.pmSensorDev_t[i].triggered = True
-                            self.pmSensorDev_t[i].triggertime = self.pmTimeFunction()
-                        self.pmSensorDev_t[i].pushChange()
+                self.pmUpdateZones("status", val, zones, changed)
 
             val = self.makeInt(data[6:10])
-            if val != self.lowbatt_old:
-                self.lowbatt_old = val
+            zones = self.pmZoneMaskChanged("lowbatt", val)
+            if zones != 0:
                 log.debug("[handle_msgtypeA5]      Battery Low Zones 32-01: {:032b}".format(val))
-                for i in range(0, 32):
-                    if i in self.pmSensorDev_t:
-                        self.pmSensorDev_t[i].lowbatt = (val & (1 << i) != 0)
-                        self.pmSensorDev_t[i].pushChange()
+                self.pmUpdateZones("lowbatt", val, zones, changed)
+
+            self.pmPushChanges(changed)
 
         elif eventType == 0x03: # Tamper Event
             val = self.makeInt(data[2:6])
@@ -2170,13 +3402,12 @@ class PacketHandling(ProtocolBase):
             #        self.pmSensorDev_t[i].status = (val & (1 << i) != 0)
 
             val = self.makeInt(data[6:10])
-            if val != self.tamper_old:
-                self.tamper_old = val
+            zones = self.pmZoneMaskChanged("tamper", val)
+            if zones != 0:
                 log.debug("[handle_msgtypeA5]      Tamper Zones 32-01: {:032b}".format(val))
-                for i in range(0, 32):
-                    if i in self.pmSensorDev_t:
-                        self.pmSensorDev_t[i].tamper = (val & (1 << i) != 0)
-                        self.pmSensorDev_t[i].pushChange()
+                changed = {}
+                self.pmUpdateZones("tamper", val, zones, changed)
+                self.pmPushChanges(changed)
 
         elif eventType == 0x04: # Zone event
             sysStatus = data[2]
@@ -2193,12 +3424,11 @@ class PacketHandling(ProtocolBase):
             # Examine zone tripped status
             if eventZone != 0:
                 log.debug("[handle_msgtypeA5]      Event {0} in zone {1}".format(pmEventType_t[self.pmLang][eventType] or "UNKNOWN", eventZone))
-                if eventZone in self.pmSensorDev_t:
-                    sensor = self.pmSensorDev_t[eventZone]
-                    if sensor is not None:
-                        log.debug("[handle_msgtypeA5]      zone type {0} device tripped {1}".format(eventType, eventZone))
-                    else:
-                        log.debug("[handle_msgtypeA5]      unable to locate zone device " + str(eventZone))
+                sensor = self.pmSensorDev_t.zone(eventZone)
+                if sensor is not None:
+                    log.debug("[handle_msgtypeA5]      zone type {0} device tripped {1}".format(eventType, eventZone))
+                else:
+                    log.debug("[handle_msgtypeA5]      unable to locate zone device " + str(eventZone))
 
             # Examine X10 status
             for i in range(0, 16):
@@ -2250,21 +3480,27 @@ class PacketHandling(ProtocolBase):
                 sEventLog = pmEventType_t[self.pmLang][eventType]
                 log.debug("[handle_msgtypeA5]      Bit 5 set, Zone Event")
                 log.debug("[handle_msgtypeA5]            Zone: {0}, {1}".format(eventZone, sEventLog))
-                for key, value in self.pmSensorDev_t.items():
-                    if value.id == eventZone:      # look for the device name
-                        if eventType == 3: # Zone Open
-                            self.pmSensorDev_t[key].triggered = True
-                            self.pmSensorDev_t[key].status = True
-                            self.pmSensorDev_t[key].triggertime = self.pmTimeFunction()
-                            self.pmSensorDev_t[key].pushChange()
-                        elif eventType == 4: # Zone Closed
-                            self.pmSensorDev_t[key].triggered = False
-                            self.pmSensorDev_t[key].status = False
-                            self.pmSensorDev_t[key].pushChange()
-                        elif eventType == 5: # Zone Violated
-                            self.pmSensorDev_t[key].triggered = True
-                            self.pmSensorDev_t[key].triggertime = self.pmTimeFunction()
-                            self.pmSensorDev_t[key].pushChange()
+                key = self.pmSensorDev_t.slot(eventZone)
+                if key is not None:
+                    sensor = self.pmSensorDev_t[key]
+                    if eventType == 3: # Zone Open
+                        sensor.triggered = True
+                        sensor.status = True
+                        self.pmSetZoneBit("status", key, True)
+                        sensor.triggertime = self.pmTimeFunction()
+                        self.pmSensorTriggered(key)
+                        sensor.pushChange()
+                    elif eventType == 4: # Zone Closed
+                        sensor.triggered = False
+                        sensor.status = False
+                        self.pmSetZoneBit("status", key, False)
+                        self.pmSensorReset(key)
+                        sensor.pushChange()
+                    elif eventType == 5: # Zone Violated
+                        sensor.triggered = True
+                        sensor.triggertime = self.pmTimeFunction()
+                        self.pmSensorTriggered(key)
+                        sensor.pushChange()
 
             #armModeNum = 1 if pmArmed_t[sysStatus] != None else 0
             #armMode = "Armed" if armModeNum == 1 else "Disarmed"
@@ -2272,21 +3508,22 @@ class PacketHandling(ProtocolBase):
         elif eventType == 0x06: # Status message enrolled/bypassed
             # e.g. 00 06 7F 00 00 10 00 00 00 00 43
             val = self.makeInt(data[2:6])
-            
-            if val != self.enrolled_old:
+            zones = self.pmZoneMaskChanged("enrolled", val)
+            if zones != 0:
                 log.debug("[handle_msgtypeA5]      Enrolled Zones 32-01: {:032b}".format(val))
                 send_zone_type_request = False
                 visonic_devices = defaultdict(list)
-                self.enrolled_old = val
-                for i in range(0, 32):
+                for i in self.pmZoneBits(zones):
                     # if the sensor is enrolled
                     if val & (1 << i) != 0:
                         # do we already know about the sensor from the EPROM decode
                         if i in self.pmSensorDev_t:
                             self.pmSensorDev_t[i].enrolled = True
+                            self.pmSensorDev_t.touch(i)
                         elif (i+1) not in self.exclude_sensor_list:
                             # we dont know about it so create it and make it enrolled
                             self.pmSensorDev_t[i] = SensorDevice(dname="Z{0:0>2}".format(i+1), id=i+1, enrolled = True)
+                            self.pmSetFromZoneMasks(i)
                             visonic_devices['sensor'].append(self.pmSensorDev_t[i])
                             if not send_zone_type_request:
                                 self.SendCommand("MSG_ZONENAME")
@@ -2296,18 +3533,18 @@ class PacketHandling(ProtocolBase):
                     elif i in self.pmSensorDev_t:
                         # it is not enrolled and we already know about it from the EPROM, set enrolled to False
                         self.pmSensorDev_t[i].enrolled = False
+                        self.pmSensorDev_t.touch(i)
 
                 if self.event_callback is not None:
-                    self.event_callback(visonic_devices)
+                    self.pmDelivery.deliver(self.event_callback, visonic_devices)
 
             val = self.makeInt(data[6:10])
-            if val != self.bypass_old:
+            zones = self.pmZoneMaskChanged("bypass", val)
+            if zones != 0:
                 log.debug("[handle_msgtypeA5]      Bypassed Zones 32-01: {:032b}".format(val))
-                self.bypass_old = val
-                for i in range(0, 32):
-                    if i in self.pmSensorDev_t:
-                        self.pmSensorDev_t[i].bypass = (val & (1 << i) != 0)
-                        self.pmSensorDev_t[i].pushChange()
+                changed = {}
+                self.pmUpdateZones("bypass", val, zones, changed)
+                self.pmPushChanges(changed)
 
             self.DumpSensorsToDisplay()
 
@@ -2327,7 +3564,7 @@ class PacketHandling(ProtocolBase):
             eventZone = int(data[2 + (2 * i)])
             logEvent  = int(data[3 + (2 * i)])
             eventType = int(logEvent & 0x7F)
-            s = (pmLogEvent_t[self.pmLang][eventType] or "UNKNOWN") + " / " + (pmLogUser_t[eventZone] or "UNKNOWN")
+            s = (pmLogEvent_t[self.pmLang][eventType] or "UNKNOWN") + " / " + self.pmLogUser(eventZone)
             alarmStatus = "None"
             if eventType in pmPanelAlarmType_t:
                 alarmStatus = pmPanelAlarmType_t[eventType]
@@ -2340,6 +3577,9 @@ class PacketHandling(ProtocolBase):
             PanelStatus["PanelTroubleStatus"] = troubleStatus
 
             log.info("[handle_msgtypeA7]      System message " + s + "  alarmStatus " + alarmStatus + "   troubleStatus " + troubleStatus)
+            sensor = self.pmSensorDev_t.zone(eventZone) if self.pmLogUser(eventZone).startswith("Zone") else None
+            if sensor is not None:
+                log.debug("[handle_msgtypeA7]      The event is from sensor {0} {1}".format(sensor.dname, sensor.zname))
 
             # Update siren status
             self.pmSirenActive = None
@@ -2358,13 +3598,17 @@ class PacketHandling(ProtocolBase):
     # pmHandlePowerlink (0xAB)
     def handle_msgtypeAB(self, data): # PowerLink Message
         """ MsgType=AB - Panel Powerlink Messages """
+        # Only process AB if not forced standard
+        if self.ForceStandardMode:
+            log.info("[handle_msgtypeAB] Ignoring PowerLink message in forced standard mode  data {0}".format(self.toString(data)))
+            return
         log.info("[handle_msgtypeAB]  data {0}".format(self.toString(data)))
         self.pmSendAck(True)
 
         # Restart the timer
         self.reset_watchdog_timeout()
 
-        subType = self.ReceiveData[2]
+        subType = data[0]
         if subType == 3: # keepalive message
             # Example 0D AB 03 00 1E 00 31 2E 31 35 00 00 43 2A 0A
             log.info("[handle_msgtypeAB] ***************************** Got PowerLink Keep-Alive ****************************")
@@ -2380,7 +3624,7 @@ class PacketHandling(ProtocolBase):
             else:
                 self.DumpSensorsToDisplay()
         elif subType == 5: # -- phone message
-            action = self.ReceiveData[4]
+            action = data[2]
             if action == 1:
                 log.debug("[handle_msgtypeAB] PowerLink Phone: Calling User")
                 #pmMessage("Calling user " + pmUserCalling + " (" + pmPhoneNr_t[pmUserCalling] +  ").", 2)
@@ -2392,20 +3636,20 @@ class PacketHandling(ProtocolBase):
                 #pmMessage("User " .. pmUserCalling .. " acknowledged by phone.", 2)
                 #pmUserCalling = 1
             else:
-                log.debug("[handle_msgtypeAB] PowerLink Phone: Unknown Action {0}".format(hex(self.ReceiveData[3]).upper()))
-        elif subType == 10 and self.ReceiveData[4] == 0:
+                log.debug("[handle_msgtypeAB] PowerLink Phone: Unknown Action {0}".format(hex(data[1]).upper()))
+        elif subType == 10 and data[2] == 0:
             log.debug("[handle_msgtypeAB] PowerLink telling us what the code is for downloads, currently commented out as I'm not certain of this")
-            #DownloadCode[0] = self.ReceiveData[5]
-            #DownloadCode[1] = self.ReceiveData[6]
-        elif subType == 10 and self.ReceiveData[4] == 1 and not self.doneAutoEnroll:
+            #DownloadCode[0] = data[3]
+            #DownloadCode[1] = data[4]
+        elif subType == 10 and data[2] == 1 and not self.doneAutoEnroll:
             if not self.ForceStandardMode:
                 log.info("[handle_msgtypeAB] PowerLink most likely wants to auto-enroll, only doing auto enroll once")
                 self.DownloadMode = False
                 self.SendMsg_ENROLL()
-        elif subType == 10 and self.ReceiveData[4] == 1:
+        elif subType == 10 and data[2] == 1:
             self.DownloadMode = False
             self.doneAutoEnroll = False
-            asyncio.ensure_future(self.coordinate_powerlink_startup(4), loop = self.loop)
+            self.pmStartTask(self.coordinate_powerlink_startup(4))
 
     def handle_msgtypeB0(self, data): # PowerMaster Message
         """ MsgType=B0 - Panel PowerMaster Message """
@@ -2414,11 +3658,39 @@ class PacketHandling(ProtocolBase):
         subType = data[1]
         msgLen  = data[2]
         log.info("[handle_msgtypeB0] Received PowerMaster message {0}/{1} (len = {2})".format(msgType, subType, msgLen))
-        if msgType == 0x03 and subType == 0x39:
+        if subType in self.pmMessageB0Table_t:
+            self.pmMessageB0Table_t[subType](self, data)
+            return
+        if msgType == 0x03 and subType in pmReceiveMsgB0Zones_t:
+            if self.pmDecodeB0Zones:
+                self.handle_msgtypeB0Zones(pmReceiveMsgB0Zones_t[subType], data[3:3 + msgLen])
+            else:
+                log.debug("[handle_msgtypeB0]      Zone bitmask not decoded (PowerMasterZoneMasks is off) " + self.toString(data))
+        elif msgType == 0x03 and subType == 0x39:
             log.debug("[handle_msgtypeB0]      Sending special PowerMaster Commands to the panel")
             self.SendCommand("MSG_POWERMASTER", options = [2, pmSendMsgB0_t["ZONE_STAT1"]])    #
             self.SendCommand("MSG_POWERMASTER", options = [2, pmSendMsgB0_t["ZONE_STAT2"]])    #
 
+    # A PowerMaster zone bitmask message (B0 03 04 and B0 03 18), name is the zone bitmask in it (see pmReceiveMsgB0Zones_t)
+    #    data is FF 08 <type> <count> followed by a bitmask of count bytes (8 bytes for the 64 zones of a PowerMaster 30), bit 0 is zone 1
+    #    This is decoded in the same way as the 32 zone bitmasks in the A5 messages, only the zones that have changed are updated
+    #    I haven't been able to check the layout with a PowerMaster 30, so setting PanelSettings["PowerMasterZoneMasks"] to False turns this off.
+    #       Anything that doesn't fit the layout is logged and ignored. A bitmask that isn't a sensor attribute ("zonestatus") is kept but not set in the sensors
+    def handle_msgtypeB0Zones(self, name, data):
+        if len(data) < 4 or data[0] != 0xFF or len(data) < 4 + data[3]:
+            log.debug("[handle_msgtypeB0]      Zone bitmask not decoded " + self.toString(data))
+            return
+        count = data[3]
+        val = int.from_bytes(data[4:4 + count], 'little')
+        zones = self.pmZoneMaskChanged(name, val, (1 << (8 * count)) - 1)
+        if zones != 0:
+            log.debug("[handle_msgtypeB0]      {0} Zones {1}-01: {2:0{3}b}".format(name, 8 * count, val, 8 * count))
+            if name not in SENSOR_ATTRIBUTES:
+                return
+            changed = {}
+            self.pmUpdateZones(name, val, zones, changed)
+            self.pmPushChanges(changed)
+
     # pmGetPin: Convert a PIN given as 4 digit string in the PIN PDU format as used in messages to powermax
     def pmGetPin(self, pin):
         """ Get pin and convert to bytearray """
@@ -2438,11 +3710,59 @@ class PacketHandling(ProtocolBase):
     #   Return : The SensorDevice class of the provided refernce in s  or None if not found
     #            I don't think it can be immutable in python but at least changes in either will not affect the other
     def GetSensor(self, s) -> SensorDevice:
-        """ Return a deepcopy of sensor details """
+        """ Return a copy of sensor details """
         if s in self.pmSensorDev_t:
-            return copy.deepcopy(self.pmSensorDev_t[s]) # return a deepcopy as we don't want anything else to change it
+            return copy.copy(self.pmSensorDev_t[s]) # return a copy as we don't want anything else to change it
         return None
 
+    # Get the latest VisonicState, a consistent view of the panel status and the sensors that does not change
+    #    It can be read from any thread without a lock
+    def GetState(self) -> VisonicState:
+        """ Return the panel state """
+        return self.pmState
+
+    # Wait until there is a VisonicState with a version greater than version and return it, return the latest state if timeout (seconds) goes by first
+    #    This blocks so it is for other threads (like the one that called create_tcp_visonic_connection_task), use WaitForVersionAsync in the event loop
+    def WaitForVersion(self, version, timeout = None) -> VisonicState:
+        """ Wait for a newer panel state """
+        with self.pmStateCondition:
+            self.pmStateCondition.wait_for(lambda: self.pmState.version > version, timeout)
+            return self.pmState
+
+    # WaitForVersion for the event loop
+    async def WaitForVersionAsync(self, version, timeout = None) -> VisonicState:
+        """ Wait for a newer panel state """
+        if self.pmState.version > version:
+            return self.pmState
+        waiter = self.loop.create_future()
+        self.pmStateWaiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return self.pmState
+
+    # Set the motion off delay, in seconds, for a zone (the zone number, 1 is the first). None to use MotionOffDelay for the zone again
+    #    This is used the next time that the zone is triggered
+    def SetZoneOffDelay(self, zone, seconds = None):
+        """ Set the motion off delay for a zone """
+        if seconds is None:
+            self.pmZoneOffDelay.pop(zone, None)
+        else:
+            self.pmZoneOffDelay[zone] = seconds
+
+    # Get a sensor by the key reference (integer)
+    #   Return : A SensorSnapshot (an immutable named tuple) of the sensor or None if not found, this is quicker than GetSensor
+    def GetSensorSnapshot(self, s) -> SensorSnapshot:
+        """ Return a snapshot of sensor details """
+        sensor = self.pmSensorDev_t.get(s)
+        return None if sensor is None else sensor.snapshot()
+
+    # Get the zone bitmasks from the A5 messages (bit 0 is zone 1) as a dictionary with the status, lowbatt, tamper, enrolled and bypass
+    #   Return : The bitmask for each, None when the panel has not sent it yet
+    def GetZoneMasks(self) -> dict:
+        """ Return the zone bitmasks """
+        return dict(self.pmZoneMask)
+
     #===================================================================================================================================================
     #===================================================================================================================================================
     #===================================================================================================================================================
@@ -2484,7 +3804,7 @@ class EventHandling(PacketHandling):
         
         self.command_queue = command_queue
         if command_queue is not None:
-            asyncio.ensure_future(self.process_command_queue(), loop=self.loop)
+            self.pmStartTask(self.process_command_queue())
 
     # implement commands from the queue            
     async def process_command_queue(self):
@@ -2504,7 +3824,8 @@ class EventHandling(PacketHandling):
     #       state is one of: "Disarmed", "Stay", "Armed", "UserTest", "StayInstant", "ArmedInstant", "Night", "NightInstant"
     #       optional pin, if not provided then try to use the EPROM downloaded pin if in powerlink
 
-    def RequestArm(self, state, pin = ""):
+    #       optional reply, see SendCommand
+    def RequestArm(self, state, pin = "", reply = None):
         """ Send a request to the panel to Arm/Disarm """
         isValidPL, bpin = self.pmGetPin(pin)
         armCode = None
@@ -2517,13 +3838,26 @@ class EventHandling(PacketHandling):
         if armCode is not None:
             if isValidPL:
                 if (state == "Disarmed" and self.pmRemoteDisArm) or (state != "Disarmed" and self.pmRemoteArm):
-                    self.SendCommand("MSG_ARM", options = [3, armCodeA, 4, bpin])    #
+                    self.SendCommand("MSG_ARM", options = [3, armCodeA, 4, bpin], reply = reply)    #
                 else:
-                    log.info("Panel Access Not allowed, user setting prevent access")
+                    self.pmCommandRejected(reply, "Panel Access Not allowed, user setting prevent access")
             else:
-                log.info("Panel Access Not allowed without pin")
+                self.pmCommandRejected(reply, "Panel Access Not allowed without pin")
         else:
-            log.info("RequestArmMode invalid state requested " + (state or "N/A"))
+            self.pmCommandRejected(reply, "RequestArmMode invalid state requested " + (state or "N/A"))
+
+    # Arm/Disarm and wait for the panel to acknowledge it, see RequestArm and SendCommandAsync
+    async def RequestArmAsync(self, state, pin = "", timeout = COMMAND_TIMEOUT) -> VisonicReply:
+        """ Send a request to the panel to Arm/Disarm and wait for the reply """
+        reply = self.loop.create_future()
+        self.RequestArm(state, pin, reply = reply)
+        return await asyncio.wait_for(reply, timeout)
+
+    # A command was not sent, log why and tell whoever is waiting for the reply
+    def pmCommandRejected(self, reply, why):
+        log.info(why)
+        if reply is not None and not reply.done():
+            reply.set_exception(VisonicCommandError(why))
 
     # Individually arm/disarm the sensors
     #   This sets/clears the bypass for each sensor
@@ -2538,43 +3872,74 @@ class EventHandling(PacketHandling):
     #      bytes 3 to 6 are the Enable bits for the 32 zones
     #      bytes 7 to 10 are the Disable bits for the 32 zones 
     #      byte 11 is 0x43
-    def SetSensorArmedState(self, zone, armedValue, pin = "") -> bool:  # was sensor instead of zone (zone in range 1 to 32).
+    #   optional reply is given the reply to the MSG_BYPASSTAT that follows, see SendCommand
+    def SetSensorArmedState(self, zone, armedValue, pin = "", reply = None) -> bool:  # was sensor instead of zone (zone in range 1 to 32).
         """ Set or Clear Sensor Bypass """
         if self.pmPowerlinkMode:
             if not self.pmBypassOff:
                 isValidPL, bpin = self.pmGetPin(pin)
                 #   zone = tonumber(string.sub(luup.devices[sensor].id, 2))
-                if isValidPL:
-                    bypassint = int(2 ^ (zone - 1))
-                    # is it big or little endian, i'm not sure, needs testing
-                    y1, y2, y3, y4 = (bypassint & 0xFFFFFFFF).to_bytes(4, 'big')
-                    # These could be the wrong way around, needs testing
-                    bypass = bytearray([y1, y2, y3, y4])
+                if not 1 <= zone <= 32:
+                    # the bypass messages only have bits for zones 1 to 32
+                    self.pmCommandRejected(reply, "Bypass is only supported for zones 1 to 32, not zone {0}".format(zone))
+                elif isValidPL:
+                    # the same bit order as the zone bitmasks in the A5 messages, bit 0 is zone 1
+                    bypass = bytearray((1 << (zone - 1)).to_bytes(4, 'little'))
                     if len(bpin) == 2 and len(bypass) == 4:
                         if armedValue:
                             self.SendCommand("MSG_BYPASSDIS", options = [1, bpin, 7, bypass])
                         else:
                             self.SendCommand("MSG_BYPASSEN", options = [1, bpin, 3, bypass]) # { pin = pmPincode_t[1], bypass = bypassStr })
-                        self.SendCommand("MSG_BYPASSTAT") # request status to check success and update sensor variable
+                        self.SendCommand("MSG_BYPASSTAT", reply = reply) # request status to check success and update sensor variable
                         return True
                 else:
-                    log.info("Bypass option not allowed, invalid pin")
+                    self.pmCommandRejected(reply, "Bypass option not allowed, invalid pin")
             else:
-                log.info("Bypass option not enabled in panel settings.")
+                self.pmCommandRejected(reply, "Bypass option not enabled in panel settings.")
         else:
-            log.info("Bypass setting only supported in Powerlink mode.")
+            self.pmCommandRejected(reply, "Bypass setting only supported in Powerlink mode.")
         return False
 
+    # Set or clear the bypass of a sensor and wait for the status from the panel that shows it, see SetSensorArmedState and SendCommandAsync
+    async def SetSensorArmedStateAsync(self, zone, armedValue, pin = "", timeout = COMMAND_TIMEOUT) -> VisonicReply:
+        """ Set or Clear Sensor Bypass and wait for the reply """
+        reply = self.loop.create_future()
+        self.SetSensorArmedState(zone, armedValue, pin, reply = reply)
+        return await asyncio.wait_for(reply, timeout)
+
     # Get the Event Log
     #       optional pin, if not provided then try to use the EPROM downloaded pin if in powerlink
-    def GetEventLog(self, pin = ""):
+    #       optional reply, see SendCommand
+    def GetEventLog(self, pin = "", reply = None):
         """ Get Panel Event Log """
         log.info("GetEventLog")
         isValidPL, bpin = self.pmGetPin(pin)
         if isValidPL:
-            self.SendCommand("MSG_EVENTLOG", options=[4, bpin])
+            self.SendCommand("MSG_EVENTLOG", options=[4, bpin], reply = reply)
         else:
-            log.info("Get Event Log not allowed, invalid pin")
+            self.pmCommandRejected(reply, "Get Event Log not allowed, invalid pin")
+
+    # Get the Event Log and wait for all of it, return the list of LogEvent, oldest first
+    #    timeout is for the whole event log, see SendCommandAsync for the exceptions
+    #    Only one event log can be retrieved at a time, a VisonicCommandError is raised if one is already being retrieved
+    async def GetEventLogAsync(self, pin = "", timeout = COMMAND_TIMEOUT) -> list:
+        """ Get Panel Event Log and wait for it """
+        if self.pmEventLogReply is not None and not self.pmEventLogReply.done():
+            raise VisonicCommandError("Retrieving Event Log: the event log is already being retrieved")
+        deadline = self.loop.time() + timeout
+        # the event log can follow the acknowledge straight away, so be ready for it before sending the command
+        eventlog = self.loop.create_future()
+        self.pmEventLogReply = eventlog
+        reply = self.loop.create_future()
+        try:
+            self.GetEventLog(pin, reply = reply)
+            await asyncio.wait_for(reply, timeout)
+            return await asyncio.wait_for(eventlog, max(0, deadline - self.loop.time()))
+        finally:
+            # when the command failed or timed out nobody is waiting for the event log anymore
+            eventlog.cancel()
+            if self.pmEventLogReply is eventlog:
+                self.pmEventLogReply = None
 
 
 class VisonicProtocol(EventHandling):
@@ -2605,7 +3970,7 @@ def setConfig(key, val):
             log.setLevel(level)
 
 # Create a connection using asyncio using an ip and port
-def create_tcp_visonic_connection(address, port, protocol=VisonicProtocol, command_queue = None, event_callback=None, disconnect_callback=None, loop=None, excludes=None):
+def create_tcp_visonic_connection(address, port, protocol=VisonicProtocol, command_queue = None, event_callback=None, disconnect_callback=None, loop=None, excludes=None, callback_target=None):
     """Create Visonic manager class, returns tcp transport coroutine."""
 
     # use default protocol if not specified
@@ -2617,6 +3982,7 @@ def create_tcp_visonic_connection(address, port, protocol=VisonicProtocol, comma
         disconnect_callback=disconnect_callback,
         excludes=excludes,
         command_queue = command_queue, 
+        callback_target=callback_target,
 #        ignore=ignore if ignore else [],
     )
 
@@ -2627,7 +3993,7 @@ def create_tcp_visonic_connection(address, port, protocol=VisonicProtocol, comma
     return conn
 
 # Create a connection using asyncio through a linux port (usb or rs232)
-def create_usb_visonic_connection(port, baud=9600, protocol=VisonicProtocol, command_queue = None, event_callback=None, disconnect_callback=None, loop=None, excludes=None):
+def create_usb_visonic_connection(port, baud=9600, protocol=VisonicProtocol, command_queue = None, event_callback=None, disconnect_callback=None, loop=None, excludes=None, callback_target=None):
      """Create Visonic manager class, returns rs232 transport coroutine."""
      # use default protocol if not specified
      protocol = partial(
@@ -2638,6 +4004,7 @@ def create_usb_visonic_connection(port, baud=9600, protocol=VisonicProtocol, com
         disconnect_callback=disconnect_callback,
         excludes=excludes,
         command_queue = command_queue, 
+        callback_target=callback_target,
  #        ignore=ignore if ignore else [],
      )
 
@@ -2650,17 +4017,19 @@ def create_usb_visonic_connection(port, baud=9600, protocol=VisonicProtocol, com
 
 
 # Do not call this directly, it is the thread that creates and keeps going the asyncio. It repackages an asyncio in to a task
-def visonicworker(tcp, address, port, event_callback=None, disconnect_callback=None, excludes=None):
+#    callback_target is the loop (or executor) to call event_callback and disconnect_callback on, None to call them in this thread
+#    thread is the VisonicConnectionThread to give the protocol to once it is connected
+def visonicworker(tcp, address, port, event_callback=None, disconnect_callback=None, excludes=None, callback_target=None, thread=None):
     mynewloop = asyncio.new_event_loop()
     asyncio.set_event_loop(mynewloop)
 
     log.debug("visonic worker")
     try:
         if tcp:
-            conn = create_tcp_visonic_connection(address=address, port=port, event_callback=event_callback, disconnect_callback=disconnect_callback, loop=mynewloop, excludes=excludes)
+            conn = create_tcp_visonic_connection(address=address, port=port, event_callback=event_callback, disconnect_callback=disconnect_callback, loop=mynewloop, excludes=excludes, callback_target=callback_target)
         else:
-            conn = create_usb_visonic_connection(port=port, event_callback=event_callback, disconnect_callback=disconnect_callback, loop=mynewloop, excludes=excludes)
-        mynewloop.create_task(conn)
+            conn = create_usb_visonic_connection(port=port, event_callback=event_callback, disconnect_callback=disconnect_callback, loop=mynewloop, excludes=excludes, callback_target=callback_target)
+        mynewloop.create_task(visonicconnected(conn, thread))
         mynewloop.run_forever()
 
     except KeyboardInterrupt:
@@ -2670,18 +4039,54 @@ def visonicworker(tcp, address, port, event_callback=None, disconnect_callback=N
     finally:
         mynewloop.close()
 
+# Wait for the connection to be made and give the protocol to the thread
+async def visonicconnected(conn, thread):
+    transport, protocol = await conn
+    if thread is not None:
+        thread.setProtocol(protocol)
+
+# The thread that create_tcp_visonic_connection_task and create_usb_visonic_connection_task return
+#    protocol is the VisonicProtocol once the connection has been made, None until then. It runs in this thread's event loop,
+#    so from other threads only use GetState and WaitForVersion (here or on the protocol), they do not touch PanelStatus or the sensors
+class VisonicConnectionThread(threading.Thread):
+    def __init__(self, tcp, address, port, event_callback=None, disconnect_callback=None, excludes=None, callback_target=None):
+        super().__init__(target=visonicworker, args=(tcp, address, port, event_callback, disconnect_callback, excludes, callback_target, self))
+        self.protocol = None
+        self.isconnected = threading.Event()
+
+    def setProtocol(self, protocol):
+        self.protocol = protocol
+        self.isconnected.set()
+
+    # Return the latest VisonicState, NO_STATE before the connection has been made
+    def GetState(self) -> VisonicState:
+        """ Return the panel state """
+        protocol = self.protocol
+        return NO_STATE if protocol is None else protocol.GetState()
+
+    # Wait until there is a VisonicState with a version greater than version and return it, return the latest state if timeout (seconds) goes by first
+    #    This includes waiting for the connection to be made
+    def WaitForVersion(self, version, timeout = None) -> VisonicState:
+        """ Wait for a newer panel state """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self.isconnected.wait(timeout):
+            return NO_STATE
+        return self.protocol.WaitForVersion(version, None if deadline is None else max(0.0, deadline - time.monotonic()))
+
 # Create a task and start it
-def create_tcp_visonic_connection_task(address, port, event_callback=None, disconnect_callback=None, excludes=None):
+#    Return the VisonicConnectionThread, use its GetState and WaitForVersion to follow the panel
+def create_tcp_visonic_connection_task(address, port, event_callback=None, disconnect_callback=None, excludes=None, callback_target=None):
     #pool = ProcessPoolExecutor(1)
     #future = pool.submit(visonicworker, True, address, port, event_callback, disconnect_callback)
     #return pool
 
-    t = threading.Thread(target=visonicworker, args=(True, address, port, event_callback, disconnect_callback, excludes))
+    t = VisonicConnectionThread(True, address, port, event_callback, disconnect_callback, excludes, callback_target)
     t.start()
     return t
 
 # Create a task and start it
-def create_usb_visonic_connection_task(port, event_callback=None, disconnect_callback=None, excludes=None):
-    t = threading.Thread(target=visonicworker, args=(False, "dummy", port, event_callback, disconnect_callback, excludes))
+#    Return the VisonicConnectionThread, use its GetState and WaitForVersion to follow the panel
+def create_usb_visonic_connection_task(port, event_callback=None, disconnect_callback=None, excludes=None, callback_target=None):
+    t = VisonicConnectionThread(False, "dummy", port, event_callback, disconnect_callback, excludes, callback_target)
     t.start()
     return t
@@ -0,0 +1,162 @@
+"""Replay captured panel traffic through VisonicProtocol, without a panel.
+
+  The frames are taken from a debug log (log.txt), where pmSendPdu logs the frames that were sent to the panel
+  and pmLogPdu logs the frames received from it, both as "raw data 0d ... 0a", or from a raw capture of the
+  bytes received from the panel.
+
+  The debug log has to be from a run of this version of pyvisonic (or later) with PluginDebug set to True, as
+  test.py does, so that it has the "[pmLogPdu] <-PM ... raw data" lines. Older logs, like example_log.txt and
+  example_log_wouter.txt, only have the frames that were sent and a summary of what was decoded, the bytes
+  received from the panel are not in them, so they can't be replayed.
+
+  The received frames are fed to VisonicProtocol.data_received with a transport that just records what the
+  protocol writes. At the end the sensors, PanelStatus and the throughput are printed.
+
+  Usage:
+      python3 replay.py log.txt                  as fast as possible
+      python3 replay.py --speed 1 log.txt        at the original timing
+      python3 replay.py --speed 10 log.txt       10 times faster than the original timing
+      python3 replay.py --raw capture.bin        a raw capture, timed as if it was received at --baud
+"""
+
+import re
+import sys
+import time
+import asyncio
+import logging
+import argparse
+
+from collections import namedtuple
+
+# A frame from the capture, time is in seconds from the start of the capture, inbound is True when it came from the panel
+ReplayFrame = namedtuple('ReplayFrame', 'time inbound data')
+
+# The log lines look like this, from the ElapsedFormatter in pyvisonic
+#    0:00:01.008233 <  917>    DEBUG   [pmSendPdu] Sending Command (...)    raw data 0d ab 0a 00 01 00 00 00 00 00 00 00 43 06 0a
+#    0:00:01.258233 < 1099>    DEBUG   [pmLogPdu] <-PM      raw data 0d 02 43 ba 0a
+LOG_LINE = re.compile(r'^(\d+):(\d+):(\d+(?:\.\d*)?) .*?\[(pmSendPdu|pmLogPdu)\].*?raw data ((?:[0-9a-fA-F]{2} ?)+)')
+
+# What to tell the user when there is nothing to replay
+LOG_FORMAT_HELP = ("The log has to be a debug log (PluginDebug set to True, as test.py does) from this version of pyvisonic or later,\n"
+                   "with \"[pmLogPdu] <-PM ... raw data 0d ... 0a\" lines for the frames received from the panel. Run test.py against\n"
+                   "the panel (or simulator.py) and replay the log.txt that it writes, or use --raw with a capture of the bytes received.")
+
+
+def read_log(filename):
+    """ Get the sent and received frames from a pyvisonic debug log """
+    frames = []
+    with open(filename, 'r', errors='replace') as f:
+        for line in f:
+            m = LOG_LINE.match(line)
+            if m is not None:
+                seconds = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3))
+                frames.append(ReplayFrame(seconds, m.group(4) == "pmLogPdu", bytes.fromhex(m.group(5))))
+    return frames
+
+
+def read_raw(filename, chunk_size, baud):
+    """ Get the received bytes from a raw capture, in chunks timed as if they were received at baud (10 bits a byte) """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    return [ReplayFrame(10.0 * i / baud, True, data[i : i + chunk_size]) for i in range(0, len(data), chunk_size)]
+
+
+class ReplayTransport:
+    """ Stands in for the serial or tcp transport, keeps what the protocol sends to the panel """
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def close(self):
+        pass
+
+
+def replay(pyvisonic, frames, speed = 0.0):
+    """ Feed the received frames to a new protocol, at the original timing divided by speed or as fast as possible when speed is 0
+        Return the protocol and the time it took in seconds """
+    loop = asyncio.new_event_loop()
+    protocol = pyvisonic.VisonicProtocol(loop = loop)
+    protocol.transport = ReplayTransport()
+    # process the received data as normal, rather than just collecting it as we do at the start of a connection
+    protocol.coordinating_powerlink = False
+    inbound = [frame for frame in frames if frame.inbound]
+
+    start = time.perf_counter()
+    if speed > 0 and len(inbound) > 0:
+        # schedule each frame at its time in the capture and let the protocol timers run in between
+        done = loop.create_future()
+        begin = loop.time() - inbound[0].time / speed
+        for frame in inbound:
+            loop.call_at(begin + frame.time / speed, protocol.data_received, frame.data)
+        loop.call_at(begin + inbound[-1].time / speed, done.set_result, None)
+        loop.run_until_complete(done)
+    else:
+        for frame in inbound:
+            protocol.data_received(frame.data)
+    elapsed = time.perf_counter() - start
+
+    # stop the protocol timers that were started
+    protocol.suspendAllOperations = True
+    protocol.pmTimers.close()
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    if len(tasks) > 0:
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+    return protocol, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Replay captured panel traffic through VisonicProtocol", epilog = LOG_FORMAT_HELP)
+    parser.add_argument("capture", help = "a pyvisonic debug log with [pmLogPdu] lines (see below), or a raw capture with --raw")
+    parser.add_argument("--raw", action = "store_true", help = "the capture is the raw bytes received from the panel")
+    parser.add_argument("--speed", type = float, default = 0.0, help = "0 for as fast as possible (the default), 1 for the original timing, 2 for twice as fast ...")
+    parser.add_argument("--chunk", type = int, default = 64, help = "bytes per data_received call for a raw capture")
+    parser.add_argument("--baud", type = int, default = 9600, help = "the line speed to time a raw capture by")
+    parser.add_argument("--debug", action = "store_true", help = "log the protocol debug messages")
+    args = parser.parse_args()
+
+    if args.raw:
+        frames = read_raw(args.capture, args.chunk, args.baud)
+    else:
+        frames = read_log(args.capture)
+
+    # Import pyvisonic after the capture has been read, the import starts a new log.txt in the current directory
+    import pyvisonic
+    pyvisonic.log.setLevel(logging.DEBUG if args.debug else logging.WARNING)
+
+    inbound = [frame for frame in frames if frame.inbound]
+    outbound = [frame for frame in frames if not frame.inbound]
+    if len(inbound) == 0:
+        print("No received frames in {0}".format(args.capture))
+        if len(outbound) > 0:
+            print("It has {0} sent frames but no [pmLogPdu] lines, it is from an older version of pyvisonic that did not log the bytes received".format(len(outbound)))
+        print(LOG_FORMAT_HELP)
+        return 1
+
+    protocol, elapsed = replay(pyvisonic, frames, args.speed)
+    unit = "chunks" if args.raw else "frames"
+
+    print("Sensors")
+    for key in sorted(protocol.pmSensorDev_t):
+        print("    {0}".format(protocol.pmSensorDev_t[key]))
+    print("PanelStatus")
+    for key in sorted(pyvisonic.PanelStatus):
+        print("    {0:<20} {1}".format(key, pyvisonic.PanelStatus[key]))
+    print("Replay")
+    print("    {0:12} received {1} ({2} bytes)".format(len(inbound), unit, sum(len(frame.data) for frame in inbound)))
+    print("    {0:12} sent frames in the capture".format(len(outbound)))
+    print("    {0:12} frames sent by the protocol".format(len(protocol.transport.written)))
+    print("    {0:12} CRC errors, {1} resyncs, {2} bytes discarded".format(protocol.pmCrcErrorCount, protocol.pmResyncCount, protocol.pmDiscardedBytes))
+    print("    {0:12.3f} seconds".format(elapsed))
+    if elapsed > 0:
+        print("    {0:12.0f} {1}/sec".format(len(inbound) / elapsed, unit))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,454 @@
+"""A simulated PowerMax/PowerMaster panel, to test pyvisonic without the hardware.
+
+  The panel listens on a tcp port, so create_tcp_visonic_connection connects to it unchanged,
+  or on a pseudo terminal for the serial path (create_usb_visonic_connection with the port it prints).
+
+  It goes through the same steps with pyvisonic as a real panel would:
+      Exit/Stop/Init                      ack
+      Start Download (24) with the code   ack and panel info (3C), or access denied (08)
+      Auto-Enroll (AB 0A 00 00)           ack and the download code (AB 0A 00 00), the panel is then enrolled
+      Download Data Set (3E)              the EPROM data as 3F messages
+      Start (0A)                          all of the EPROM as 33 messages then stop (0B), we are in powerlink
+      Status (A2) or Restore (AB 06)      A5 status messages
+  and in powerlink it sends a keep-alive (AB 03) every --keepalive seconds.
+
+  After powerlink it can send a storm of A5 zone events and A7 panel events at --storm-rate a second.
+  Faults can be added with --deny, --timeout-rate and --crc-rate.
+
+  The report has the time to powerlink, the ack delay (the time from us sending a message to pyvisonic
+  acking it) and the commands pyvisonic sent. The ack delay is not the command round trip, that is only
+  seen in pyvisonic: with --client the simulator runs pyvisonic itself, connects it to the panel and once
+  it is in powerlink times --commands awaitable commands from SendCommandAsync to the reply resolving it.
+
+  Usage:
+      python3 simulator.py                                 tcp on port 20024
+      python3 simulator.py --pty                           on a pseudo terminal
+      python3 simulator.py --storm-rate 20 --storm-count 1000 --crc-rate 0.01
+      python3 simulator.py --client --commands 50          connect pyvisonic to it and time 50 commands
+"""
+
+import os
+import sys
+import time
+import tty
+import random
+import asyncio
+import logging
+import argparse
+
+from collections import deque
+
+# The download code that pyvisonic uses (DownloadCode)
+DOWNLOAD_CODE = bytes.fromhex('56 50')
+
+# The largest block of data in a 3F message
+MAX_3F_DATA = 0xB0
+
+# How long we wait for an ack from pyvisonic before giving up on it
+ACK_TIMEOUT = 5.0
+
+# With --client, how long pyvisonic has to get in to powerlink and the command that is timed (the panel replies with an A5)
+CLIENT_POWERLINK_TIMEOUT = 120.0
+CLIENT_COMMAND = "MSG_STATUS"
+
+# Where the settings are in the EPROM as (index, page, length), the same as pmDownloadItem_t in pyvisonic
+EPROM_COMMDEF    = (0x01, 0x01, 0x1E)
+EPROM_PHONENRS   = (0x36, 0x01, 0x20)
+EPROM_PINCODES   = (0xFA, 0x01, 0x10)
+EPROM_PGMX10     = (0x14, 0x02, 0xD5)
+EPROM_PARTITIONS = (0x00, 0x03, 0xF0)
+EPROM_PANELFW    = (0x00, 0x04, 0x20)
+EPROM_SERIAL     = (0x30, 0x04, 0x08)
+EPROM_ZONES      = (0x00, 0x09, 0x78)
+EPROM_2WKEYPAD   = (0x00, 0x0A, 0x08)
+EPROM_1WKEYPAD   = (0x20, 0x0A, 0x40)
+EPROM_SIRENS     = (0x60, 0x0A, 0x08)
+EPROM_X10NAMES   = (0x30, 0x0B, 0x10)
+EPROM_ZONENAMES  = (0x40, 0x0B, 0x1E)
+EPROM_ZONESTR    = (0x00, 0x19, 0x200)
+
+
+def make_pdu(body):
+    """ Add header, checksum and footer to a message """
+    checksum = 0xFF - (sum(body) % 0xFF)
+    if checksum == 0xFF:
+        checksum = 0x00
+    return bytes([0x0D]) + bytes(body) + bytes([checksum, 0x0A])
+
+
+def make_eprom(panel_type = 2, zones = 30):
+    """ A 64K EPROM image, 0xFF where nothing is set, for a panel of panel_type (2 is a PowerMax Pro) with zones enrolled """
+    image = bytearray(b'\xFF' * 0x10000)
+
+    def write(item, data):
+        index, page, length = item
+        assert len(data) == length
+        image[page * 0x100 + index : page * 0x100 + index + length] = data
+
+    write(EPROM_SERIAL, bytes([0x12, 0x34, 0x56, 0x78, 0x9A, 0xBC, 0x02, panel_type]))
+    write(EPROM_PANELFW, b'JS702412 K17.000JS702412 K17.000')
+    write(EPROM_COMMDEF, bytes([30, 30, 60, 4] + [0] * 0x1A))
+    write(EPROM_PINCODES, bytes(0x10))
+    write(EPROM_PARTITIONS, bytes(0xF0))
+    write(EPROM_ZONESTR, b''.join(b'Zone type %-5d ' % i for i in range(0, 0x20)))
+    write(EPROM_ZONENAMES, bytes(i % 0x1F for i in range(0, 0x1E)))
+    write(EPROM_ZONES, b''.join(bytes([0x10 + i, 0x20, (0x3, 0x5, 0xA, 0xF)[i % 4], 0x12]) if i < zones else bytes(4) for i in range(0, 0x1E)))
+    write(EPROM_PGMX10, bytes(0xD5))
+    write(EPROM_X10NAMES, bytes([0x1F] * 0x10))
+    write(EPROM_1WKEYPAD, bytes(0x40))
+    write(EPROM_2WKEYPAD, bytes.fromhex('01 02 03 00') + bytes(4))
+    write(EPROM_SIRENS, bytes.fromhex('01 02 03 00') + bytes(4))
+    return image
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def latency_summary(values):
+    """ values in seconds as the count, min, median, 95% and max in msec """
+    return "(msec)  count {0}  min {1:.1f}  median {2:.1f}  95% {3:.1f}  max {4:.1f}".format(len(values),
+           1000 * min(values), 1000 * percentile(values, 0.5), 1000 * percentile(values, 0.95), 1000 * max(values))
+
+
+class PanelStats:
+    """ What we measured on a connection """
+
+    def __init__(self):
+        self.connected = time.monotonic()
+        self.powerlink = None             # seconds from connecting to pyvisonic acknowledging in powerlink
+        self.ack_delay = []               # seconds from sending a message that needs an ack to getting the ack from pyvisonic
+        self.unacked = 0                  # messages that needed an ack and didn't get one in ACK_TIMEOUT seconds
+        self.commands = {}                # command type : count
+        self.sent = 0
+        self.corrupted = 0
+        self.storm_sent = 0
+
+    def report(self):
+        lines = []
+        if self.powerlink is None:
+            lines.append("  powerlink not reached")
+        else:
+            lines.append("  time to powerlink {0:.2f} seconds".format(self.powerlink))
+        lines.append("  sent {0} messages, {1} with a corrupted checksum, {2} in the storm".format(self.sent, self.corrupted, self.storm_sent))
+        if len(self.ack_delay) > 0:
+            lines.append("  pyvisonic ack delay " + latency_summary(self.ack_delay))
+        lines.append("  messages not acked {0}".format(self.unacked))
+        lines.append("  commands received  " + "  ".join("{0:02X}:{1}".format(c, n) for c, n in sorted(self.commands.items())))
+        return "\n".join(lines)
+
+
+class SimulatedPanel(asyncio.Protocol):
+    """ The panel end of one connection """
+
+    def __init__(self, options, eprom):
+        self.options = options
+        self.eprom = eprom
+        self.random = random.Random(options.seed)
+        self.loop = asyncio.get_event_loop()
+        self.transport = None
+        self.buffer = bytearray()
+        self.stats = PanelStats()
+        # The messages we sent that need an ack, as (time sent, message type)
+        self.awaiting_ack = deque()
+        # The messages waiting for the panel delay, as (time to send, message, storm), in the order they are sent
+        self.outgoing = deque()
+        self.outgoing_timer = None
+        self.denials = options.deny
+        self.enrolled = False
+        self.downloading = False
+        self.powerlink = False
+        self.tasks = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.stats = PanelStats()
+        print("Panel: connected")
+
+    def connection_lost(self, exc):
+        print("Panel: connection closed")
+        for task in self.tasks:
+            task.cancel()
+        if self.outgoing_timer is not None:
+            self.outgoing_timer.cancel()
+        print(self.stats.report())
+
+    # Frame the commands from pyvisonic, they do not have a length so look for a 0x0A with the right checksum before it
+    def data_received(self, data):
+        self.buffer += data
+        while True:
+            start = self.buffer.find(b'\x0D')
+            if start < 0:
+                self.buffer.clear()
+                return
+            del self.buffer[:start]
+            end = 2
+            while True:
+                end = self.buffer.find(b'\x0A', end)
+                if end < 0:
+                    return
+                if make_pdu(self.buffer[1 : end - 1]) == self.buffer[0 : end + 1]:
+                    break
+                end = end + 1
+            command = bytes(self.buffer[1 : end - 1])
+            del self.buffer[: end + 1]
+            if len(command) > 0:
+                self.handle_command(command)
+
+    def send(self, body, storm = False):
+        """ Send a message to pyvisonic after the panel delay, messages are sent in order """
+        self.outgoing.append((self.loop.time() + self.options.delay, bytes(body), storm))
+        if self.outgoing_timer is None:
+            self.outgoing_timer = self.loop.call_at(self.outgoing[0][0], self.send_outgoing)
+
+    def send_outgoing(self):
+        self.outgoing_timer = None
+        now = self.loop.time()
+        while len(self.outgoing) > 0 and self.outgoing[0][0] <= now:
+            due, body, storm = self.outgoing.popleft()
+            self.send_now(body, storm)
+        if len(self.outgoing) > 0:
+            self.outgoing_timer = self.loop.call_at(self.outgoing[0][0], self.send_outgoing)
+
+    def send_now(self, body, storm = False):
+        if self.transport is None or self.transport.is_closing():
+            return
+        pdu = bytearray(make_pdu(body))
+        if self.options.crc_rate > 0 and self.random.random() < self.options.crc_rate:
+            pdu[-2] = pdu[-2] ^ 0xFF
+            self.stats.corrupted = self.stats.corrupted + 1
+        elif body[0] != 0x02:
+            # everything apart from an ack gets an ack from pyvisonic
+            self.awaiting_ack.append((time.monotonic(), body[0]))
+        self.stats.sent = self.stats.sent + 1
+        if storm:
+            self.stats.storm_sent = self.stats.storm_sent + 1
+        self.transport.write(bytes(pdu))
+
+    def ack(self):
+        self.send(b'\x02\x43' if self.powerlink else b'\x02')
+
+    def got_ack(self, powerlink_ack):
+        now = time.monotonic()
+        while len(self.awaiting_ack) > 0 and now - self.awaiting_ack[0][0] > ACK_TIMEOUT:
+            self.awaiting_ack.popleft()
+            self.stats.unacked = self.stats.unacked + 1
+        if len(self.awaiting_ack) > 0:
+            sent, msgtype = self.awaiting_ack.popleft()
+            self.stats.ack_delay.append(now - sent)
+        if powerlink_ack and self.powerlink and self.stats.powerlink is None:
+            self.stats.powerlink = now - self.stats.connected
+            print("Panel: pyvisonic is in powerlink after {0:.2f} seconds".format(self.stats.powerlink))
+            if self.options.storm_count > 0:
+                self.tasks.append(asyncio.ensure_future(self.storm()))
+
+    def handle_command(self, command):
+        msgtype = command[0]
+        self.stats.commands[msgtype] = self.stats.commands.get(msgtype, 0) + 1
+        if msgtype == 0x02:
+            self.got_ack(len(command) > 1)
+            return
+
+        # Randomly time out instead of doing the command
+        if self.options.timeout_rate > 0 and self.random.random() < self.options.timeout_rate:
+            self.send(b'\x06')
+            return
+
+        if msgtype == 0x24:                                     # Start Download
+            if self.denials > 0 or command[3:5] != DOWNLOAD_CODE:
+                self.denials = self.denials - 1
+                self.send(b'\x08\x43')
+                return
+            self.ack()
+            self.downloading = True
+            panel_type = self.eprom[EPROM_SERIAL[1] * 0x100 + EPROM_SERIAL[0] + 7]
+            self.send(bytes([0x3C, 0x00, 0x00, 0x00, 0x00, 0x02, panel_type, 0x00, 0x00, 0x00, 0x43]))
+        elif msgtype == 0xAB and command[1] == 0x0A and command[3] == 0x00:   # Auto-Enroll
+            self.ack()
+            self.enrolled = command[4:6] == DOWNLOAD_CODE
+            if self.enrolled:
+                self.send(bytes([0xAB, 0x0A, 0x00, 0x00]) + DOWNLOAD_CODE + bytes([0x00, 0x00, 0x00, 0x00, 0x00, 0x43]))
+        elif msgtype == 0x3E:                                   # Download Data Set
+            self.ack()
+            self.download(command[1], command[2], command[3] + 0x100 * command[4])
+        elif msgtype == 0x0A:                                   # Start, send all the settings
+            self.ack()
+            self.send_settings()
+        elif msgtype == 0x0F:                                   # Exit
+            self.ack()
+            self.downloading = False
+        elif msgtype == 0xA2 or (msgtype == 0xAB and command[1] == 0x06):  # Status or Restore
+            self.ack()
+            self.send_status()
+        elif msgtype == 0xA3:                                   # Zone Names
+            self.ack()
+            names = self.eprom[EPROM_ZONENAMES[1] * 0x100 + EPROM_ZONENAMES[0] : EPROM_ZONENAMES[1] * 0x100 + EPROM_ZONENAMES[0] + 32]
+            for i in range(0, 4):
+                self.send(bytes([0xA3, 4, i + 1]) + bytes(n & 0x1F for n in names[i * 8 : i * 8 + 8]) + b'\x43')
+        else:
+            # Exit, Stop, Init, Alive, Set Time, Arm, Bypass ... just need an ack
+            self.ack()
+
+    def download(self, index, page, length):
+        """ Send length bytes of the EPROM from page/index in 3F messages """
+        address = page * 0x100 + index
+        while length > 0:
+            size = min(length, MAX_3F_DATA)
+            self.send(bytes([0x3F, address & 0xFF, address >> 8, size]) + self.eprom[address : address + size])
+            address = address + size
+            length = length - size
+
+    def send_settings(self):
+        """ Send the EPROM as 33 messages, skipping 8 byte blocks that are not set, then stop """
+        for address in range(0, len(self.eprom), 8):
+            block = self.eprom[address : address + 8]
+            if block != b'\xFF' * 8:
+                self.send(bytes([0x33, address & 0xFF, address >> 8]) + block)
+        self.send(b'\x0B\x43')
+        if self.enrolled:
+            # we are now in powerlink, send a keep-alive straight away, pyvisonic acks it with a powerlink ack
+            self.powerlink = True
+            self.downloading = False
+            self.send(bytes.fromhex('AB 03 00 1E 00 31 2E 31 35 00 00 43'))
+            self.tasks.append(asyncio.ensure_future(self.keep_alive()))
+
+    def send_status(self):
+        self.send(bytes.fromhex('A5 00 02 00 00 00 00 00 00 00 00 43'))
+        self.send(bytes.fromhex('A5 00 03 00 00 00 00 00 00 00 00 43'))
+        self.send(bytes.fromhex('A5 00 04 00 61 00 00 00 00 00 00 43'))
+
+    async def keep_alive(self):
+        while self.powerlink:
+            await asyncio.sleep(self.options.keepalive)
+            self.send_now(bytes.fromhex('AB 03 00 1E 00 31 2E 31 35 00 00 43'))
+
+    async def storm(self):
+        """ Zones opening and closing (A5 zone events) with a panel event (A7) every 10 messages """
+        print("Panel: starting a storm of {0} messages at {1} a second".format(self.options.storm_count, self.options.storm_rate))
+        interval = 1.0 / self.options.storm_rate
+        next_time = self.loop.time()
+        for i in range(0, self.options.storm_count):
+            zone = 1 + (i // 2) % self.options.zones
+            if i % 10 == 9:
+                self.send_now(bytes([0xA7, 0x01, 0x00, zone, 0x03, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x43]), True)
+            else:
+                event = 0x03 if i % 2 == 0 else 0x04           # zone open, zone closed
+                self.send_now(bytes([0xA5, 0x00, 0x04, 0x00, 0x21, zone, event, 0x00, 0x00, 0x00, 0x00, 0x43]), True)
+            next_time = next_time + interval
+            await asyncio.sleep(max(0.0, next_time - self.loop.time()))
+        print("Panel: storm finished")
+        print(self.stats.report())
+
+
+class PtyTransport:
+    """ The transport for the panel end of a pseudo terminal """
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def write(self, data):
+        os.write(self.fd, data)
+
+    def is_closing(self):
+        return False
+
+    def close(self):
+        pass
+
+
+def serve_pty(loop, panel):
+    """ Run the panel on a pseudo terminal, we keep the other end open so that pyvisonic can connect and disconnect """
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    panel.connection_made(PtyTransport(master))
+    loop.add_reader(master, lambda: panel.data_received(os.read(master, 1024)))
+    print("Panel: on pseudo terminal {0}".format(os.ttyname(slave)))
+    return slave
+
+
+async def run_client(options, loop):
+    """ Connect pyvisonic to the panel, wait for it to get in to powerlink and time options.commands commands
+        from calling SendCommandAsync to it returning the reply, this is the command round trip """
+    # Import pyvisonic here, the import starts a new log.txt in the current directory
+    import pyvisonic
+    pyvisonic.log.setLevel(logging.WARNING)
+    transport, protocol = await pyvisonic.create_tcp_visonic_connection(options.host, options.port, loop = loop)
+    start = time.monotonic()
+    state = protocol.GetState()
+    while state.mode != "Powerlink" and time.monotonic() - start < CLIENT_POWERLINK_TIMEOUT:
+        state = await protocol.WaitForVersionAsync(state.version, timeout = CLIENT_POWERLINK_TIMEOUT - (time.monotonic() - start))
+    if state.mode != "Powerlink":
+        print("Client: pyvisonic did not get in to powerlink in {0:.0f} seconds".format(CLIENT_POWERLINK_TIMEOUT))
+    else:
+        print("Client: pyvisonic is in powerlink after {0:.2f} seconds, sending {1} {2} commands".format(time.monotonic() - start, options.commands, CLIENT_COMMAND))
+        round_trip = []
+        failed = 0
+        for i in range(0, options.commands):
+            sent = time.monotonic()
+            try:
+                await protocol.SendCommandAsync(CLIENT_COMMAND)
+                round_trip.append(time.monotonic() - sent)
+            except (pyvisonic.VisonicCommandError, asyncio.TimeoutError) as e:
+                failed = failed + 1
+                print("Client: {0} failed: {1}".format(CLIENT_COMMAND, e))
+        if len(round_trip) > 0:
+            print("  command round trip " + latency_summary(round_trip))
+        print("  commands failed {0}".format(failed))
+    transport.close()
+    # let the panel see the connection close and print its report
+    await asyncio.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "A simulated PowerMax/PowerMaster panel")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 20024)
+    parser.add_argument("--pty", action = "store_true", help = "use a pseudo terminal rather than tcp")
+    parser.add_argument("--eprom", help = "a file with a 64K EPROM image, otherwise a PowerMax Pro with --zones zones is used")
+    parser.add_argument("--zones", type = int, default = 30, help = "the number of enrolled zones in the built in EPROM image")
+    parser.add_argument("--delay", type = float, default = 0.02, help = "seconds the panel takes to reply")
+    parser.add_argument("--keepalive", type = float, default = 25.0, help = "seconds between powerlink keep-alive messages")
+    parser.add_argument("--storm-rate", type = float, default = 10.0, help = "A5/A7 messages a second in the storm")
+    parser.add_argument("--storm-count", type = int, default = 0, help = "the number of messages in the storm after getting to powerlink")
+    parser.add_argument("--deny", type = int, default = 0, help = "deny this many download requests with an access denied (08)")
+    parser.add_argument("--timeout-rate", type = float, default = 0.0, help = "the fraction of commands answered with a timeout (06)")
+    parser.add_argument("--crc-rate", type = float, default = 0.0, help = "the fraction of messages sent with a bad checksum")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--client", action = "store_true", help = "connect pyvisonic to the panel over tcp and report the command round trip, then exit")
+    parser.add_argument("--commands", type = int, default = 20, help = "the number of commands that --client times")
+    options = parser.parse_args()
+    if options.client and options.pty:
+        parser.error("--client connects over tcp, it can't be used with --pty")
+
+    if options.eprom is not None:
+        with open(options.eprom, 'rb') as f:
+            eprom = bytearray(f.read())
+        if len(eprom) != 0x10000:
+            parser.error("the EPROM image must be 64K bytes")
+    else:
+        eprom = make_eprom(zones = options.zones)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    if options.pty:
+        panel = SimulatedPanel(options, eprom)
+        serve_pty(loop, panel)
+    else:
+        server = loop.run_until_complete(loop.create_server(lambda: SimulatedPanel(options, eprom), options.host, options.port))
+        print("Panel: listening on {0} port {1}".format(options.host, options.port))
+    if options.client:
+        loop.run_until_complete(run_client(options, loop))
+        server.close()
+        return 0
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        if options.pty:
+            print(panel.stats.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""Tests for retrieving the pyvisonic event log.
+
+  Run from the repository root:
+      python -m pytest tests
+"""
+
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyvisonic
+
+
+class NullTransport:
+    def write(self, data):
+        pass
+
+
+class EventLogTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.protocol = pyvisonic.VisonicProtocol(loop=self.loop)
+        self.protocol.transport = NullTransport()
+        self.protocol.coordinating_powerlink = False
+        self.protocol.OverrideCode = "1234"
+
+    def tearDown(self):
+        self.protocol.pmTimers.close()
+        self.loop.close()
+
+    def test_second_request_is_rejected(self):
+        async def run():
+            first = self.loop.create_task(self.protocol.GetEventLogAsync(timeout = 0.1))
+            await asyncio.sleep(0)
+            with self.assertRaises(pyvisonic.VisonicCommandError):
+                await self.protocol.GetEventLogAsync(timeout = 0.1)
+            with self.assertRaises(asyncio.TimeoutError):
+                await first
+        self.loop.run_until_complete(run())
+
+    def test_timeout_cancels_the_event_log_reply(self):
+        async def run():
+            with self.assertRaises(asyncio.TimeoutError):
+                await self.protocol.GetEventLogAsync(timeout = 0.1)
+        self.loop.run_until_complete(run())
+        self.assertIsNone(self.protocol.pmEventLogReply)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""Tests for the pyvisonic send queue.
+
+  Run from the repository root:
+      python -m pytest tests
+"""
+
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyvisonic
+
+
+class RecordingTransport:
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+
+class DownloadModeTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.protocol = pyvisonic.VisonicProtocol(loop=self.loop)
+        self.protocol.transport = RecordingTransport()
+        self.protocol.coordinating_powerlink = False
+        self.protocol.pmRemoteDisArm = True
+        self.protocol.OverrideCode = "1234"
+        self.protocol.DownloadMode = True
+
+    def tearDown(self):
+        self.protocol.pmTimers.close()
+        self.loop.close()
+
+    def sent(self):
+        return [data[1] for data in self.protocol.transport.written]
+
+    def test_disarm_is_sent_while_downloading(self):
+        self.protocol.RequestArm("Disarmed")
+        self.assertEqual(self.sent(), [pyvisonic.pmSendMsg["MSG_ARM"].data[0]])
+        self.assertTrue(self.protocol.DownloadMode)
+
+    def test_user_messages_wait_while_downloading(self):
+        self.protocol.SendCommand("MSG_EVENTLOG", options = [4, bytearray.fromhex("1234")])
+        self.assertEqual(self.sent(), [])
+        self.assertEqual(len(self.protocol.SendList), 1)
+
+    def test_download_timeout_ends_download_mode(self):
+        self.protocol.SendCommand("MSG_EVENTLOG", options = [4, bytearray.fromhex("1234")])
+        self.protocol.download_timer()
+        self.assertFalse(self.protocol.DownloadMode)
+        self.assertEqual(self.sent(), [pyvisonic.pmSendMsg["MSG_EVENTLOG"].data[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()